@@ -3,28 +3,33 @@ Ekthaa Business - Backend API Server
 RESTful API for React frontend
 Handles all business operations including customers, transactions, recurring transactions
 """
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify, send_file, stream_with_context, g
 from flask_cors import CORS
 from firebase_utils import FirebaseDB
 from firebase_query import Query
+import ledger_summary
+import delta_sync
+import firebase_stats
+import metrics
+import qr_codes
+import invoice_renderer
+import ledger_export
+import upload_queue
+import recurring_engine
+import image_pipeline
+import phone_index
+import product_search
 import os
+import json
+import time
 import uuid
 import logging
 from functools import wraps
 from werkzeug.utils import secure_filename
 import jwt
 from datetime import datetime, timedelta
-import qrcode
 from io import BytesIO
-import cloudinary
-import cloudinary.uploader
 from dotenv import load_dotenv
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
-from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.enums import TA_LEFT, TA_CENTER, TA_RIGHT
 
 # Load environment variables
 load_dotenv()
@@ -32,26 +37,48 @@ load_dotenv()
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+db_logger = logging.getLogger('firebase.requests')
 
 # Initialize Firebase
 firebase_db = FirebaseDB()
 
-# Initialize Cloudinary
-cloudinary.config(
-    cloud_name=os.getenv('CLOUDINARY_CLOUD_NAME'),
-    api_key=os.getenv('CLOUDINARY_API_KEY'),
-    api_secret=os.getenv('CLOUDINARY_API_SECRET'),
-    secure=True
-)
-
 # File upload configuration
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 MAX_FILE_SIZE = 16 * 1024 * 1024  # 16MB
 
+# Pagination configuration for list endpoints
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+
 def allowed_file(filename):
     """Check if the uploaded file has an allowed extension"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def resolve_receipt_url(receipt_url):
+    """Turn a stored Cloudinary public_id into a full URL; invalid values become ''"""
+    if receipt_url and not receipt_url.startswith('http'):
+        if receipt_url.startswith('bill_receipts/') or '/' in receipt_url:
+            return f"https://res.cloudinary.com/{os.getenv('CLOUDINARY_CLOUD_NAME')}/image/upload/" + receipt_url
+        return ''
+    return receipt_url or ''
+
+def get_pagination_args(args=None):
+    """
+    Read page_size/page_token query parameters (from the current request unless args is given)
+    Returns (page_size, page_token), or None when the client did not ask for pages
+    """
+    args = request.args if args is None else args
+    page_size = args.get('page_size')
+    page_token = args.get('page_token')
+    if page_size is None and page_token is None:
+        return None
+    
+    try:
+        page_size = int(page_size) if page_size else DEFAULT_PAGE_SIZE
+    except ValueError:
+        page_size = DEFAULT_PAGE_SIZE
+    return max(1, min(page_size, MAX_PAGE_SIZE)), page_token
+
 # Create Flask app
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
@@ -64,10 +91,184 @@ CORS(app, resources={
         "origins": "*",  # Allow all origins for mobile access
         "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
         "allow_headers": ["Content-Type", "Authorization"],
+        "expose_headers": ["X-DB-Reads", "X-DB-Calls", "Server-Timing"],
         "supports_credentials": False  # Must be False when using wildcard origins
     }
 })
 
+# Request metrics
+metrics.registry.counter('http_requests_total', 'HTTP requests by method, route and status')
+metrics.registry.histogram('http_request_duration_seconds', 'HTTP request latency by method and route')
+metrics.registry.counter('http_request_errors_total', 'Failed requests; kind is "status" for 4xx/5xx or "error_body" for 2xx responses with an error key')
+metrics.registry.counter('firestore_reads_total', 'Billed Firestore document reads by route')
+metrics.registry.counter('firebase_cache_hits_total', 'FirebaseDB document cache hits')
+metrics.registry.counter('firebase_cache_misses_total', 'FirebaseDB document cache misses')
+metrics.registry.gauge('firebase_cache_hit_ratio', 'FirebaseDB document cache hit ratio')
+metrics.registry.gauge('firebase_cache_entries', 'Documents currently held in the FirebaseDB cache')
+metrics.registry.histogram('cloudinary_upload_duration_seconds', 'Cloudinary upload latency by kind')
+metrics.registry.counter('cloudinary_upload_errors_total', 'Failed Cloudinary uploads by kind')
+metrics.registry.counter('cloudinary_upload_retries_total', 'Background Cloudinary uploads retried by kind')
+metrics.registry.gauge('upload_queue_pending', 'Background uploads queued or in progress')
+metrics.registry.counter('image_bytes_in_total', 'Image bytes received for upload by kind')
+metrics.registry.counter('image_bytes_saved_total', 'Image bytes removed by pre-upload optimization by kind')
+
+def collect_cache_metrics():
+    """Copy the FirebaseDB cache counters into the metrics registry"""
+    stats = firebase_db.cache_stats()
+    metrics.registry.set('firebase_cache_hits_total', value=stats['hits'])
+    metrics.registry.set('firebase_cache_misses_total', value=stats['misses'])
+    metrics.registry.set('firebase_cache_hit_ratio', value=stats['hit_ratio'])
+    metrics.registry.set('firebase_cache_entries', value=stats['entries'])
+    metrics.registry.set('upload_queue_pending', value=upload_queue.pending_uploads())
+
+metrics.registry.add_collector(collect_cache_metrics)
+
+def metric_route():
+    """Route template for metric labels, keeping IDs out of label values"""
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+def response_has_error(response):
+    """Detect failed responses, including handlers that return 200 with an 'error' key"""
+    if response.status_code >= 400:
+        return True
+    # Error bodies are tiny, so large successful payloads are never parsed
+    if not response.is_json or response.direct_passthrough or (response.content_length or 0) > 4096:
+        return False
+    body = response.get_json(silent=True)
+    return isinstance(body, dict) and 'error' in body
+
+@app.before_request
+def start_request_timer():
+    """Remember when the request started for the latency histogram"""
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    """Count the request and record its latency and outcome"""
+    started = g.get('request_started')
+    if started is None:
+        return response
+    
+    route = metric_route()
+    metrics.registry.inc('http_requests_total', {'method': request.method, 'route': route, 'status': str(response.status_code)})
+    metrics.registry.observe('http_request_duration_seconds', {'method': request.method, 'route': route}, time.perf_counter() - started)
+    if response_has_error(response):
+        kind = 'status' if response.status_code >= 400 else 'error_body'
+        metrics.registry.inc('http_request_errors_total', {'method': request.method, 'route': route, 'kind': kind})
+    
+    metrics.registry.maybe_flush()
+    return response
+
+_cloudinary_configured = False
+
+def get_cloudinary_uploader():
+    """
+    Import and configure Cloudinary on first use
+    Reportlab, qrcode and Cloudinary are imported inside the routes that need them,
+    so worker cold starts only pay for them when those routes are hit
+    """
+    global _cloudinary_configured
+    import cloudinary
+    import cloudinary.uploader
+    
+    if not _cloudinary_configured:
+        cloudinary.config(
+            cloud_name=os.getenv('CLOUDINARY_CLOUD_NAME'),
+            api_key=os.getenv('CLOUDINARY_API_KEY'),
+            api_secret=os.getenv('CLOUDINARY_API_SECRET'),
+            secure=True
+        )
+        _cloudinary_configured = True
+    return cloudinary.uploader
+
+def upload_to_cloudinary(file, kind, **options):
+    """Upload a file to Cloudinary, recording latency and failures per kind of upload"""
+    started = time.perf_counter()
+    try:
+        return get_cloudinary_uploader().upload(file, **options)
+    except Exception:
+        metrics.registry.inc('cloudinary_upload_errors_total', {'kind': kind})
+        raise
+    finally:
+        metrics.registry.observe('cloudinary_upload_duration_seconds', {'kind': kind}, time.perf_counter() - started)
+
+def optimize_for_upload(path, kind):
+    """Shrink an image before upload, recording the bytes saved"""
+    output_path, stats = image_pipeline.optimize_image(path)
+    metrics.registry.inc('image_bytes_in_total', {'kind': kind}, stats['original_bytes'])
+    metrics.registry.inc('image_bytes_saved_total', {'kind': kind}, stats['bytes_saved'])
+    logger.info(f"Optimized {kind} image: {stats['original_bytes']} -> {stats['optimized_bytes']} bytes "
+                f"({stats['bytes_saved']} saved, format {stats['format'] or 'unchanged'})")
+    return output_path
+
+def queue_upload(file, kind, options, collection_name, document_id, url_field, status_field,
+                 result_key='secure_url', optimize=False):
+    """
+    Upload a file to Cloudinary in the background
+    With optimize, the image is shrunk by image_pipeline on the upload thread first.
+    When the upload finishes, result[result_key] is written to url_field of the
+    document and status_field goes from 'pending' to 'uploaded' (or 'failed')
+    """
+    def on_success(result):
+        firebase_db.update_document(collection_name, document_id, {
+            url_field: result.get(result_key),
+            status_field: 'uploaded'
+        })
+    
+    def on_failure(error):
+        firebase_db.update_document(collection_name, document_id, {status_field: 'failed'})
+    
+    def on_retry(kind):
+        metrics.registry.inc('cloudinary_upload_retries_total', {'kind': kind})
+    
+    prepare = (lambda path: optimize_for_upload(path, kind)) if optimize else None
+    upload_queue.enqueue(upload_to_cloudinary, file, kind, options, on_success, on_failure, on_retry, prepare)
+
+# Documents whose images are uploaded through queue_upload, with their status field
+QUEUED_UPLOAD_FIELDS = [('transactions', 'receipt_status'), ('products', 'image_status')]
+
+def fail_lost_uploads():
+    """Mark uploads lost with a restarted worker as failed (see upload_queue.fail_stale)"""
+    return upload_queue.fail_stale(firebase_db, QUEUED_UPLOAD_FIELDS)
+
+# Per-request Firestore accounting
+@app.before_request
+def start_db_accounting():
+    """Start recording the Firestore RPCs made by this request"""
+    g.db_stats_token = firebase_stats.start_request()
+
+@app.after_request
+def report_db_accounting(response):
+    """Expose the request's Firestore usage in response headers and a structured log line"""
+    stats = firebase_stats.current_stats()
+    if stats is None:
+        return response
+    
+    summary = stats.summary()
+    if summary['reads']:
+        metrics.registry.inc('firestore_reads_total', {'route': metric_route()}, summary['reads'])
+    response.headers['X-DB-Reads'] = str(summary['reads'])
+    response.headers['X-DB-Calls'] = str(summary['calls'])
+    response.headers.add('Server-Timing', f'firestore;dur={summary["ms"]};desc="{summary["calls"]} RPCs"')
+    
+    if summary['calls']:
+        db_logger.info(json.dumps({
+            'event': 'request_db_usage',
+            'method': request.method,
+            'path': request.path,
+            'endpoint': request.endpoint,
+            'status': response.status_code,
+            **summary
+        }))
+    return response
+
+@app.teardown_request
+def end_db_accounting(exc):
+    """Stop recording Firestore RPCs for this request"""
+    token = g.pop('db_stats_token', None)
+    if token is not None:
+        firebase_stats.end_request(token)
+
 # JWT token helper functions
 def create_access_token(user_id, user_type, business_id=None):
     """Create JWT access token"""
@@ -141,6 +342,16 @@ def health_check():
         'timestamp': datetime.utcnow().isoformat()
     }), 200
 
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus metrics aggregated across all workers"""
+    # Optional bearer token so the endpoint can be scraped without being public
+    metrics_token = os.getenv('METRICS_TOKEN')
+    if metrics_token and request.headers.get('Authorization') != f'Bearer {metrics_token}':
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    return metrics.registry.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
 # ========== Authentication Endpoints ==========
 
 @app.route('/api/auth/register', methods=['POST'])
@@ -159,14 +370,6 @@ def register():
         if not phone_number.isdigit() or len(phone_number) != 10:
             return jsonify({'error': 'Phone number must be exactly 10 digits'}), 400
         
-        # Check if user already exists
-        existing_users = firebase_db.list_documents('users', [
-            Query.equal('phone_number', phone_number)
-        ])
-        
-        if existing_users:
-            return jsonify({'error': 'Phone number already registered'}), 400
-        
         # Create user
         user_id = str(uuid.uuid4())
         from werkzeug.security import generate_password_hash
@@ -176,11 +379,9 @@ def register():
             'phone_number': phone_number,
             'password': generate_password_hash(password),
             'user_type': 'business',
-            'created_at': datetime.now().isoformat()
+            'created_at': datetime.utcnow().isoformat()
         }
         
-        user = firebase_db.create_document('users', user_id, user_data)
-        
         # Generate business PIN (6-digit unique PIN)
         import random
         business_pin = ''.join([str(random.randint(0, 9)) for _ in range(6)])
@@ -193,10 +394,16 @@ def register():
             'phone_number': phone_number,
             'access_pin': business_pin,
             'is_active': True,
-            'created_at': datetime.now().isoformat()
+            'created_at': datetime.utcnow().isoformat()
         }
         
-        business = firebase_db.create_document('businesses', business_id, business_data)
+        # The phone index entry, user and business are created together, so two
+        # registrations racing for the same number cannot both succeed
+        try:
+            if not phone_index.register(firebase_db, phone_number, user_id, user_data, business_id, business_data):
+                return jsonify({'error': 'Registration failed, please try again'}), 500
+        except phone_index.PhoneAlreadyRegistered:
+            return jsonify({'error': 'Phone number already registered'}), 400
         
         # Create access token
         token = create_access_token(user_id, 'business', business_id)
@@ -210,7 +417,7 @@ def register():
                 'user_type': 'business',
                 'business_id': business_id,
                 'business_name': business_name,
-                'business_pin': business.get('access_pin')
+                'business_pin': business_pin
             }
         }), 201
         
@@ -229,16 +436,20 @@ def login():
         if not phone_number or not password:
             return jsonify({'error': 'Phone number and password are required'}), 400
         
-        # Find user
-        users = firebase_db.list_documents('users', [
-            Query.equal('phone_number', phone_number),
-            Query.equal('user_type', 'business')
-        ])
+        # Find user through the phone index
+        entry = phone_index.lookup(firebase_db, phone_number)
         
-        if not users:
+        if not entry or entry.get('user_type') != 'business':
             return jsonify({'error': 'Invalid phone number or password'}), 401
         
-        user = users[0]
+        # Read the user and business together; the password hash and PIN are never served from cache
+        user, business = firebase_db.gather([
+            lambda: firebase_db.get_document('users', entry['user_id'], use_cache=False),
+            lambda: firebase_db.get_document('businesses', entry['business_id'], use_cache=False) if entry.get('business_id') else None
+        ])
+        
+        if not user:
+            return jsonify({'error': 'Invalid phone number or password'}), 401
         
         # Verify password - handle both plain text (legacy) and hashed passwords
         stored_password = user.get('password', '')
@@ -264,16 +475,9 @@ def login():
         if not password_valid:
             return jsonify({'error': 'Invalid phone number or password'}), 401
         
-        # Get business details
-        businesses = firebase_db.list_documents('businesses', [
-            Query.equal('user_id', user['$id'])
-        ])
-        
-        if not businesses:
+        if not business:
             return jsonify({'error': 'Business profile not found'}), 404
         
-        business = businesses[0]
-        
         # Create access token
         token = create_access_token(user['$id'], 'business', business['$id'])
         
@@ -319,7 +523,7 @@ def change_password():
         
         # Get current user
         try:
-            user = firebase_db.get_document('users', request.user_id)
+            user = firebase_db.get_document('users', request.user_id, use_cache=False)
         except Exception as e:
             return jsonify({'error': 'User not found'}), 404
         
@@ -378,119 +582,106 @@ def dashboard():
     try:
         business_id = request.business_id
         
-        # Get business details
-        business = firebase_db.get_document('businesses', business_id)
-        
-        # Get all customers
-        customers = firebase_db.list_documents('customers', [
-            Query.equal('business_id', business_id)
-        ])
-        
-        # Get ALL transactions for accurate calculations (no limit)
-        all_transactions = firebase_db.list_documents('transactions', [
-            Query.equal('business_id', business_id)
-        ])
-        
-        # Get recent transactions for display (limited to 100)
-        transactions = firebase_db.list_documents('transactions', [
-            Query.equal('business_id', business_id),
-            Query.order_desc('created_at'),
-            Query.limit(100)
-        ])
-        
-        # Calculate statistics using ALL transactions
-        total_customers = len(customers)
-        total_credit = sum(float(t.get('amount', 0)) for t in all_transactions if t.get('transaction_type') == 'credit')
-        total_payment = sum(float(t.get('amount', 0)) for t in all_transactions if t.get('transaction_type') == 'payment')
-        
-        # Get customer credits for accurate current balances
-        customer_credits = firebase_db.list_documents('customer_credits', [
-            Query.equal('business_id', business_id)
+        # The dashboard reads are independent, so issue them concurrently:
+        # business details, all customers, the incrementally maintained totals,
+        # recent transactions for display (limited to 100) and customer credits
+        business, customers, summary, transactions, customer_credits = firebase_db.gather([
+            lambda: firebase_db.get_document('businesses', business_id),
+            lambda: firebase_db.list_documents('customers', [
+                Query.equal('business_id', business_id),
+                Query.select(['name', 'phone_number'])
+            ]),
+            lambda: ledger_summary.get_summary(firebase_db, business_id),
+            lambda: firebase_db.list_documents('transactions', [
+                Query.equal('business_id', business_id),
+                Query.order_desc('created_at'),
+                Query.limit(100)
+            ]),
+            lambda: firebase_db.list_documents('customer_credits', [
+                Query.equal('business_id', business_id),
+                Query.select(['customer_id', 'current_balance'])
+            ])
         ])
+        return jsonify(build_dashboard(business_id, business, customers, summary, transactions, customer_credits)), 200
         
-        # Create a map of customer_id -> current_balance and calculate outstanding balance
-        customer_balance_map = {}
-        outstanding_balance = 0
-        for credit in customer_credits:
-            customer_id = credit.get('customer_id')
-            current_balance = credit.get('current_balance', 0)
-            customer_balance_map[customer_id] = current_balance
-            outstanding_balance += current_balance
-        
-        # Get pending payments (customers with positive balance) from customer_credits
-        pending_customers = []
-        for customer in customers:
-            customer_balance = customer_balance_map.get(customer['$id'], 0)
-            
-            if customer_balance > 0:
-                pending_customers.append({
-                    'id': customer['$id'],
-                    'name': customer.get('name'),
-                    'phone_number': customer.get('phone_number'),
-                    'balance': customer_balance
-                })
-        
-        # Get recent transactions (last 10)
-        recent_transactions = transactions[:10] if transactions else []
-        
-        # Get recent customers (based on last transaction date) with their balances
-        recent_customers_list = []
-        
-        # Build a dict of customer_id -> last_transaction_date
-        customer_last_transaction = {}
-        for txn in transactions:
-            cid = txn.get('customer_id')
-            txn_date = txn.get('$createdAt', '')
-            if cid:
-                if cid not in customer_last_transaction or txn_date > customer_last_transaction[cid]:
-                    customer_last_transaction[cid] = txn_date
-        
-        # Sort customers by their last transaction date (most recent first)
-        sorted_customer_ids = sorted(
-            customer_last_transaction.keys(),
-            key=lambda cid: customer_last_transaction[cid],
-            reverse=True
-        )
+    except Exception as e:
+        logger.error(f"Dashboard error: {str(e)}")
+        return jsonify({'error': f'Failed to load dashboard: {str(e)}'}), 500
+
+def build_dashboard(business_id, business, customers, summary, transactions, customer_credits):
+    """Dashboard response body from its independently fetched parts"""
+    customer_balance_map = ledger_summary.balance_map(customer_credits, business_id)
+    
+    # Get pending payments (customers with positive balance) from customer_credits
+    pending_customers = []
+    for customer in customers:
+        customer_balance = customer_balance_map.get(customer['$id'], 0)
         
-        # Take the top 4 and build the response - fetch balance from customer_credits
-        for customer_id in sorted_customer_ids[:4]:
-            # Find the customer object
-            customer = next((c for c in customers if c['$id'] == customer_id), None)
-            if not customer:
-                continue
-            
-            # Get balance from customer_credits collection
-            customer_balance = customer_balance_map.get(customer_id, 0)
-            
-            recent_customers_list.append({
+        if customer_balance > 0:
+            pending_customers.append({
                 'id': customer['$id'],
                 'name': customer.get('name'),
                 'phone_number': customer.get('phone_number'),
                 'balance': customer_balance
             })
-        
-        return jsonify({
-            'business': {
-                'id': business['$id'],
-                'name': business['name'],
-                'phone_number': business.get('phone_number'),
-                'access_pin': business.get('access_pin')
-            },
-            'summary': {
-                'total_customers': total_customers,
-                'total_credit': total_credit,
-                'total_payment': total_payment,
-                'outstanding_balance': outstanding_balance,
-                'pending_customers_count': len(pending_customers),
-                'recent_customers': recent_customers_list
-            },
-            'recent_transactions': recent_transactions,
-            'pending_customers': pending_customers[:5]  # Top 5
-        }), 200
-        
-    except Exception as e:
-        logger.error(f"Dashboard error: {str(e)}")
-        return jsonify({'error': f'Failed to load dashboard: {str(e)}'}), 500
+    
+    # Get recent transactions (last 10)
+    recent_transactions = transactions[:10] if transactions else []
+    
+    # Get recent customers (based on last transaction date) with their balances
+    recent_customers_list = []
+    
+    # Build a dict of customer_id -> last_transaction_date
+    customer_last_transaction = {}
+    for txn in transactions:
+        cid = txn.get('customer_id')
+        txn_date = txn.get('created_at', '')
+        if cid:
+            if cid not in customer_last_transaction or txn_date > customer_last_transaction[cid]:
+                customer_last_transaction[cid] = txn_date
+    
+    # Sort customers by their last transaction date (most recent first)
+    sorted_customer_ids = sorted(
+        customer_last_transaction.keys(),
+        key=lambda cid: customer_last_transaction[cid],
+        reverse=True
+    )
+    
+    # Take the top 4 and build the response - fetch balance from customer_credits
+    for customer_id in sorted_customer_ids[:4]:
+        # Find the customer object
+        customer = next((c for c in customers if c['$id'] == customer_id), None)
+        if not customer:
+            continue
+        
+        # Get balance from customer_credits collection
+        customer_balance = customer_balance_map.get(customer_id, 0)
+        
+        recent_customers_list.append({
+            'id': customer['$id'],
+            'name': customer.get('name'),
+            'phone_number': customer.get('phone_number'),
+            'balance': customer_balance
+        })
+    
+    return {
+        'business': {
+            'id': business['$id'],
+            'name': business['name'],
+            'phone_number': business.get('phone_number'),
+            'access_pin': business.get('access_pin')
+        },
+        'summary': {
+            'total_customers': summary.get('total_customers', len(customers)),
+            'total_credit': summary.get('total_credit', 0),
+            'total_payment': summary.get('total_payment', 0),
+            'outstanding_balance': summary.get('outstanding_balance', 0),
+            'pending_customers_count': summary.get('pending_customers_count', len(pending_customers)),
+            'recent_customers': recent_customers_list
+        },
+        'recent_transactions': recent_transactions,
+        'pending_customers': pending_customers[:5]  # Top 5
+    }
 
 @app.route('/api/business/access-pin', methods=['GET'])
 @token_required
@@ -499,7 +690,7 @@ def get_access_pin():
     """Get business access PIN"""
     try:
         business_id = request.business_id
-        business = firebase_db.get_document('businesses', business_id)
+        business = firebase_db.get_document('businesses', business_id, use_cache=False)
         
         return jsonify({
             'access_pin': business.get('access_pin')
@@ -519,66 +710,86 @@ def get_customers():
     try:
         business_id = request.business_id
         
-        customers = firebase_db.list_documents('customers', [
-            Query.equal('business_id', business_id)
-        ])
-        
-        # Get all transactions to calculate balances dynamically
-        transactions = firebase_db.list_documents('transactions', [
-            Query.equal('business_id', business_id),
-            Query.order_desc('created_at')
+        pagination = get_pagination_args()
+        if pagination:
+            return get_customers_page(business_id, *pagination)
+        
+        # Make sure balances have been backfilled for older businesses
+        ledger_summary.get_summary(firebase_db, business_id)
+        
+        # Balances, counts and last transaction dates are maintained on every
+        # transaction write, so no ledger scan is needed
+        customers, customer_credits = firebase_db.gather([
+            lambda: firebase_db.list_documents('customers', [
+                Query.equal('business_id', business_id),
+                Query.select(['name', 'phone_number'])
+            ]),
+            lambda: firebase_db.list_documents('customer_credits', [
+                Query.equal('business_id', business_id),
+                Query.select(['customer_id', 'current_balance', 'transaction_count', 'last_transaction_at'])
+            ])
         ])
-        
-        # Build maps for balance, last transaction, and transaction count
-        customer_balance_map = {}
-        customer_last_transaction = {}
-        customer_transaction_count = {}
-        
-        for txn in transactions:
-            cid = txn.get('customer_id')
-            txn_date = txn.get('$createdAt', '')
-            amount = float(txn.get('amount', 0))
-            txn_type = txn.get('transaction_type')
-            
-            if cid:
-                # Calculate balance (credit - payment)
-                if cid not in customer_balance_map:
-                    customer_balance_map[cid] = 0
-                
-                if txn_type == 'credit':
-                    customer_balance_map[cid] += amount
-                elif txn_type == 'payment':
-                    customer_balance_map[cid] -= amount
-                
-                # Track last transaction and count
-                if cid not in customer_last_transaction:
-                    customer_last_transaction[cid] = txn_date
-                customer_transaction_count[cid] = customer_transaction_count.get(cid, 0) + 1
-        
-        # Build customer list with calculated balances
-        customer_list = []
-        for customer in customers:
-            customer_id = customer['$id']
-            
-            customer_list.append({
-                'id': customer_id,
-                'name': customer.get('name'),
-                'phone_number': customer.get('phone_number'),
-                'balance': customer_balance_map.get(customer_id, 0),
-                'transaction_count': customer_transaction_count.get(customer_id, 0),
-                'last_transaction_date': customer_last_transaction.get(customer_id, '')
-            })
-        
-        # Sort by last transaction date (most recent first)
-        customer_list.sort(key=lambda c: c.get('last_transaction_date', ''), reverse=True)
-        
-        return jsonify({'customers': customer_list}), 200
+        return jsonify({'customers': build_customer_list(business_id, customers, customer_credits)}), 200
         
     except Exception as e:
         logger.error(f"Get customers error: {str(e)}")
         # Return empty array on error to prevent frontend issues
         return jsonify({'customers': [], 'error': f'Failed to get customers: {str(e)}'}), 200
 
+def build_customer_list(business_id, customers, customer_credits):
+    """Customer list with maintained balances, most recent activity first"""
+    customer_credit_map = ledger_summary.credit_map(customer_credits, business_id)
+    
+    customer_list = [
+        format_customer(customer, customer_credit_map.get(customer['$id']))
+        for customer in customers
+    ]
+    
+    # Sort by last transaction date (most recent first)
+    customer_list.sort(key=lambda c: c.get('last_transaction_date', ''), reverse=True)
+    return customer_list
+
+def build_customer_page(customers, customer_credits):
+    """One page of customers, with credits fetched by their deterministic IDs"""
+    customer_credit_map = {credit['customer_id']: credit for credit in customer_credits.values()}
+    return [
+        format_customer(customer, customer_credit_map.get(customer['$id']))
+        for customer in customers
+    ]
+
+def format_customer(customer, credit):
+    """Build a customer list entry from its customer and customer_credits documents"""
+    credit = credit or {}
+    return {
+        'id': customer['$id'],
+        'name': customer.get('name'),
+        'phone_number': customer.get('phone_number'),
+        'balance': credit.get('current_balance', 0),
+        'transaction_count': credit.get('transaction_count', 0),
+        'last_transaction_date': credit.get('last_transaction_at') or ''
+    }
+
+def get_customers_page(business_id, page_size, page_token):
+    """Get one page of customers (ordered by name) with balances from customer_credits"""
+    try:
+        customers, next_page_token = firebase_db.list_page('customers', [
+            Query.equal('business_id', business_id),
+            Query.order_asc('name')
+        ], page_size, page_token)
+    except ValueError:
+        return jsonify({'error': 'Invalid page token'}), 400
+    
+    # Make sure balances have been backfilled for older businesses
+    ledger_summary.get_summary(firebase_db, business_id)
+    
+    # Maintained credit documents have deterministic IDs, so read them in one batch
+    customer_credits = firebase_db.get_many('customer_credits', [
+        ledger_summary.credit_document_id(business_id, c['$id']) for c in customers
+    ])
+    customer_list = build_customer_page(customers, customer_credits)
+    
+    return jsonify({'customers': customer_list, 'next_page_token': next_page_token}), 200
+
 @app.route('/api/customer/<customer_id>', methods=['GET'])
 @token_required
 @business_required
@@ -638,12 +849,21 @@ def get_customer_transactions(customer_id):
         if customer.get('business_id') != business_id:
             return jsonify({'error': 'Access denied'}), 403
         
-        # Get transactions
-        transactions = firebase_db.list_documents('transactions', [
+        # Get transactions, one page at a time when requested
+        transaction_queries = [
             Query.equal('business_id', business_id),
             Query.equal('customer_id', customer_id),
             Query.order_desc('created_at')
-        ])
+        ]
+        next_page_token = None
+        pagination = get_pagination_args()
+        if pagination:
+            try:
+                transactions, next_page_token = firebase_db.list_page('transactions', transaction_queries, *pagination)
+            except ValueError:
+                return jsonify({'error': 'Invalid page token'}), 400
+        else:
+            transactions = firebase_db.list_documents('transactions', transaction_queries)
         
         # Format transactions with proper id field
         transaction_list = []
@@ -677,9 +897,12 @@ def get_customer_transactions(customer_id):
                 'notes': txn.get('notes'),
                 'created_at': txn.get('created_at'),
                 'receipt_image_url': receipt_url,
+                'receipt_status': txn.get('receipt_status', ''),
                 'created_by': txn.get('created_by')
             })
         
+        if pagination:
+            return jsonify({'transactions': transaction_list, 'next_page_token': next_page_token}), 200
         return jsonify({'transactions': transaction_list}), 200
         
     except Exception as e:
@@ -723,7 +946,10 @@ def add_customer():
             'created_at': datetime.utcnow().isoformat()
         }
         
-        customer = firebase_db.create_document('customers', customer_id, customer_data)
+        customer = ledger_summary.record_customer(firebase_db, customer_id, customer_data)
+        
+        if not customer:
+            return jsonify({'error': 'Failed to add customer'}), 500
         
         return jsonify({
             'message': 'Customer added successfully',
@@ -779,43 +1005,9 @@ def create_transaction():
         # Generate transaction ID first (needed for file upload)
         transaction_id = str(uuid.uuid4())
         
-        # Handle bill image upload
-        bill_image_url = None
-        if 'bill_photo' in request.files:
-            file = request.files['bill_photo']
-            if file and file.filename and allowed_file(file.filename):
-                try:
-                    # Generate unique filename
-                    bill_id = f"bill_{transaction_id}_{uuid.uuid4().hex[:8]}"
-                    
-                    # Upload to Cloudinary
-                    upload_result = cloudinary.uploader.upload(
-                        file,
-                        folder='bill_receipts',
-                        public_id=bill_id,
-                        resource_type='image'
-                    )
-                    logger.info(f"Cloudinary upload result: {upload_result}")
-                    # Store the public_id (not secure_url) so we can construct URL dynamically
-                    bill_image_url = upload_result.get('public_id')
-                    logger.info(f"Stored public_id: {bill_image_url}")
-                except Exception as upload_error:
-                    logger.error(f"Image upload error: {str(upload_error)}")
-        elif 'bill_image' in request.files:
-            # Fallback for old field name
-            file = request.files['bill_image']
-            if file and file.filename and allowed_file(file.filename):
-                try:
-                    bill_id = f"bill_{transaction_id}_{uuid.uuid4().hex[:8]}"
-                    upload_result = cloudinary.uploader.upload(
-                        file,
-                        folder='bill_receipts',
-                        public_id=bill_id,
-                        resource_type='image'
-                    )
-                    bill_image_url = upload_result.get('public_id')
-                except Exception as upload_error:
-                    logger.error(f"Image upload error: {str(upload_error)}")
+        # Bill image, with bill_image as the old field name
+        bill_file = request.files['bill_photo'] if 'bill_photo' in request.files else request.files.get('bill_image')
+        has_bill = bool(bill_file and bill_file.filename and allowed_file(bill_file.filename))
         
         # Get created_by from request, default to 'business' if not provided
         if request.is_json:
@@ -829,15 +1021,35 @@ def create_transaction():
             'transaction_type': transaction_type,
             'amount': amount,
             'notes': notes,
-            'receipt_image_url': bill_image_url or '',
+            'receipt_image_url': '',
             'created_by': created_by,  # Use from request or default
             'created_at': datetime.utcnow().isoformat()
         }
+        if has_bill:
+            # The receipt's public_id is filled in once the background upload finishes
+            transaction_data['receipt_status'] = 'pending'
         
-        logger.info(f"Creating transaction with receipt_image_url: {transaction_data.get('receipt_image_url')}")
-        transaction = firebase_db.create_document('transactions', transaction_id, transaction_data)
+        # Write the transaction, customer balance and business summary atomically
+        transaction = ledger_summary.record_transaction(firebase_db, transaction_id, transaction_data)
         logger.info(f"Created transaction document: {transaction}")
         
+        if not transaction:
+            return jsonify({'error': 'Failed to record transaction'}), 500
+        
+        if has_bill:
+            try:
+                # Store the public_id (not secure_url) so we can construct URL dynamically
+                queue_upload(bill_file, 'bill', {
+                    'folder': 'bill_receipts',
+                    'public_id': f"bill_{transaction_id}_{uuid.uuid4().hex[:8]}",
+                    'resource_type': 'image'
+                }, 'transactions', transaction_id, 'receipt_image_url', 'receipt_status',
+                   result_key='public_id', optimize=True)
+            except Exception as upload_error:
+                logger.error(f"Image upload error: {str(upload_error)}")
+                firebase_db.update_document('transactions', transaction_id, {'receipt_status': 'failed'})
+                transaction['receipt_status'] = 'failed'
+        
         return jsonify({
             'message': f'{transaction_type.capitalize()} recorded successfully',
             'transaction': transaction
@@ -847,6 +1059,28 @@ def create_transaction():
         logger.error(f"Create transaction error: {str(e)}")
         return jsonify({'error': f'Failed to create transaction: {str(e)}'}), 500
 
+def format_transaction_list(transactions, customer_map):
+    """Transaction list entries with customer names and resolved receipt URLs"""
+    transaction_list = []
+    
+    for txn in transactions:
+        # Only construct URL if it's a valid Cloudinary public_id
+        receipt_url = resolve_receipt_url(txn.get('receipt_image_url', ''))
+        
+        transaction_list.append({
+            'id': txn['$id'],
+            'customer_id': txn.get('customer_id'),
+            'customer_name': customer_map.get(txn.get('customer_id'), 'Unknown'),
+            'amount': txn.get('amount'),
+            'transaction_type': txn.get('transaction_type'),
+            'notes': txn.get('notes'),
+            'created_at': txn.get('created_at'),
+            'receipt_image_url': receipt_url,
+            'receipt_status': txn.get('receipt_status', ''),
+            'created_by': txn.get('created_by')
+        })
+    return transaction_list
+
 @app.route('/api/transactions', methods=['GET'])
 @token_required
 @business_required
@@ -855,45 +1089,36 @@ def get_all_transactions():
     try:
         business_id = request.business_id
         
-        transactions = firebase_db.list_documents('transactions', [
+        transaction_queries = [
             Query.equal('business_id', business_id),
             Query.order_desc('created_at')
-        ])
-        
-        # Get customer names
-        customers = firebase_db.list_documents('customers', [
-            Query.equal('business_id', business_id)
-        ])
-        customer_map = {c['$id']: c.get('name', 'Unknown') for c in customers}
-        
-        # Format transactions
-        transaction_list = []
-        cloudinary_base = f"https://res.cloudinary.com/{os.getenv('CLOUDINARY_CLOUD_NAME')}/image/upload/"
-        
-        for txn in transactions:
-            receipt_url = txn.get('receipt_image_url', '')
+        ]
+        next_page_token = None
+        pagination = get_pagination_args()
+        if pagination:
+            try:
+                transactions, next_page_token = firebase_db.list_page('transactions', transaction_queries, *pagination)
+            except ValueError:
+                return jsonify({'error': 'Invalid page token'}), 400
             
-            # Only construct URL if it's a valid Cloudinary public_id
-            if receipt_url and not receipt_url.startswith('http'):
-                if receipt_url.startswith('bill_receipts/') or '/' in receipt_url:
-                    receipt_url = cloudinary_base + receipt_url
-                else:
-                    receipt_url = ''
-            elif receipt_url and not receipt_url.startswith('http'):
-                receipt_url = ''
-                
-            transaction_list.append({
-                'id': txn['$id'],
-                'customer_id': txn.get('customer_id'),
-                'customer_name': customer_map.get(txn.get('customer_id'), 'Unknown'),
-                'amount': txn.get('amount'),
-                'transaction_type': txn.get('transaction_type'),
-                'notes': txn.get('notes'),
-                'created_at': txn.get('created_at'),
-                'receipt_image_url': receipt_url,
-                'created_by': txn.get('created_by')
-            })
+            # Only look up the customers that appear on this page
+            customers = firebase_db.get_many('customers', [t.get('customer_id') for t in transactions])
+            customer_map = {cid: c.get('name', 'Unknown') for cid, c in customers.items()}
+        else:
+            # Get transactions and customer names concurrently
+            transactions, customers = firebase_db.gather([
+                lambda: firebase_db.list_documents('transactions', transaction_queries),
+                lambda: firebase_db.list_documents('customers', [
+                    Query.equal('business_id', business_id),
+                    Query.select(['name'])
+                ])
+            ])
+            customer_map = {c['$id']: c.get('name', 'Unknown') for c in customers}
         
+        transaction_list = format_transaction_list(transactions, customer_map)
+        
+        if pagination:
+            return jsonify({'transactions': transaction_list, 'next_page_token': next_page_token}), 200
         return jsonify({'transactions': transaction_list}), 200
         
     except Exception as e:
@@ -924,6 +1149,105 @@ def get_bill_image(transaction_id):
         logger.error(f"Get bill image error: {str(e)}")
         return jsonify({'error': f'Failed to get bill image: {str(e)}'}), 500
 
+@app.route('/api/sync', methods=['GET'])
+@token_required
+@business_required
+def sync_changes():
+    """Get ledger changes since the client's last sync token (everything without one)"""
+    try:
+        business_id = request.business_id
+        
+        since = None
+        overlap = True
+        pages = None
+        cursors = None
+        sync_token = request.args.get('since')
+        if sync_token:
+            decoded = delta_sync.decode_sync_token(sync_token)
+            if not decoded:
+                return jsonify({'error': 'Invalid sync token'}), 400
+            since, overlap, pages, cursors = decoded
+        
+        result = delta_sync.collect_changes(firebase_db, business_id, since, overlap, pages, cursors)
+        
+        for txn in result['changes']['transactions']:
+            txn['receipt_image_url'] = resolve_receipt_url(txn.get('receipt_image_url', ''))
+        
+        return jsonify(result), 200
+        
+    except Exception as e:
+        logger.error(f"Sync error: {str(e)}")
+        return jsonify({'error': f'Failed to sync: {str(e)}'}), 500
+
+# ========== Export Endpoints ==========
+
+def export_response(name, rows, columns):
+    """
+    Stream export rows as ?format=csv (default) or ?format=ndjson
+    Rows are produced lazily, so reads happen while the response is being sent
+    """
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in ledger_export.FORMATS:
+        return jsonify({'error': f"format must be one of: {', '.join(ledger_export.FORMATS)}"}), 400
+    
+    filename = f"{name}_{datetime.utcnow().strftime('%Y%m%d')}.{export_format}"
+    return Response(
+        stream_with_context(ledger_export.stream_rows(rows, columns, export_format)),
+        mimetype=ledger_export.FORMATS[export_format],
+        headers={
+            'Content-Disposition': f'attachment; filename="{filename}"',
+            # Ask reverse proxies to pass chunks through instead of buffering the export
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+@app.route('/api/export/transactions', methods=['GET'])
+@token_required
+@business_required
+def export_transactions():
+    """Export the ledger, optionally for a date range (start_date/end_date) and customer_id"""
+    try:
+        business_id = request.business_id
+        
+        date_range, error = ledger_export.parse_date_range(request.args)
+        if error:
+            return jsonify({'error': error}), 400
+        
+        rows = ledger_export.transaction_rows(
+            firebase_db, business_id, resolve_receipt_url, *date_range, customer_id=request.args.get('customer_id')
+        )
+        return export_response('transactions', rows, ledger_export.TRANSACTION_COLUMNS)
+        
+    except Exception as e:
+        logger.error(f"Export transactions error: {str(e)}")
+        return jsonify({'error': f'Failed to export transactions: {str(e)}'}), 500
+
+@app.route('/api/export/customers', methods=['GET'])
+@token_required
+@business_required
+def export_customers():
+    """Export customers with their balances"""
+    try:
+        rows = ledger_export.customer_rows(firebase_db, request.business_id)
+        return export_response('customers', rows, ledger_export.CUSTOMER_COLUMNS)
+        
+    except Exception as e:
+        logger.error(f"Export customers error: {str(e)}")
+        return jsonify({'error': f'Failed to export customers: {str(e)}'}), 500
+
+@app.route('/api/export/products', methods=['GET'])
+@token_required
+@business_required
+def export_products():
+    """Export the product catalog"""
+    try:
+        rows = ledger_export.product_rows(firebase_db, request.business_id)
+        return export_response('products', rows, ledger_export.PRODUCT_COLUMNS)
+        
+    except Exception as e:
+        logger.error(f"Export products error: {str(e)}")
+        return jsonify({'error': f'Failed to export products: {str(e)}'}), 500
+
 # ========== Recurring Transactions Endpoints ==========
 
 @app.route('/api/recurring-transactions', methods=['GET'])
@@ -941,7 +1265,8 @@ def get_recurring_transactions():
         
         # Get customer names
         customers = firebase_db.list_documents('customers', [
-            Query.equal('business_id', business_id)
+            Query.equal('business_id', business_id),
+            Query.select(['name'])
         ])
         customer_map = {c['$id']: c.get('name', 'Unknown') for c in customers}
         
@@ -1025,9 +1350,13 @@ def toggle_recurring_transaction(recurring_id):
         
         # Toggle is_active
         new_status = not recurring_transaction.get('is_active', False)
-        firebase_db.update_document('recurring_transactions', recurring_id, {
-            'is_active': new_status
-        })
+        update_data = {'is_active': new_status}
+        if new_status:
+            # Resume from the next period instead of billing the ones missed while paused
+            update_data['next_execution_date'] = recurring_engine.resume_date(
+                recurring_transaction, datetime.utcnow()
+            ).isoformat()
+        firebase_db.update_document('recurring_transactions', recurring_id, update_data)
         
         return jsonify({
             'message': f'Recurring transaction {"activated" if new_status else "deactivated"} successfully',
@@ -1078,23 +1407,19 @@ def get_profile():
         logger.info(f"📱 Phone: {business.get('phone_number')}")
         logger.info(f"🆔 Business ID: {business['$id']}")
         
-        # Get customer count
-        customers = firebase_db.list_documents(
+        # Get customer and transaction counts with aggregation queries
+        total_customers = firebase_db.count(
             'customers',
             [Query.equal('business_id', business_id)]
         )
-        total_customers = len(customers)
-        
-        # Get transaction count
-        transactions = firebase_db.list_documents(
+        total_transactions = firebase_db.count(
             'transactions',
             [Query.equal('business_id', business_id)]
         )
-        total_transactions = len(transactions)
         
         # Add stats to business data
-        business['total_customers'] = total_customers
-        business['total_transactions'] = total_transactions
+        business['total_customers'] = total_customers or 0
+        business['total_transactions'] = total_transactions or 0
         
         # Ensure profile_photo_url is included (even if None)
         if 'profile_photo_url' not in business:
@@ -1228,7 +1553,7 @@ def update_location():
         update_data = {
             'latitude': lat,
             'longitude': lng,
-            'location_updated_at': datetime.now().isoformat()
+            'location_updated_at': datetime.utcnow().isoformat()
         }
         
         business = firebase_db.update_document('businesses', business_id, update_data)
@@ -1291,6 +1616,9 @@ def regenerate_pin():
             'access_pin': new_pin
         })
         
+        # QR codes embed the PIN
+        qr_codes.invalidate_business(business_id)
+        
         return jsonify({
             'message': 'PIN regenerated successfully',
             'pin': new_pin
@@ -1324,9 +1652,10 @@ def upload_profile_photo():
             # Generate unique filename
             photo_id = f"profile_{business_id}_{uuid.uuid4().hex[:8]}"
             
-            # Upload to Cloudinary
-            upload_result = cloudinary.uploader.upload(
+            # Upload to Cloudinary while the client waits: the response returns the URL
+            upload_result = upload_to_cloudinary(
                 file,
+                'profile_photo',
                 folder='business_profiles',
                 public_id=photo_id,
                 resource_type='image',
@@ -1359,6 +1688,42 @@ def upload_profile_photo():
         logger.error(f"Upload profile photo error: {str(e)}")
         return jsonify({'error': f'Failed to upload profile photo: {str(e)}'}), 500
 
+def qr_image_response(business_id, pin, data, default_fill_color, error_correction):
+    """
+    Serve a cached QR image with an ETag, answering 304 when the client already has it
+    Query parameters: fill, back (hex colors), size (pixels per module), format (png or svg)
+    """
+    fill_color = qr_codes.normalize_color(request.args.get('fill')) if request.args.get('fill') else default_fill_color
+    back_color = qr_codes.normalize_color(request.args.get('back')) if request.args.get('back') else '#ffffff'
+    if not fill_color or not back_color:
+        return jsonify({'error': 'Colors must be hex values like #7c3aed'}), 400
+    
+    image_format = request.args.get('format', 'png').lower()
+    if image_format not in qr_codes.IMAGE_FORMATS:
+        return jsonify({'error': 'Format must be png or svg'}), 400
+    
+    try:
+        box_size = int(request.args.get('size', 10))
+    except ValueError:
+        return jsonify({'error': 'Size must be a number'}), 400
+    box_size = max(qr_codes.MIN_BOX_SIZE, min(box_size, qr_codes.MAX_BOX_SIZE))
+    
+    etag, content, mimetype = qr_codes.get_qr_image(
+        business_id, pin, data,
+        fill_color=fill_color,
+        back_color=back_color,
+        box_size=box_size,
+        error_correction=error_correction,
+        image_format=image_format,
+        if_none_match=request.if_none_match
+    )
+    
+    response = Response(content, status=200, mimetype=mimetype) if content is not None else Response(status=304)
+    response.set_etag(etag)
+    # The image embeds the PIN, so keep it out of shared caches and revalidate on every use
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
 @app.route('/api/profile/qr', methods=['GET'])
 @token_required
 @business_required
@@ -1367,30 +1732,15 @@ def generate_qr():
     try:
         business_id = request.business_id
         
-        business = firebase_db.get_document('businesses', business_id)
+        # The PIN is part of the image cache key, so never read it from a stale cache entry
+        business = firebase_db.get_document('businesses', business_id, use_cache=False)
         pin = business.get('pin')
         
         if not pin:
             return jsonify({'error': 'Business PIN not found'}), 404
         
-        # Generate QR code
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(pin)
-        qr.make(fit=True)
-        
-        img = qr.make_image(fill_color="black", back_color="white")
-        
-        # Convert to bytes
-        img_io = BytesIO()
-        img.save(img_io, 'PNG')
-        img_io.seek(0)
-        
-        return send_file(img_io, mimetype='image/png')
+        # Serve the cached QR code (rendered on first request)
+        return qr_image_response(business_id, pin, pin, '#000000', 'L')
         
     except Exception as e:
         logger.error(f"Generate QR error: {str(e)}")
@@ -1404,7 +1754,8 @@ def get_business_qr_code():
     try:
         business_id = request.business_id
         
-        business = firebase_db.get_document('businesses', business_id)
+        # The PIN is part of the image cache key, so never read it from a stale cache entry
+        business = firebase_db.get_document('businesses', business_id, use_cache=False)
         access_pin = business.get('access_pin')
         
         if not access_pin:
@@ -1413,24 +1764,8 @@ def get_business_qr_code():
         # Create QR data with business ID and PIN
         qr_data = f"KATHAPE_BUSINESS:{business_id}:{access_pin}"
         
-        # Generate QR code
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_H,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(qr_data)
-        qr.make(fit=True)
-        
-        img = qr.make_image(fill_color="#7c3aed", back_color="white")
-        
-        # Convert to bytes
-        img_io = BytesIO()
-        img.save(img_io, 'PNG')
-        img_io.seek(0)
-        
-        return send_file(img_io, mimetype='image/png', as_attachment=False)
+        # Serve the cached QR code (rendered on first request)
+        return qr_image_response(business_id, access_pin, qr_data, '#7c3aed', 'H')
         
     except Exception as e:
         logger.error(f"Generate business QR code error: {str(e)}")
@@ -1455,11 +1790,7 @@ def remind_customer(customer_id):
         business = firebase_db.get_document('businesses', business_id)
         
         # Get credit relationship for balance
-        credit_docs = firebase_db.list_documents('customer_credits', [
-            Query.equal('business_id', business_id),
-            Query.equal('customer_id', customer_id)
-        ])
-        credit = credit_docs[0] if credit_docs else {}
+        credit = ledger_summary.get_customer_credit(firebase_db, business_id, customer_id)
         balance = credit.get('current_balance', 0)
         
         # Clean and format phone number
@@ -1505,8 +1836,6 @@ def remind_all_customers():
     """Get list of all customers with WhatsApp reminder URLs"""
     try:
         business_id = request.business_id
-        import re
-        import urllib.parse
         
         # Get business details
         business = firebase_db.get_document('businesses', business_id)
@@ -1514,52 +1843,64 @@ def remind_all_customers():
         
         # Get all customer credits with positive balance
         customer_credits = firebase_db.list_documents('customer_credits', [
-            Query.equal('business_id', business_id)
+            Query.equal('business_id', business_id),
+            Query.select(['customer_id', 'current_balance'])
         ])
         
-        customers_to_remind = []
-        for credit in customer_credits:
-            balance = credit.get('current_balance', 0)
-            if balance > 0:
-                customer_id = credit.get('customer_id')
-                customer = firebase_db.get_document('customers', customer_id)
-                
-                if customer:
-                    # Clean and format phone number
-                    phone_number = customer.get('phone_number', '')
-                    clean_phone = re.sub(r'\D', '', phone_number)
-                    if clean_phone and not clean_phone.startswith('91'):
-                        if clean_phone.startswith('0'):
-                            clean_phone = '91' + clean_phone[1:]
-                        elif len(clean_phone) == 10:
-                            clean_phone = '91' + clean_phone
-                    
-                    # Generate reminder message
-                    customer_name = customer.get('name', 'Customer')
-                    message = f"Hello {customer_name},\n\nJust a reminder about your outstanding balance of ₹{balance:,.2f} with {business_name}.\n\nThank you!"
-                    
-                    # Create WhatsApp URL
-                    encoded_message = urllib.parse.quote(message)
-                    whatsapp_url = f"https://wa.me/{clean_phone}?text={encoded_message}"
-                    
-                    customers_to_remind.append({
-                        'id': customer_id,
-                        'name': customer_name,
-                        'phone_number': customer.get('phone_number', ''),
-                        'balance': balance,
-                        'whatsapp_url': whatsapp_url
-                    })
+        customer_balance_map = ledger_summary.balance_map(customer_credits, business_id)
+        debtor_ids = [cid for cid, balance in customer_balance_map.items() if balance > 0]
         
-        return jsonify({
-            'customers': customers_to_remind,
-            'count': len(customers_to_remind),
-            'business_name': business_name
-        }), 200
+        # Fetch all debtors in batched reads instead of one round trip each
+        debtors = firebase_db.get_many('customers', debtor_ids, parallel=True)
+        
+        return jsonify(build_reminders(business_name, customer_balance_map, debtor_ids, debtors)), 200
         
     except Exception as e:
         logger.error(f"Get bulk reminders error: {str(e)}")
         return jsonify({'error': f'Failed to get reminders: {str(e)}'}), 500
 
+def build_reminders(business_name, customer_balance_map, debtor_ids, debtors):
+    """WhatsApp reminder links for every customer with an outstanding balance"""
+    import re
+    import urllib.parse
+    
+    customers_to_remind = []
+    for customer_id in debtor_ids:
+        balance = customer_balance_map[customer_id]
+        customer = debtors.get(customer_id)
+        
+        if customer:
+            # Clean and format phone number
+            phone_number = customer.get('phone_number', '')
+            clean_phone = re.sub(r'\D', '', phone_number)
+            if clean_phone and not clean_phone.startswith('91'):
+                if clean_phone.startswith('0'):
+                    clean_phone = '91' + clean_phone[1:]
+                elif len(clean_phone) == 10:
+                    clean_phone = '91' + clean_phone
+            
+            # Generate reminder message
+            customer_name = customer.get('name', 'Customer')
+            message = f"Hello {customer_name},\n\nJust a reminder about your outstanding balance of ₹{balance:,.2f} with {business_name}.\n\nThank you!"
+            
+            # Create WhatsApp URL
+            encoded_message = urllib.parse.quote(message)
+            whatsapp_url = f"https://wa.me/{clean_phone}?text={encoded_message}"
+            
+            customers_to_remind.append({
+                'id': customer_id,
+                'name': customer_name,
+                'phone_number': customer.get('phone_number', ''),
+                'balance': balance,
+                'whatsapp_url': whatsapp_url
+            })
+    
+    return {
+        'customers': customers_to_remind,
+        'count': len(customers_to_remind),
+        'business_name': business_name
+    }
+
 # ============================================================================
 # PRODUCTS / INVENTORY MANAGEMENT
 # ============================================================================
@@ -1576,23 +1917,29 @@ def get_products():
         search = request.args.get('search')
         is_public = request.args.get('is_public')
         
-        # Build queries
-        queries = [Query.equal('business_id', business_id)]
-        
-        if category:
-            queries.append(Query.equal('category', category))
-        
-        if is_public is not None:
-            queries.append(Query.equal('is_public', is_public == 'true'))
-        
         if search:
-            queries.append(Query.search('name', search))
-        
-        # Get products
-        products = firebase_db.list_documents(
-            'products',
-            queries
-        )
+            # Ranked matches from the search index; other filters apply to the matches
+            matches, truncated = product_search.search(firebase_db, business_id, search)
+            products = [
+                product for product in matches
+                if (not category or product.get('category') == category)
+                and (is_public is None or product.get('is_public') == (is_public == 'true'))
+            ]
+        else:
+            # Build queries
+            queries = [Query.equal('business_id', business_id)]
+            
+            if category:
+                queries.append(Query.equal('category', category))
+            
+            if is_public is not None:
+                queries.append(Query.equal('is_public', is_public == 'true'))
+            
+            # Get products
+            products = firebase_db.list_documents(
+                'products',
+                queries
+            )
         
         # Format products
         products_list = []
@@ -1611,15 +1958,19 @@ def get_products():
                 'is_public': doc['is_public'],
                 'low_stock_threshold': doc.get('low_stock_threshold', 10),
                 'is_low_stock': doc['stock_quantity'] <= doc.get('low_stock_threshold', 10),
-                'created_at': doc['$createdAt'],
-                'updated_at': doc['$updatedAt']
+                'created_at': doc.get('created_at', ''),
+                'updated_at': doc.get('updated_at', '')
             }
             products_list.append(product)
         
-        return jsonify({
+        response = {
             'products': products_list,
             'count': len(products_list)
-        }), 200
+        }
+        if search:
+            # True when a very common search word matched more products than a search reads
+            response['truncated'] = truncated
+        return jsonify(response), 200
         
     except Exception as e:
         logger.error(f"Get products error: {str(e)}")
@@ -1660,20 +2011,6 @@ def add_product():
         except ValueError:
             return jsonify({'error': 'Invalid number format for stock or price'}), 400
         
-        # Upload image to Cloudinary if provided
-        product_image_url = ''
-        if product_image:
-            try:
-                upload_result = cloudinary.uploader.upload(
-                    product_image,
-                    folder=f"kathape/products/{business_id}",
-                    resource_type="image"
-                )
-                product_image_url = upload_result['secure_url']
-                logger.info(f"Product image uploaded: {product_image_url}")
-            except Exception as e:
-                logger.error(f"Cloudinary upload error: {str(e)}")
-        
         # Handle is_public field (can be bool or string)
         is_public_value = data.get('is_public', False)
         if isinstance(is_public_value, str):
@@ -1692,15 +2029,30 @@ def add_product():
             'unit': data['unit'].strip(),
             'price': price,
             'hsn_code': data.get('hsn_code', '').strip(),
-            'product_image_url': product_image_url,
+            'product_image_url': '',
             'is_public': is_public,
             'low_stock_threshold': int(data.get('low_stock_threshold', 10))
         }
+        product_data.update(product_search.index_fields(product_data))
+        if product_image:
+            # product_image_url is filled in once the background upload finishes
+            product_data['image_status'] = 'pending'
         
         # Save to database
         product_id = str(uuid.uuid4())
         result = firebase_db.create_document('products', product_id, product_data)
         
+        if product_image:
+            try:
+                queue_upload(product_image, 'product', {
+                    'folder': f"kathape/products/{business_id}",
+                    'resource_type': 'image'
+                }, 'products', product_id, 'product_image_url', 'image_status', optimize=True)
+            except Exception as e:
+                logger.error(f"Cloudinary upload error: {str(e)}")
+                firebase_db.update_document('products', product_id, {'image_status': 'failed'})
+                result['image_status'] = 'failed'
+        
         product = {
             'id': result['$id'],
             'name': result['name'],
@@ -1714,7 +2066,8 @@ def add_product():
             'product_image_url': result.get('product_image_url', ''),
             'is_public': result['is_public'],
             'low_stock_threshold': result.get('low_stock_threshold', 10),
-            'created_at': result['$createdAt']
+            'image_status': result.get('image_status', ''),
+            'created_at': result.get('created_at', '')
         }
         
         return jsonify({
@@ -1754,8 +2107,8 @@ def get_product(product_id):
             'is_public': doc['is_public'],
             'low_stock_threshold': doc.get('low_stock_threshold', 10),
             'is_low_stock': doc['stock_quantity'] <= doc.get('low_stock_threshold', 10),
-            'created_at': doc['$createdAt'],
-            'updated_at': doc['$updatedAt']
+            'created_at': doc.get('created_at', ''),
+            'updated_at': doc.get('updated_at', '')
         }
         
         return jsonify({'product': product}), 200
@@ -1809,6 +2162,10 @@ def update_product(product_id):
         if not update_data:
             return jsonify({'error': 'No valid fields to update'}), 400
         
+        # Keep the search index in step with renamed or recategorised products
+        if product_search.needs_reindex(update_data):
+            update_data.update(product_search.index_fields({**doc, **update_data}))
+        
         # Update product
         result = firebase_db.update_document('products', product_id, update_data)
         
@@ -1827,7 +2184,7 @@ def update_product(product_id):
             'product_image_url': result.get('product_image_url', ''),
             'is_public': result.get('is_public', False),
             'low_stock_threshold': result.get('low_stock_threshold', 10),
-            'updated_at': result.get('$updatedAt', '')
+            'updated_at': result.get('updated_at', '')
         }
         
         return jsonify({
@@ -1852,8 +2209,8 @@ def delete_product(product_id):
         if doc['business_id'] != business_id:
             return jsonify({'error': 'Unauthorized access to product'}), 403
         
-        # Delete product
-        firebase_db.delete_document('products', product_id)
+        # Delete product and leave a tombstone for syncing clients
+        delta_sync.record_deletion(firebase_db, 'products', doc)
         
         return jsonify({'message': 'Product deleted successfully'}), 200
         
@@ -2058,8 +2415,8 @@ def delete_voucher(voucher_id):
         if not voucher or voucher.get('business_id') != business_id:
             return jsonify({'error': 'Voucher not found'}), 404
         
-        # Delete voucher
-        firebase_db.delete_document('vouchers', voucher_id)
+        # Delete voucher and leave a tombstone for syncing clients
+        delta_sync.record_deletion(firebase_db, 'vouchers', voucher)
         
         return jsonify({'message': 'Voucher deleted successfully'}), 200
         
@@ -2245,8 +2602,8 @@ def delete_offer(offer_id):
         if not offer or offer.get('business_id') != business_id:
             return jsonify({'error': 'Offer not found'}), 404
         
-        # Delete offer
-        firebase_db.delete_document('offers', offer_id)
+        # Delete offer and leave a tombstone for syncing clients
+        delta_sync.record_deletion(firebase_db, 'offers', offer)
         
         return jsonify({'message': 'Offer deleted successfully'}), 200
         
@@ -2258,206 +2615,47 @@ def delete_offer(offer_id):
 # INVOICE GENERATION
 # ============================================================================
 
-def number_to_words(num):
-    """Convert number to words (Indian format)"""
-    try:
-        if not isinstance(num, int):
-            num = int(num)
-    except Exception:
-        return str(num)
-
-    if num < 0:
-        return 'Minus ' + number_to_words(abs(num))
-
-    ones = ['', 'One', 'Two', 'Three', 'Four', 'Five', 'Six', 'Seven', 'Eight', 'Nine']
-    tens = ['', '', 'Twenty', 'Thirty', 'Forty', 'Fifty', 'Sixty', 'Seventy', 'Eighty', 'Ninety']
-    teens = ['Ten', 'Eleven', 'Twelve', 'Thirteen', 'Fourteen', 'Fifteen', 'Sixteen', 'Seventeen', 'Eighteen', 'Nineteen']
-
-    def convert_below_thousand(n):
-        if n == 0:
-            return ''
-        elif n < 10:
-            return ones[n]
-        elif n < 20:
-            return teens[n - 10]
-        elif n < 100:
-            return tens[n // 10] + (' ' + ones[n % 10] if n % 10 != 0 else '')
-        else:
-            return ones[n // 100] + ' Hundred' + (' ' + convert_below_thousand(n % 100) if n % 100 != 0 else '')
-
-    if num == 0:
-        return 'Zero'
-    elif num < 1000:
-        return convert_below_thousand(num)
-    elif num < 100000:
-        return convert_below_thousand(num // 1000) + ' Thousand' + (' ' + convert_below_thousand(num % 1000) if num % 1000 != 0 else '')
-    elif num < 10000000:
-        return convert_below_thousand(num // 100000) + ' Lakh' + (' ' + convert_below_thousand(num % 100000) if num % 100000 != 0 else '')
-    elif num < 1000000000:
-        return convert_below_thousand(num // 10000000) + ' Crore' + (' ' + convert_below_thousand(num % 10000000) if num % 10000000 != 0 else '')
-    else:
-        return str(num)
-
-def create_invoice_pdf(data):
-    """Generate tax invoice PDF"""
-    try:
-        buffer = BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=30, leftMargin=30, topMargin=30, bottomMargin=30)
-        elements = []
-        styles = getSampleStyleSheet()
-        
-        # Title
-        title_style = ParagraphStyle('Title', parent=styles['Heading1'], fontSize=18, textColor=colors.HexColor('#000000'),
-                                    alignment=TA_CENTER, spaceAfter=20, fontName='Helvetica-Bold')
-        elements.append(Paragraph("TAX INVOICE", title_style))
-        elements.append(Spacer(1, 10))
-        
-        # Invoice details
-        invoice_date = datetime.now().strftime("%d-%b-%y")
-        invoice_number = f"2025-26/{datetime.now().strftime('%m%d%H%M')}"
-        
-        # Header table
-        seller_info = f"""<b>{data.get('seller_name', '')}</b><br/>{data.get('seller_address', '')}<br/>
-        {data.get('seller_city', '')}, {data.get('seller_state', '')} - {data.get('seller_pincode', '')}<br/>
-        GSTIN/UIN: {data.get('seller_gstin', '')}<br/>
-        State Name: {data.get('seller_state_name', '')}, Code: {data.get('seller_state_code', '')}"""
-        
-        buyer_info = f"""<b>{data.get('buyer_name', '')}</b><br/>{data.get('buyer_address', '')}<br/>
-        {data.get('buyer_city', '')}, {data.get('buyer_state', '')} - {data.get('buyer_pincode', '')}<br/>
-        {"GSTIN/UIN: " + data.get('buyer_gstin', '') if data.get('buyer_gstin') else ''}<br/>
-        {"State Code: " + data.get('buyer_state_code', '') if data.get('buyer_state_code') else ''}"""
-        
-        invoice_meta = f"""<b>Invoice No.</b> {invoice_number}<br/><b>Dated:</b> {invoice_date}<br/>
-        {"<b>Vehicle No:</b> " + data.get('vehicle_number', '') if data.get('vehicle_number') else ''}"""
-        
-        header_data = [
-            [Paragraph(seller_info, styles['Normal']), Paragraph(invoice_meta, styles['Normal'])],
-            [Paragraph("<b>Buyer (Bill to)</b>", styles['Normal']), ''],
-            [Paragraph(buyer_info, styles['Normal']), '']
-        ]
-        
-        header_table = Table(header_data, colWidths=[4*inch, 3.5*inch])
-        header_table.setStyle(TableStyle([
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-            ('PADDING', (0, 0), (-1, -1), 10),
-            ('FONTSIZE', (0, 0), (-1, -1), 9),
-        ]))
-        elements.append(header_table)
-        elements.append(Spacer(1, 15))
-        
-        # Items table
-        items = data.get('items', [])
-        cgst_rate = float(data.get('cgst_rate', 9))
-        sgst_rate = float(data.get('sgst_rate', 9))
-        
-        subtotal = 0
-        items_data = [['Sl', 'Description of Goods', 'HSN/SAC', 'Quantity', 'Rate', 'per', 'Amount']]
-        hsn_codes = []
-        
-        for idx, item in enumerate(items, 1):
-            if not item.get('description'):
-                continue
-            qty = float(item.get('quantity', 0))
-            rate = float(item.get('rate', 0))
-            amount = qty * rate
-            subtotal += amount
-            
-            hsn = item.get('hsn_code', '')
-            if hsn and hsn not in hsn_codes:
-                hsn_codes.append(hsn)
-            
-            items_data.append([
-                str(idx), item.get('description', ''), hsn,
-                f"{qty} {item.get('unit', 'Nos')}", f"Rs {rate:,.2f}",
-                item.get('unit', 'Nos'), f"Rs {amount:,.2f}"
-            ])
-        
-        items_data.append(['', '', '', '', '', 'Total', f"Rs {subtotal:,.2f}"])
-        
-        items_table = Table(items_data, colWidths=[0.4*inch, 3*inch, 0.8*inch, 0.9*inch, 0.9*inch, 0.5*inch, 1*inch])
-        items_table.setStyle(TableStyle([
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#666666')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
-            ('FONTSIZE', (0, 0), (-1, -1), 8),
-            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-            ('PADDING', (0, 0), (-1, -1), 6),
-            ('ALIGN', (3, 1), (6, -1), 'RIGHT'),
-        ]))
-        elements.append(items_table)
-        elements.append(Spacer(1, 10))
-        
-        # Tax calculation
-        cgst_amount = (subtotal * cgst_rate) / 100
-        sgst_amount = (subtotal * sgst_rate) / 100
-        total = subtotal + cgst_amount + sgst_amount
-        hsn_display = hsn_codes[0] if hsn_codes else ''
-        
-        tax_data = [
-            ['HSN/SAC', 'Taxable Value', 'CGST', '', 'SGST/UTGST', '', 'Total Tax Amount'],
-            ['', '', 'Rate', 'Amount', 'Rate', 'Amount', ''],
-            [hsn_display, f"Rs {subtotal:,.2f}", f"{cgst_rate}%", f"Rs {cgst_amount:,.2f}",
-             f"{sgst_rate}%", f"Rs {sgst_amount:,.2f}", f"Rs {(cgst_amount + sgst_amount):,.2f}"],
-            ['', f"Total Rs {subtotal:,.2f}", '', '', '', '', f"Rs {(cgst_amount + sgst_amount):,.2f}"]
-        ]
-        
-        tax_table = Table(tax_data, colWidths=[0.8*inch, 1.3*inch, 0.6*inch, 1*inch, 0.8*inch, 1*inch, 1*inch])
-        tax_table.setStyle(TableStyle([
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('BACKGROUND', (0, 0), (-1, 1), colors.HexColor('#666666')),
-            ('TEXTCOLOR', (0, 0), (-1, 1), colors.whitesmoke),
-            ('SPAN', (0, 0), (0, 1)), ('SPAN', (1, 0), (1, 1)), ('SPAN', (2, 0), (3, 0)),
-            ('SPAN', (4, 0), (5, 0)), ('SPAN', (6, 0), (6, 1)),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTSIZE', (0, 0), (-1, -1), 8),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ('PADDING', (0, 0), (-1, -1), 6),
-        ]))
-        elements.append(tax_table)
-        elements.append(Spacer(1, 10))
-        
-        # Amount in words
-        total_int = int(total)
-        amount_words = f"INR {number_to_words(total_int)} Only"
-        amount_words_data = [[f"Amount Chargeable (in words): {amount_words}", f"Rs {total:,.2f}"]]
-        amount_words_table = Table(amount_words_data, colWidths=[5.5*inch, 2*inch])
-        amount_words_table.setStyle(TableStyle([
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('FONTNAME', (0, 0), (-1, -1), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, -1), 9),
-            ('PADDING', (0, 0), (-1, -1), 8),
-            ('ALIGN', (1, 0), (1, 0), 'RIGHT'),
-        ]))
-        elements.append(amount_words_table)
-        elements.append(Spacer(1, 15))
-        
-        # Notes
-        if data.get('notes'):
-            elements.append(Paragraph(f"<b>Notes:</b> {data.get('notes', '')}", styles['Normal']))
-            elements.append(Spacer(1, 10))
-        
-        # Declaration and signature
-        declaration_style = ParagraphStyle('Declaration', parent=styles['Normal'], fontSize=9, spaceAfter=10)
-        elements.append(Spacer(1, 10))
-        elements.append(Paragraph("<b>Declaration:</b>", declaration_style))
-        elements.append(Paragraph("We declare that this invoice shows the actual price of the goods described and that all particulars are true and correct.", declaration_style))
-        elements.append(Spacer(1, 20))
-        
-        signature_style = ParagraphStyle('Signature', parent=styles['Normal'], fontSize=9, alignment=TA_RIGHT)
-        elements.append(Paragraph(f"<b>For {data.get('seller_name', '')}</b>", signature_style))
-        elements.append(Spacer(1, 30))
-        elements.append(Paragraph("Authorised Signatory", signature_style))
-        
-        footer_style = ParagraphStyle('Footer', parent=styles['Normal'], fontSize=8, alignment=TA_CENTER)
-        elements.append(Paragraph("This is a Computer Generated Invoice", footer_style))
-        
-        doc.build(elements)
-        buffer.seek(0)
-        return buffer
-    except Exception as e:
-        raise Exception(f"Error creating PDF: {str(e)}")
+# Invoices accepted by one bulk request
+MAX_BULK_INVOICES = 200
+
+def invoice_payload_error(data):
+    """Validate an invoice payload, returning an error message or None"""
+    # Validate required buyer fields
+    required_fields = ['buyer_name', 'buyer_address', 'buyer_city', 'buyer_state', 'buyer_pincode']
+    missing_fields = [field for field in required_fields if not data.get(field)]
+    
+    if missing_fields:
+        return f'Missing required fields: {", ".join(missing_fields)}'
+    
+    # Validate items
+    items = data.get('items', [])
+    if not items or not isinstance(items, list):
+        return 'Please add at least one item'
+    
+    has_valid_item = any(item.get('description') and item.get('quantity') and item.get('rate') for item in items)
+    if not has_valid_item:
+        return 'At least one item must have description, quantity, and rate'
+    
+    return None
+
+def with_seller_details(data, business):
+    """Merge business details into an invoice payload as seller info"""
+    return {
+        'seller_name': data.get('seller_name') or business.get('name', ''),
+        'seller_address': data.get('seller_address') or business.get('address', ''),
+        'seller_city': data.get('seller_city') or business.get('city', ''),
+        'seller_state': data.get('seller_state') or business.get('state', ''),
+        'seller_pincode': data.get('seller_pincode') or business.get('pincode', ''),
+        'seller_gstin': data.get('seller_gstin') or business.get('gst_number', ''),
+        'seller_state_name': data.get('seller_state_name') or business.get('state', ''),
+        'seller_state_code': data.get('seller_state_code', ''),
+        **data
+    }
+
+def invoice_filename(buyer_name):
+    """Download filename for an invoice PDF"""
+    buyer_name_safe = (buyer_name or 'customer').replace(' ', '_')
+    return f"invoice_{buyer_name_safe}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
 
 @app.route('/api/generate-invoice', methods=['POST'])
 @token_required
@@ -2472,49 +2670,152 @@ def generate_invoice():
         
         data = request.json
         
-        # Validate required buyer fields
-        required_fields = ['buyer_name', 'buyer_address', 'buyer_city', 'buyer_state', 'buyer_pincode']
-        missing_fields = [field for field in required_fields if not data.get(field)]
-        
-        if missing_fields:
-            return jsonify({'error': f'Missing required fields: {", ".join(missing_fields)}'}), 400
-        
-        # Validate items
-        items = data.get('items', [])
-        if not items or not isinstance(items, list):
-            return jsonify({'error': 'Please add at least one item'}), 400
-        
-        has_valid_item = any(item.get('description') and item.get('quantity') and item.get('rate') for item in items)
-        if not has_valid_item:
-            return jsonify({'error': 'At least one item must have description, quantity, and rate'}), 400
+        error = invoice_payload_error(data)
+        if error:
+            return jsonify({'error': error}), 400
         
         # Get business details to auto-fill seller info
         business = firebase_db.get_document('businesses', business_id)
         
         # Merge business details with provided data
-        invoice_data = {
-            'seller_name': data.get('seller_name') or business.get('name', ''),
-            'seller_address': data.get('seller_address') or business.get('address', ''),
-            'seller_city': data.get('seller_city') or business.get('city', ''),
-            'seller_state': data.get('seller_state') or business.get('state', ''),
-            'seller_pincode': data.get('seller_pincode') or business.get('pincode', ''),
-            'seller_gstin': data.get('seller_gstin') or business.get('gst_number', ''),
-            'seller_state_name': data.get('seller_state_name') or business.get('state', ''),
-            'seller_state_code': data.get('seller_state_code', ''),
-            **data
-        }
+        invoice_data = with_seller_details(data, business)
         
-        pdf_buffer = create_invoice_pdf(invoice_data)
+        # Rendered on the invoice process pool so layout does not block this worker
+        try:
+            pdf_bytes = invoice_renderer.render_invoice(invoice_data)
+        except invoice_renderer.InvoiceQueueFull as e:
+            return jsonify({'error': str(e)}), 503, {'Retry-After': '5'}
+        except invoice_renderer.InvoiceTimeout as e:
+            return jsonify({'error': str(e)}), 504
         
-        buyer_name_safe = data.get('buyer_name', 'customer').replace(' ', '_')
-        filename = f"invoice_{buyer_name_safe}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
+        filename = invoice_filename(data.get('buyer_name', 'customer'))
         
-        return send_file(pdf_buffer, mimetype='application/pdf', as_attachment=True, download_name=filename)
+        return send_file(BytesIO(pdf_bytes), mimetype='application/pdf', as_attachment=True, download_name=filename)
         
     except Exception as e:
         logger.error(f"Generate invoice error: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+def ledger_invoice_payloads(business_id, data):
+    """
+    Build one invoice payload per customer from their credit transactions in a date range
+    data: start_date and end_date (YYYY-MM-DD, inclusive), optional customer_ids and
+    invoice fields (cgst_rate, sgst_rate, seller_*) applied to every invoice
+    Returns (payloads, error)
+    """
+    try:
+        start = datetime.strptime(data.get('start_date', ''), '%Y-%m-%d')
+        end = datetime.strptime(data.get('end_date', ''), '%Y-%m-%d') + timedelta(days=1)
+    except ValueError:
+        return None, 'start_date and end_date must be dates like 2025-03-31'
+    if end <= start:
+        return None, 'end_date must not be before start_date'
+    
+    customer_ids = data.get('customer_ids')
+    if customer_ids is not None and not isinstance(customer_ids, list):
+        return None, 'customer_ids must be a list'
+    
+    # Uses the same (business_id, created_at desc) index as the dashboard
+    # Streamed, so only the credits that end up on an invoice are held in memory
+    transactions = firebase_db.iter_documents('transactions', [
+        Query.equal('business_id', business_id),
+        Query.greaterThanEqual('created_at', start.isoformat()),
+        Query.lessThan('created_at', end.isoformat()),
+        Query.order_desc('created_at')
+    ])
+    
+    by_customer = {}
+    for txn in transactions:
+        if txn.get('transaction_type') != 'credit':
+            continue
+        if customer_ids is not None and txn.get('customer_id') not in customer_ids:
+            continue
+        by_customer.setdefault(txn.get('customer_id'), []).append(txn)
+    
+    # Invoice lines run oldest first, and so do the invoices
+    for customer_transactions in by_customer.values():
+        customer_transactions.reverse()
+    by_customer = dict(sorted(by_customer.items(), key=lambda item: item[1][0].get('created_at', '')))
+    
+    customers = firebase_db.get_many('customers', list(by_customer.keys()))
+    shared_fields = {
+        key: value for key, value in data.items()
+        if key not in ('start_date', 'end_date', 'customer_ids')
+    }
+    
+    payloads = []
+    for customer_id, customer_transactions in by_customer.items():
+        customer = customers.get(customer_id)
+        if not customer or customer.get('business_id') != business_id:
+            continue
+        payloads.append({
+            **shared_fields,
+            'buyer_name': customer.get('name', ''),
+            'buyer_address': customer.get('address', ''),
+            'buyer_city': customer.get('city', ''),
+            'buyer_state': customer.get('state', ''),
+            'buyer_pincode': customer.get('pincode', ''),
+            'items': [{
+                'description': txn.get('notes') or f"Credit on {txn.get('created_at', '')[:10]}",
+                'quantity': 1,
+                'rate': txn.get('amount', 0),
+                'unit': 'Nos'
+            } for txn in customer_transactions]
+        })
+    return payloads, None
+
+@app.route('/api/generate-invoices', methods=['POST'])
+@token_required
+@business_required
+def generate_invoices():
+    """
+    Generate many invoices at once and stream them back as a ZIP archive
+    Body is either {"invoices": [invoice payload, ...]} or a ledger range
+    {"start_date": ..., "end_date": ..., "customer_ids": [...]} with one invoice per customer
+    """
+    try:
+        business_id = request.business_id
+        data = request.get_json(silent=True)
+        
+        if not data:
+            return jsonify({'error': 'No data provided'}), 400
+        
+        if 'invoices' in data:
+            payloads = data['invoices']
+            if not isinstance(payloads, list) or not payloads:
+                return jsonify({'error': 'invoices must be a non-empty list'}), 400
+            for index, payload in enumerate(payloads):
+                error = invoice_payload_error(payload) if isinstance(payload, dict) else 'Invoice must be an object'
+                if error:
+                    return jsonify({'error': f'Invoice {index + 1}: {error}'}), 400
+        else:
+            payloads, error = ledger_invoice_payloads(business_id, data)
+            if error:
+                return jsonify({'error': error}), 400
+            if not payloads:
+                return jsonify({'error': 'No credit transactions found in this date range'}), 404
+        
+        if len(payloads) > MAX_BULK_INVOICES:
+            return jsonify({'error': f'At most {MAX_BULK_INVOICES} invoices can be generated at once'}), 400
+        
+        business = firebase_db.get_document('businesses', business_id)
+        invoices = [
+            (f"{index:03d}_{invoice_filename(payload.get('buyer_name'))}", with_seller_details(payload, business))
+            for index, payload in enumerate(payloads, 1)
+        ]
+        
+        # PDFs are rendered in parallel and written to the response as each one finishes
+        archive_name = f"invoices_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+        return Response(
+            stream_with_context(invoice_renderer.stream_invoice_zip(invoices)),
+            mimetype='application/zip',
+            headers={'Content-Disposition': f'attachment; filename={archive_name}'}
+        )
+        
+    except Exception as e:
+        logger.error(f"Generate invoices error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 # Error handlers
 @app.errorhandler(404)
 def not_found(error):
@@ -2524,6 +2825,16 @@ def not_found(error):
 def server_error(error):
     return jsonify({'error': 'Internal server error'}), 500
 
+# Optional in-process runner for recurring transactions; a cron job running
+# recurring_engine.py works too, and a lease keeps runners from overlapping
+if os.getenv('RECURRING_WORKER_INTERVAL'):
+    recurring_engine.start_worker(firebase_db, int(os.getenv('RECURRING_WORKER_INTERVAL')))
+
+# Recover background uploads lost when a worker restarted with jobs still queued;
+# opt-in through UPLOAD_SWEEP_INTERVAL, like the recurring worker above
+if upload_queue.UPLOAD_SWEEP_INTERVAL > 0:
+    upload_queue.start_sweeper(fail_lost_uploads)
+
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 5003))
     app.run(host='0.0.0.0', port=port, debug=os.getenv('FLASK_ENV') == 'development')
@@ -149,6 +149,49 @@ class AppwriteDB:
             logger.error(f"Appwrite list error: {e}")
             return []
 
+    def count(self, collection_name, queries=None):
+        """Count matching documents using the total Appwrite reports for a list call"""
+        try:
+            self._ensure_initialized()
+            result = self.databases.list_documents(
+                database_id=self.database_id,
+                collection_id=self.collections[collection_name],
+                queries=list(queries or []) + [Query.limit(1)]
+            )
+            return result['total']
+        except AppwriteException as e:
+            logger.error(f"Appwrite count error: {e}")
+            return None
+
+    def sum(self, collection_name, field, queries=None, page_size=1000):
+        """
+        Sum a numeric field over matching documents
+        Appwrite has no aggregation queries, so this pages through only the selected field
+        """
+        try:
+            self._ensure_initialized()
+            total = 0
+            cursor = None
+            while True:
+                page_queries = list(queries or []) + [Query.select([field]), Query.limit(page_size)]
+                if cursor:
+                    page_queries.append(Query.cursor_after(cursor))
+                
+                result = self.databases.list_documents(
+                    database_id=self.database_id,
+                    collection_id=self.collections[collection_name],
+                    queries=page_queries
+                )
+                documents = result['documents']
+                total += sum(float(doc.get(field) or 0) for doc in documents)
+                
+                if len(documents) < page_size:
+                    return total
+                cursor = documents[-1]['$id']
+        except AppwriteException as e:
+            logger.error(f"Appwrite sum error: {e}")
+            return None
+
     def update_document(self, collection_name, document_id, data):
         """Update a document"""
         try:
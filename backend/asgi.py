@@ -0,0 +1,278 @@
+"""
+ASGI - Event-loop serving mode for the hot read endpoints
+GET /api/dashboard, /api/customers, /api/transactions and /api/customers/remind-all
+are served natively on AsyncFirebaseDB, so one worker keeps many requests' Firestore
+RPCs in flight at once. Every other route is handed to the Flask app on a worker
+thread through a2wsgi, so the whole API is available from this entry point.
+
+Response bodies come from the same builders as the Flask handlers, and the two data
+layers share one document cache so writes through Flask invalidate async reads.
+
+This mode is opt-in: the default deployment (render.yaml) still runs the WSGI app
+with `gunicorn app:app`. To serve through this module instead, use:
+    gunicorn asgi:app -k uvicorn.workers.UvicornWorker --bind 0.0.0.0:$PORT
+    uvicorn asgi:app --port 5003
+"""
+import asyncio
+import json
+import logging
+import time
+from urllib.parse import parse_qsl
+from a2wsgi import WSGIMiddleware
+import app as api
+import firebase_stats
+import ledger_summary
+import metrics
+from firebase_async import AsyncFirebaseDB
+from firebase_query import Query
+
+logger = logging.getLogger(__name__)
+
+async_db = AsyncFirebaseDB(share_cache_with=api.firebase_db)
+
+# Streams request and response bodies between the event loop and Flask's worker threads
+flask_app = WSGIMiddleware(api.app)
+
+CORS_HEADERS = [
+    (b'access-control-allow-origin', b'*'),
+    (b'access-control-expose-headers', b'X-DB-Reads, X-DB-Calls, Server-Timing')
+]
+
+class RequestError(Exception):
+    """Ends a request early with an error status and body"""
+
+    def __init__(self, status, body):
+        super().__init__(body.get('error'))
+        self.status = status
+        self.body = body
+
+def authenticate(headers):
+    """Business ID from the bearer token, with the same errors as token_required/business_required"""
+    token = None
+    if 'authorization' in headers:
+        try:
+            token = headers['authorization'].split(' ')[1]  # Bearer <token>
+        except IndexError:
+            raise RequestError(401, {'error': 'Invalid token format'})
+
+    if not token:
+        raise RequestError(401, {'error': 'Token is missing'})
+
+    payload = api.decode_token(token)
+    if not payload:
+        raise RequestError(401, {'error': 'Token is invalid or expired'})
+    if payload['user_type'] != 'business':
+        raise RequestError(403, {'error': 'Access denied. Business account required.'})
+    return payload.get('business_id')
+
+async def get_summary(business_id):
+    """ledger_summary.get_summary on the async client; backfills run on a worker thread"""
+    summary = await async_db.get_document('business_summaries', business_id, use_cache=False)
+    if not ledger_summary.is_current(summary):
+        summary = await asyncio.to_thread(ledger_summary.backfill, api.firebase_db, business_id)
+    return summary
+
+# ========== Native Handlers ==========
+
+async def dashboard(business_id, args):
+    """Get business dashboard data"""
+    try:
+        business, customers, summary, transactions, customer_credits = await async_db.gather(
+            async_db.get_document('businesses', business_id),
+            async_db.list_documents('customers', [
+                Query.equal('business_id', business_id),
+                Query.select(['name', 'phone_number'])
+            ]),
+            get_summary(business_id),
+            async_db.list_documents('transactions', [
+                Query.equal('business_id', business_id),
+                Query.order_desc('created_at'),
+                Query.limit(100)
+            ]),
+            async_db.list_documents('customer_credits', [
+                Query.equal('business_id', business_id),
+                Query.select(['customer_id', 'current_balance'])
+            ])
+        )
+        return 200, api.build_dashboard(business_id, business, customers, summary, transactions, customer_credits)
+
+    except Exception as e:
+        logger.error(f"Dashboard error: {str(e)}")
+        return 500, {'error': f'Failed to load dashboard: {str(e)}'}
+
+async def get_customers(business_id, args):
+    """Get all customers for business"""
+    try:
+        pagination = api.get_pagination_args(args)
+        if pagination:
+            return await get_customers_page(business_id, *pagination)
+
+        # Make sure balances have been backfilled for older businesses
+        await get_summary(business_id)
+
+        customers, customer_credits = await async_db.gather(
+            async_db.list_documents('customers', [
+                Query.equal('business_id', business_id),
+                Query.select(['name', 'phone_number'])
+            ]),
+            async_db.list_documents('customer_credits', [
+                Query.equal('business_id', business_id),
+                Query.select(['customer_id', 'current_balance', 'transaction_count', 'last_transaction_at'])
+            ])
+        )
+        return 200, {'customers': api.build_customer_list(business_id, customers, customer_credits)}
+
+    except Exception as e:
+        logger.error(f"Get customers error: {str(e)}")
+        return 200, {'customers': [], 'error': f'Failed to get customers: {str(e)}'}
+
+async def get_customers_page(business_id, page_size, page_token):
+    """Get one page of customers (ordered by name) with balances from customer_credits"""
+    try:
+        (customers, next_page_token), _ = await async_db.gather(
+            async_db.list_page('customers', [
+                Query.equal('business_id', business_id),
+                Query.order_asc('name')
+            ], page_size, page_token),
+            get_summary(business_id)
+        )
+    except ValueError:
+        return 400, {'error': 'Invalid page token'}
+
+    customer_credits = await async_db.get_many('customer_credits', [
+        ledger_summary.credit_document_id(business_id, c['$id']) for c in customers
+    ])
+    customer_list = api.build_customer_page(customers, customer_credits)
+    return 200, {'customers': customer_list, 'next_page_token': next_page_token}
+
+async def get_all_transactions(business_id, args):
+    """Get all transactions for business"""
+    try:
+        transaction_queries = [
+            Query.equal('business_id', business_id),
+            Query.order_desc('created_at')
+        ]
+        pagination = api.get_pagination_args(args)
+        if pagination:
+            try:
+                transactions, next_page_token = await async_db.list_page('transactions', transaction_queries, *pagination)
+            except ValueError:
+                return 400, {'error': 'Invalid page token'}
+
+            # Only look up the customers that appear on this page
+            customers = await async_db.get_many('customers', [t.get('customer_id') for t in transactions])
+            customer_map = {cid: c.get('name', 'Unknown') for cid, c in customers.items()}
+            transaction_list = api.format_transaction_list(transactions, customer_map)
+            return 200, {'transactions': transaction_list, 'next_page_token': next_page_token}
+
+        transactions, customers = await async_db.gather(
+            async_db.list_documents('transactions', transaction_queries),
+            async_db.list_documents('customers', [
+                Query.equal('business_id', business_id),
+                Query.select(['name'])
+            ])
+        )
+        customer_map = {c['$id']: c.get('name', 'Unknown') for c in customers}
+        return 200, {'transactions': api.format_transaction_list(transactions, customer_map)}
+
+    except Exception as e:
+        logger.error(f"Get transactions error: {str(e)}")
+        return 200, {'transactions': [], 'error': f'Failed to get transactions: {str(e)}'}
+
+async def remind_all_customers(business_id, args):
+    """Get list of all customers with WhatsApp reminder URLs"""
+    try:
+        business, customer_credits = await async_db.gather(
+            async_db.get_document('businesses', business_id),
+            async_db.list_documents('customer_credits', [
+                Query.equal('business_id', business_id),
+                Query.select(['customer_id', 'current_balance'])
+            ])
+        )
+        business_name = business.get('name', 'Business')
+
+        customer_balance_map = ledger_summary.balance_map(customer_credits, business_id)
+        debtor_ids = [cid for cid, balance in customer_balance_map.items() if balance > 0]
+        debtors = await async_db.get_many('customers', debtor_ids)
+
+        return 200, api.build_reminders(business_name, customer_balance_map, debtor_ids, debtors)
+
+    except Exception as e:
+        logger.error(f"Get bulk reminders error: {str(e)}")
+        return 500, {'error': f'Failed to get reminders: {str(e)}'}
+
+ROUTES = {
+    '/api/dashboard': dashboard,
+    '/api/customers': get_customers,
+    '/api/transactions': get_all_transactions,
+    '/api/customers/remind-all': remind_all_customers
+}
+
+# ========== ASGI Application ==========
+
+async def serve_native(scope, send, handler):
+    """Run a native handler with the same accounting, metrics and headers as the Flask hooks"""
+    route = scope['path']
+    started = time.perf_counter()
+    token = firebase_stats.start_request()
+    try:
+        headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+        args = dict(parse_qsl(scope.get('query_string', b'').decode('latin-1')))
+        try:
+            status, body = await handler(authenticate(headers), args)
+        except RequestError as e:
+            status, body = e.status, e.body
+        summary = firebase_stats.current_stats().summary()
+    finally:
+        firebase_stats.end_request(token)
+
+    payload = (api.app.json.dumps(body, separators=(',', ':')) + '\n').encode('utf-8')
+    response_headers = [
+        (b'content-type', b'application/json'),
+        (b'content-length', str(len(payload)).encode()),
+        (b'x-db-reads', str(summary['reads']).encode()),
+        (b'x-db-calls', str(summary['calls']).encode()),
+        (b'server-timing', f'firestore;dur={summary["ms"]};desc="{summary["calls"]} RPCs"'.encode())
+    ] + CORS_HEADERS
+    await send({'type': 'http.response.start', 'status': status, 'headers': response_headers})
+    await send({'type': 'http.response.body', 'body': payload})
+
+    labels = {'method': 'GET', 'route': route}
+    metrics.registry.inc('http_requests_total', {**labels, 'status': str(status)})
+    metrics.registry.observe('http_request_duration_seconds', labels, time.perf_counter() - started)
+    if status >= 400 or 'error' in body:
+        metrics.registry.inc('http_request_errors_total', {**labels, 'kind': 'status' if status >= 400 else 'error_body'})
+    if summary['reads']:
+        metrics.registry.inc('firestore_reads_total', {'route': route}, summary['reads'])
+    if summary['calls']:
+        api.db_logger.info(json.dumps({
+            'event': 'request_db_usage',
+            'method': 'GET',
+            'path': route,
+            'endpoint': handler.__name__,
+            'status': status,
+            **summary
+        }))
+    metrics.registry.maybe_flush()
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            # Let queued background uploads finish before the worker exits
+            await asyncio.to_thread(api.upload_queue.shutdown)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        raise ValueError(f"Unsupported ASGI scope type: {scope['type']}")
+
+    handler = ROUTES.get(scope['path'])
+    if scope['method'] == 'GET' and handler:
+        return await serve_native(scope, send, handler)
+    return await flask_app(scope, receive, send)
@@ -0,0 +1,274 @@
+"""
+Benchmark - Offline latency and Firestore read benchmark for the hot endpoints
+Seeds synthetic businesses into an in-memory Firestore stand-in, drives the API
+through the Flask test client and reports p50/p95/p99 latency and reads per request.
+
+Usage:
+    python benchmark.py
+    python benchmark.py --transactions 100000 --customers 2000 --iterations 50
+    python benchmark.py --latency-ms 20 --json > bench_output.json
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from firebase_fake import InMemoryFirebaseDB
+import ledger_summary
+
+# Endpoints exercised per business: (name, method, path, query string, JSON body)
+# {customer_id} is replaced with a random seeded customer on every request
+ENDPOINTS = [
+    ('dashboard', 'GET', '/api/dashboard', None, None),
+    ('customers', 'GET', '/api/customers', None, None),
+    ('customers_page', 'GET', '/api/customers', {'page_size': 50}, None),
+    ('customer_detail', 'GET', '/api/customer/{customer_id}', None, None),
+    ('customer_transactions', 'GET', '/api/customer/{customer_id}/transactions', None, None),
+    ('transactions', 'GET', '/api/transactions', None, None),
+    ('transactions_page', 'GET', '/api/transactions', {'page_size': 50}, None),
+    ('profile', 'GET', '/api/profile', None, None),
+    ('remind_all', 'GET', '/api/customers/remind-all', None, None),
+    ('sync_full', 'GET', '/api/sync', None, None),
+    ('create_transaction', 'POST', '/api/transaction', None, {'customer_id': '{customer_id}', 'type': 'credit', 'amount': 10})
+]
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+def import_time_report(top=10):
+    """
+    Import app in a fresh interpreter with -X importtime
+    Returns the total import time and app's slowest direct imports, in milliseconds
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import app'],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True
+    )
+
+    # Lines look like "import time:  self [us] | cumulative | <indent>name", children first
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative_us, name = line.split('|', 2)
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((level, name.strip(), int(cumulative_us)))
+
+    app_index = next((i for i, entry in enumerate(entries) if entry[1] == 'app' and entry[0] == 0), None)
+    if app_index is None:
+        return {'total_ms': None, 'modules': []}
+
+    # app's direct imports are the level-1 entries printed since the previous top-level import
+    modules = []
+    for level, name, cumulative_us in reversed(entries[:app_index]):
+        if level == 0:
+            break
+        if level == 1:
+            modules.append({'module': name, 'ms': round(cumulative_us / 1000, 1)})
+    modules.sort(key=lambda module: module['ms'], reverse=True)
+
+    return {
+        'total_ms': round(entries[app_index][2] / 1000, 1),
+        'modules': modules[:top]
+    }
+
+def seed_business(firebase_db, business_index, customers, transactions, rng):
+    """Seed one business with customers and a transaction history"""
+    business_id = f"bench-business-{business_index}"
+    user_id = f"bench-user-{business_index}"
+    now = datetime.utcnow()
+
+    firebase_db.seed('users', user_id, {
+        'name': f"Bench Owner {business_index}",
+        'phone_number': f"9{business_index:09d}",
+        'user_type': 'business',
+        'created_at': now.isoformat()
+    })
+    firebase_db.seed('businesses', business_id, {
+        'user_id': user_id,
+        'name': f"Bench Business {business_index}",
+        'phone_number': f"9{business_index:09d}",
+        'access_pin': f"{rng.randint(0, 999999):06d}",
+        'created_at': now.isoformat()
+    })
+
+    customer_ids = []
+    for i in range(customers):
+        customer_id = str(uuid.UUID(int=rng.getrandbits(128)))
+        created_at = (now - timedelta(days=365, minutes=i)).isoformat()
+        firebase_db.seed('customers', customer_id, {
+            'business_id': business_id,
+            'name': f"Customer {i:06d}",
+            'phone_number': f"8{i:09d}",
+            'created_at': created_at,
+            'updated_at': created_at
+        })
+        customer_ids.append(customer_id)
+
+    # Transactions are spread over the last year, oldest first
+    step = timedelta(days=365) / max(transactions, 1)
+    for i in range(transactions):
+        created_at = (now - timedelta(days=365) + step * i).isoformat()
+        firebase_db.seed('transactions', str(uuid.UUID(int=rng.getrandbits(128))), {
+            'business_id': business_id,
+            'customer_id': rng.choice(customer_ids),
+            'transaction_type': 'credit' if rng.random() < 0.6 else 'payment',
+            'amount': float(rng.randint(10, 5000)),
+            'notes': '',
+            'receipt_image_url': '',
+            'created_by': 'business',
+            'created_at': created_at,
+            'updated_at': created_at
+        })
+
+    # Backfill the maintained summary and customer balances like production does
+    ledger_summary.rebuild_summary(firebase_db, business_id)
+    return business_id, user_id, customer_ids
+
+def run_endpoint(client, firebase_db, headers, endpoint, customer_ids, iterations, rng):
+    """Call one endpoint repeatedly and collect latency and read counts"""
+    name, method, path, query_string, body = endpoint
+    latencies = []
+    reads = []
+    rpcs = []
+    errors = 0
+
+    for _ in range(iterations):
+        customer_id = rng.choice(customer_ids)
+        url = path.replace('{customer_id}', customer_id)
+        payload = None
+        if body is not None:
+            payload = {key: (value.replace('{customer_id}', customer_id) if isinstance(value, str) else value)
+                       for key, value in body.items()}
+
+        reads_before = firebase_db.stats.total_reads()
+        rpcs_before = firebase_db.stats.rpcs
+        started = time.perf_counter()
+        response = client.open(url, method=method, query_string=query_string, json=payload, headers=headers)
+        latencies.append((time.perf_counter() - started) * 1000)
+        reads.append(firebase_db.stats.total_reads() - reads_before)
+        rpcs.append(firebase_db.stats.rpcs - rpcs_before)
+        if response.status_code >= 400:
+            errors += 1
+
+    return {
+        'endpoint': name,
+        'requests': iterations,
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'reads_per_request': round(sum(reads) / len(reads), 1) if reads else 0,
+        'rpcs_per_request': round(sum(rpcs) / len(rpcs), 1) if rpcs else 0
+    }
+
+def run_benchmark(businesses=1, customers=200, transactions=10000, iterations=20, latency_ms=0.0, seed=42,
+                  endpoints=None, import_time=True):
+    """Seed the fake database, run every endpoint and return the results"""
+    # Measured in a fresh interpreter before this process has imported anything heavy
+    import_report = import_time_report() if import_time else None
+
+    import app as app_module
+
+    rng = random.Random(seed)
+    firebase_db = InMemoryFirebaseDB(latency=latency_ms / 1000)
+    app_module.firebase_db = firebase_db
+
+    seeded = []
+    seed_started = time.perf_counter()
+    for business_index in range(businesses):
+        seeded.append(seed_business(firebase_db, business_index, customers, transactions, rng))
+    seed_seconds = time.perf_counter() - seed_started
+
+    selected = [endpoint for endpoint in ENDPOINTS if not endpoints or endpoint[0] in endpoints]
+    client = app_module.app.test_client()
+    results = []
+    for business_id, user_id, customer_ids in seeded:
+        headers = {'Authorization': f"Bearer {app_module.create_access_token(user_id, 'business', business_id)}"}
+        for endpoint in selected:
+            # Start every endpoint cold so read counts are comparable between runs
+            firebase_db._cache.clear()
+            result = run_endpoint(client, firebase_db, headers, endpoint, customer_ids, iterations, rng)
+            result['business_id'] = business_id
+            results.append(result)
+
+    return {
+        'config': {
+            'businesses': businesses,
+            'customers': customers,
+            'transactions': transactions,
+            'iterations': iterations,
+            'latency_ms': latency_ms,
+            'seed_seconds': round(seed_seconds, 2)
+        },
+        'results': results,
+        'cache': firebase_db.cache_stats(),
+        'import_time': import_report
+    }
+
+def print_report(report, out=sys.stdout):
+    """Print results as a fixed-width table"""
+    config = report['config']
+    print(f"Seeded {config['businesses']} business(es) x {config['customers']} customers x "
+          f"{config['transactions']} transactions in {config['seed_seconds']}s, "
+          f"simulated latency {config['latency_ms']}ms/RPC", file=out)
+    print(f"{'endpoint':<24}{'reqs':>6}{'errs':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'reads/req':>12}{'rpcs/req':>10}", file=out)
+    for result in report['results']:
+        print(f"{result['endpoint']:<24}{result['requests']:>6}{result['errors']:>6}"
+              f"{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}{result['p99_ms']:>10.2f}"
+              f"{result['reads_per_request']:>12}{result['rpcs_per_request']:>10}", file=out)
+    cache = report['cache']
+    print(f"cache: {cache['entries']} entries, hit ratio {cache['hit_ratio']:.2f}", file=out)
+
+    import_report = report.get('import_time')
+    if import_report and import_report['total_ms'] is not None:
+        print(f"import app: {import_report['total_ms']}ms (python -X importtime), slowest imports:", file=out)
+        for module in import_report['modules']:
+            print(f"  {module['module']:<40}{module['ms']:>10.1f} ms", file=out)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the API against an in-memory Firestore')
+    parser.add_argument('--businesses', type=int, default=1, help='Businesses to seed')
+    parser.add_argument('--customers', type=int, default=200, help='Customers per business')
+    parser.add_argument('--transactions', type=int, default=10000, help='Transactions per business (10k-1M)')
+    parser.add_argument('--iterations', type=int, default=20, help='Requests per endpoint')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='Simulated latency per Firestore RPC')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed for the synthetic data')
+    parser.add_argument('--endpoint', action='append', dest='endpoints', help='Only run the named endpoint (repeatable)')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+    parser.add_argument('--skip-importtime', action='store_true', help='Skip the python -X importtime report')
+    args = parser.parse_args()
+
+    # Request logging would dominate the measurements
+    logging.disable(logging.INFO)
+
+    report = run_benchmark(
+        businesses=args.businesses,
+        customers=args.customers,
+        transactions=args.transactions,
+        iterations=args.iterations,
+        latency_ms=args.latency_ms,
+        seed=args.seed,
+        endpoints=args.endpoints,
+        import_time=not args.skip_importtime
+    )
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+"""
+Shared pytest fixtures for the offline tests
+db is the real FirebaseDB over the in-memory Firestore fake (see firebase_fake),
+async_db the AsyncFirebaseDB over the same documents and cache, and api a Flask
+test client of the app using db, signed in as business user u1 of business b1.
+"""
+import pytest
+
+from firebase_fake import InMemoryFirebaseDB, InMemoryAsyncFirebaseDB
+
+@pytest.fixture
+def db():
+    """An empty in-memory database"""
+    return InMemoryFirebaseDB()
+
+@pytest.fixture
+def async_db(db):
+    """The async layer over db"""
+    return InMemoryAsyncFirebaseDB(db)
+
+@pytest.fixture
+def api(db, monkeypatch):
+    """Test client of the app on db, sending a business token for u1/b1"""
+    import app as appmod
+    monkeypatch.setattr(appmod, 'firebase_db', db)
+    db.seed('users', 'u1', {'user_type': 'business'})
+    client = appmod.app.test_client()
+    client.environ_base['HTTP_AUTHORIZATION'] = 'Bearer ' + appmod.create_access_token('u1', 'business', 'b1')
+    return client
@@ -0,0 +1,183 @@
+"""
+Delta Sync - Change feeds for the mobile app's ledger
+Clients keep an opaque sync token and only download documents created, updated
+or deleted since their previous sync. Tokens compare against the created_at,
+updated_at and deleted_at stamps, which are all UTC.
+
+A feed that reaches SYNC_PAGE_LIMIT resumes after its last (updated_at, $id), so
+pages move forward even when many documents share one timestamp (a recurring run
+stamps all of its transactions alike).
+
+Needs composite indexes on each synced collection (business_id ASC, updated_at ASC)
+and on tombstones (business_id ASC, deleted_at ASC).
+"""
+import base64
+import json
+import logging
+from datetime import datetime, timedelta
+from firebase_query import Query
+from firebase_utils import decode_page_token
+
+logger = logging.getLogger(__name__)
+
+SYNC_COLLECTIONS = ['transactions', 'customers', 'products', 'vouchers', 'offers']
+
+# Maximum documents returned per collection in one sync response
+SYNC_PAGE_LIMIT = 1000
+
+# Re-read a small window before the token to absorb clock skew and writes that
+# were still in flight when the previous sync ran; clients upsert by ID
+SYNC_OVERLAP_SECONDS = 5
+
+# Feeds of an incremental sync and the stamp each one is ordered by
+SYNC_FEEDS = [(name, 'updated_at') for name in SYNC_COLLECTIONS] + [('tombstones', 'deleted_at')]
+
+def encode_sync_token(timestamp, overlap=True, pages=None, cursors=None):
+    """
+    Encode an ISO (UTC) timestamp as an opaque sync token
+    overlap=False resumes exactly at timestamp, without the overlap window
+    pages maps collections to list_page tokens while an initial sync is unfinished
+    cursors maps truncated feeds to the [stamp, document ID] they resume after
+    """
+    payload = {'since': timestamp, 'overlap': overlap}
+    if pages:
+        payload['pages'] = pages
+    if cursors:
+        payload['cursors'] = cursors
+    return base64.urlsafe_b64encode(json.dumps(payload).encode('utf-8')).decode('ascii').rstrip('=')
+
+def _valid_cursor(cursor):
+    return (isinstance(cursor, list) and len(cursor) == 2
+            and all(isinstance(value, str) and value for value in cursor))
+
+def decode_sync_token(sync_token):
+    """Decode a sync token into (timestamp, overlap, pages, cursors), or None if invalid"""
+    try:
+        padded = sync_token + '=' * (-len(sync_token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        since = payload.get('since')
+        datetime.fromisoformat(since)
+        pages = payload.get('pages')
+        if pages is not None and not (
+            isinstance(pages, dict) and pages
+            and all(name in SYNC_COLLECTIONS and decode_page_token(token) for name, token in pages.items())
+        ):
+            return None
+        cursors = payload.get('cursors')
+        feeds = dict(SYNC_FEEDS)
+        if cursors is not None and not (
+            isinstance(cursors, dict) and cursors
+            and all(name in feeds and _valid_cursor(cursor) for name, cursor in cursors.items())
+        ):
+            return None
+        return since, bool(payload.get('overlap', True)), pages, cursors
+    except (ValueError, TypeError, AttributeError):
+        return None
+
+def tombstone_id(collection_name, document_id):
+    """Deterministic tombstone document ID"""
+    return f"{collection_name}_{document_id}"
+
+def record_deletion(firebase_db, collection_name, document):
+    """Delete a document and leave a tombstone so syncing clients drop it too"""
+    now = datetime.utcnow().isoformat()
+    return firebase_db.batch_write([
+        ('delete', collection_name, document['$id'], None),
+        ('create', 'tombstones', tombstone_id(collection_name, document['$id']), {
+            'business_id': document.get('business_id'),
+            'collection': collection_name,
+            'document_id': document['$id'],
+            'deleted_at': now,
+            'created_at': now
+        })
+    ])
+
+def collect_full(firebase_db, business_id, started_at, pages=None):
+    """
+    One page of an initial sync: up to SYNC_PAGE_LIMIT documents per collection in ID order
+    pages holds the list_page tokens of the collections still being read (None to start).
+    Once every collection is read, the token resumes incrementally from started_at, so
+    writes and deletions made while the pages were fetched are picked up next.
+    """
+    business_filter = Query.equal('business_id', business_id)
+    names = list(pages) if pages else SYNC_COLLECTIONS
+
+    results = firebase_db.gather([
+        lambda name=name: firebase_db.list_page(name, [business_filter], SYNC_PAGE_LIMIT, (pages or {}).get(name))
+        for name in names
+    ])
+
+    changes = {name: [] for name in SYNC_COLLECTIONS}
+    next_pages = {}
+    for name, (documents, page_token) in zip(names, results):
+        changes[name] = documents
+        if page_token:
+            next_pages[name] = page_token
+    if next_pages:
+        logger.info(f"Initial sync for business {business_id} continues in another page")
+
+    return {
+        'full': pages is None,
+        'changes': changes,
+        'deleted': {name: [] for name in SYNC_COLLECTIONS},
+        'has_more': bool(next_pages),
+        'sync_token': encode_sync_token(started_at, pages=next_pages)
+    }
+
+def collect_changes(firebase_db, business_id, since=None, overlap=True, pages=None, cursors=None):
+    """
+    Collect changes for a business since an ISO (UTC) timestamp
+    Without since, every document is returned (initial sync, see collect_full)
+    When a feed reaches SYNC_PAGE_LIMIT changes, has_more is set and the returned
+    token resumes that feed after its last (stamp, $id), so clients should sync again
+    """
+    if since is None:
+        return collect_full(firebase_db, business_id, datetime.utcnow().isoformat())
+    if pages:
+        return collect_full(firebase_db, business_id, since, pages)
+
+    started_at = datetime.utcnow().isoformat()
+    business_filter = Query.equal('business_id', business_id)
+    cursors = cursors or {}
+
+    window_start = since
+    if overlap:
+        window_start = (datetime.fromisoformat(since) - timedelta(seconds=SYNC_OVERLAP_SECONDS)).isoformat()
+
+    def feed_queries(name, field):
+        # The document ID breaks ties, so a cursor can resume inside one timestamp
+        queries = [business_filter, Query.order_asc(field), Query.order_asc('$id')]
+        if name in cursors:
+            stamp, document_id = cursors[name]
+            return queries + [Query.cursorAfterValues({field: stamp, '$id': document_id})]
+        return queries + [Query.greaterThanEqual(field, window_start)]
+
+    results = firebase_db.gather([
+        lambda name=name, field=field: firebase_db.list_documents(name, feed_queries(name, field), limit=SYNC_PAGE_LIMIT)
+        for name, field in SYNC_FEEDS
+    ])
+    changes = dict(zip(SYNC_COLLECTIONS, results))
+    tombstones = results[-1]
+
+    # Feeds that were read to the end continue from started_at; the others from
+    # their last document
+    next_cursors = {}
+    for (name, field), documents in zip(SYNC_FEEDS, results):
+        if len(documents) >= SYNC_PAGE_LIMIT:
+            next_cursors[name] = [documents[-1][field], documents[-1]['$id']]
+
+    deleted = {name: [] for name in SYNC_COLLECTIONS}
+    for tombstone in tombstones:
+        if tombstone.get('collection') in deleted:
+            deleted[tombstone['collection']].append(tombstone['document_id'])
+
+    if next_cursors:
+        logger.info(f"Delta sync for business {business_id} truncated at {SYNC_PAGE_LIMIT} documents per collection")
+
+    return {
+        'full': False,
+        'changes': changes,
+        'deleted': deleted,
+        'has_more': bool(next_cursors),
+        'sync_token': encode_sync_token(started_at, cursors=next_cursors)
+    }
@@ -0,0 +1,348 @@
+"""
+Firebase Async - FirebaseDB on Firestore's AsyncClient
+Same method names, query translation, $id semantics, caching and per-request
+accounting as FirebaseDB, but every call is a coroutine, so one event loop can keep
+hundreds of Firestore RPCs in flight. Used by the ASGI entry point (asgi.py).
+
+Queries are built and results handled by the helpers both layers inherit from
+BaseFirebaseDB (_list_plan, _list_query, _list_results, _iter_plan, _aggregate_query,
+...), so only the awaited RPCs differ. AsyncFirebaseDB is not a FirebaseDB: its
+methods return coroutines and gather() takes the coroutines themselves.
+"""
+import asyncio
+import logging
+from datetime import datetime
+from firebase_admin import firestore_async
+from google.cloud import firestore as google_firestore
+from firebase_utils import BaseFirebaseDB, BATCH_LIMIT, ITER_PAGE_SIZE
+from firebase_stats import track_call, query_shape
+import query_planner
+
+logger = logging.getLogger(__name__)
+
+class AsyncFirebaseDB(BaseFirebaseDB):
+    """
+    Async counterpart of FirebaseDB
+    Pass share_cache_with=<FirebaseDB> when both serve the same process, so writes made
+    through either one invalidate the documents cached by the other
+    """
+
+    def __init__(self, share_cache_with=None):
+        super().__init__()
+        if share_cache_with is not None:
+            self._cache = share_cache_with._cache
+
+    def _client(self):
+        """Firestore client for this layer"""
+        return firestore_async.client()
+
+    async def gather(self, *calls):
+        """Await independent coroutines concurrently and return their results in order"""
+        self._ensure_initialized()
+        return list(await asyncio.gather(*calls))
+
+    async def create_document(self, collection_name, document_id, data):
+        """Create a new document in collection"""
+        try:
+            self._ensure_initialized()
+
+            if 'created_at' not in data:
+                data['created_at'] = datetime.utcnow().isoformat()
+            if 'updated_at' not in data:
+                data['updated_at'] = data['created_at']
+
+            doc_ref = self._doc_ref(collection_name, document_id)
+            with track_call('create', collection_name) as call:
+                await doc_ref.set(data)
+                call.set_results([data])
+
+            result = data.copy()
+            result['$id'] = document_id
+            self._set_cache(collection_name, self._get_cache_key(collection_name, document_id), result)
+            return result
+
+        except Exception as e:
+            logger.error(f"Firebase create error: {e}")
+            return None
+
+    async def get_document(self, collection_name, document_id, use_cache=True):
+        """Get a single document by ID with caching"""
+        try:
+            self._ensure_initialized()
+
+            cache_key = self._get_cache_key(collection_name, document_id)
+            cached_result = self._get_from_cache(cache_key) if use_cache else None
+            if cached_result is not None:
+                return cached_result
+
+            with track_call('get', collection_name) as call:
+                doc = await self._doc_ref(collection_name, document_id).get()
+                result = self._doc_to_dict(doc)
+                call.set_results([result] if result else [])
+
+            if result:
+                self._set_cache(collection_name, cache_key, result)
+            return result
+
+        except Exception as e:
+            logger.error(f"Firebase get error: {e}")
+            return None
+
+    async def get_many(self, collection_name, document_ids):
+        """
+        Get several documents by ID with batched get_all reads, all chunks concurrently
+        Returns a dict of document_id -> document; missing documents are omitted
+        """
+        try:
+            self._ensure_initialized()
+            results, chunks = self._cached_documents(collection_name, document_ids)
+            for documents in await asyncio.gather(*(self._get_all(collection_name, chunk) for chunk in chunks)):
+                self._cache_documents(collection_name, results, documents)
+            return results
+
+        except Exception as e:
+            logger.error(f"Firebase get many error: {e}")
+            return {}
+
+    async def _get_all(self, collection_name, document_ids):
+        """Fetch one chunk of documents in a single get_all RPC"""
+        doc_refs = [self._doc_ref(collection_name, document_id) for document_id in document_ids]
+        documents = []
+        with track_call('get_all', collection_name, f"ids({len(doc_refs)})") as call:
+            async for doc in self.db.get_all(doc_refs):
+                doc_dict = self._doc_to_dict(doc)
+                if doc_dict:
+                    documents.append(doc_dict)
+            call.set_results(documents)
+        return documents
+
+    async def list_documents(self, collection_name, queries=None, limit=5000):
+        """List documents with optional queries (see FirebaseDB.list_documents)"""
+        try:
+            self._ensure_initialized()
+            plan, limit, query, cursors = self._list_plan(collection_name, queries, limit)
+
+            positions = []
+            for cursor in cursors:
+                with track_call('get', collection_name, cursor['type']) as call:
+                    snapshot = await self._doc_ref(collection_name, cursor['documentId']).get()
+                    call.documents = 1
+                if not snapshot.exists:
+                    logger.warning(f"Cursor document {cursor['documentId']} not found in {collection_name}")
+                    return []
+                positions.append((cursor, snapshot))
+            query, from_end = self._list_query(query, plan, limit, positions)
+
+            results = self._list_results(plan, limit, from_end)
+            if limit != 0:
+                with track_call('list', collection_name, query_shape(queries)) as call:
+                    if from_end:
+                        for snapshot in await query.get():
+                            results.add(snapshot)
+                    else:
+                        async for snapshot in query.stream():
+                            if results.add(snapshot):
+                                break
+                    results.finish(call)
+
+            plan.report(collection_name, queries)
+            return results.documents
+
+        except Exception as e:
+            logger.error(f"Firebase list error: {e}")
+            return []
+
+    async def list_page(self, collection_name, queries, page_size, page_token=None):
+        """
+        List one page of documents using cursor pagination
+        Returns (documents, next_page_token); raises ValueError for a bad page token
+        """
+        queries = self._page_queries(queries, page_token)
+        return self._split_page(await self.list_documents(collection_name, queries, limit=page_size + 1), page_size)
+
+    async def iter_documents(self, collection_name, queries=None, page_size=ITER_PAGE_SIZE):
+        """Yield matching documents lazily, page by page (see FirebaseDB.iter_documents)"""
+        plan, query, page_size = self._iter_plan(collection_name, queries, page_size)
+        limit = plan.result_limit()
+
+        try:
+            if limit != 0:
+                async for document in self._iter_pages(collection_name, query, queries, page_size):
+                    document = plan.admit(document)
+                    if document is not None:
+                        yield document
+                        if plan.satisfied(limit):
+                            return
+        finally:
+            plan.report(collection_name, queries, 'iter')
+
+    async def _iter_pages(self, collection_name, query, queries, page_size):
+        """Yield the documents of a query one page_size page at a time"""
+        last_snapshot = None
+        while True:
+            with track_call('list', collection_name, f"{query_shape(queries)} page".strip()) as call:
+                snapshots = [snapshot async for snapshot in self._page_query(query, page_size, last_snapshot).stream()]
+                documents = self._page_documents(snapshots, call)
+
+            for document in documents:
+                yield document
+
+            if len(snapshots) < page_size:
+                return
+            last_snapshot = snapshots[-1]
+
+    async def count(self, collection_name, queries=None):
+        """Count matching documents with a server-side aggregation query"""
+        return await self._aggregate(collection_name, queries, lambda query: query.count(alias='result'), 'count')
+
+    async def sum(self, collection_name, field, queries=None):
+        """Sum a numeric field over matching documents with a server-side aggregation query"""
+        return await self._aggregate(collection_name, queries, lambda query: query.sum(field, alias='result'), f"sum({field})", field)
+
+    async def _aggregate(self, collection_name, queries, build_aggregation, label, field=None):
+        """Run a single aggregation over a query (see FirebaseDB._aggregate)"""
+        try:
+            self._ensure_initialized()
+            plan = query_planner.plan(queries)
+            if plan.residual:
+                return await self._aggregate_documents(collection_name, queries, plan, label, field)
+
+            with track_call('aggregate', collection_name, f"{query_shape(queries)} {label}".strip()) as call:
+                results = await build_aggregation(self._aggregate_query(collection_name, plan)).get()
+                return self._aggregate_value(results, label, call)
+
+        except Exception as e:
+            logger.error(f"Firebase aggregation error: {e}")
+            return None
+
+    async def _aggregate_documents(self, collection_name, queries, plan, label, field=None):
+        """Count the documents matching a plan with residual queries, or sum field over them"""
+        limit = plan.result_limit()
+
+        value = 0
+        if limit != 0:
+            async for document in self.iter_documents(collection_name, self._aggregate_documents_queries(plan, field)):
+                document = plan.admit(document)
+                if document is None:
+                    continue
+                value = self._accumulate(value, document, field)
+                if plan.satisfied(limit):
+                    break
+
+        plan.report(collection_name, queries, label)
+        return value
+
+    async def update_document(self, collection_name, document_id, data):
+        """Update a document"""
+        try:
+            self._ensure_initialized()
+            data['updated_at'] = datetime.utcnow().isoformat()
+
+            with track_call('update', collection_name) as call:
+                await self._doc_ref(collection_name, document_id).update(data)
+                call.set_results([data])
+            self._invalidate_cache(collection_name, document_id)
+
+            result = data.copy()
+            result['$id'] = document_id
+            return result
+
+        except Exception as e:
+            logger.error(f"Firebase update error: {e}")
+            return None
+
+    async def delete_document(self, collection_name, document_id):
+        """Delete a document"""
+        try:
+            self._ensure_initialized()
+            with track_call('delete', collection_name) as call:
+                await self._doc_ref(collection_name, document_id).delete()
+                call.documents = 1
+            self._invalidate_cache(collection_name, document_id)
+            return True
+
+        except Exception as e:
+            logger.error(f"Firebase delete error: {e}")
+            return False
+
+    async def batch_write(self, operations):
+        """Perform batch write operations, committed in chunks of BATCH_LIMIT (see FirebaseDB.batch_write)"""
+        try:
+            self._ensure_initialized()
+
+            for start in range(0, len(operations), BATCH_LIMIT):
+                chunk = operations[start:start + BATCH_LIMIT]
+                batch = self.db.batch()
+                for op_type, collection_name, document_id, data in chunk:
+                    self._apply_operation(batch, op_type, self._doc_ref(collection_name, document_id), data)
+
+                with track_call('batch', ','.join(sorted({operation[1] for operation in chunk}))) as call:
+                    await batch.commit()
+                    call.set_results([data for _, _, _, data in chunk if data])
+                    call.documents = len(chunk)
+
+                for _, collection_name, document_id, _ in chunk:
+                    self._invalidate_cache(collection_name, document_id)
+
+            return True
+
+        except Exception as e:
+            logger.error(f"Firebase batch write error: {e}")
+            for _, collection_name, document_id, _ in operations:
+                self._invalidate_cache(collection_name, document_id)
+            return False
+
+    async def run_transaction(self, reads, build_operations):
+        """Read documents and apply writes atomically (see FirebaseDB.run_transaction)"""
+        try:
+            self._ensure_initialized()
+
+            written = []
+
+            @google_firestore.async_transactional
+            async def run(transaction):
+                written.clear()
+                documents = {}
+                for collection_name, document_id in reads:
+                    with track_call('get', collection_name, 'transaction') as call:
+                        snapshot = await self._doc_ref(collection_name, document_id).get(transaction=transaction)
+                        documents[(collection_name, document_id)] = self._doc_to_dict(snapshot)
+                        call.documents = 1
+
+                for op_type, collection_name, document_id, data in build_operations(documents):
+                    self._apply_operation(transaction, op_type, self._doc_ref(collection_name, document_id), data)
+                    written.append((collection_name, document_id))
+
+            try:
+                with track_call('transaction_write', 'transaction') as call:
+                    await run(self.db.transaction())
+                    call.collection = ','.join(sorted({name for name, _ in written}))
+                    call.documents = len(written)
+            finally:
+                for collection_name, document_id in written:
+                    self._invalidate_cache(collection_name, document_id)
+            return True
+
+        except Exception as e:
+            logger.error(f"Firebase transaction error: {e}")
+            return False
+
+    async def query_documents(self, collection_name, field, operator, value, limit=100):
+        """Simple query helper for common filtering operations (see FirebaseDB.query_documents)"""
+        try:
+            self._ensure_initialized()
+            query = self._filter_query(collection_name, field, operator, value, limit)
+
+            results = []
+            with track_call('list', collection_name, f"{field}{operator}") as call:
+                async for doc in query.stream():
+                    doc_dict = self._doc_to_dict(doc)
+                    if doc_dict:
+                        results.append(doc_dict)
+                call.set_results(results)
+
+            return results
+
+        except Exception as e:
+            logger.error(f"Firebase query error: {e}")
+            return []
@@ -0,0 +1,128 @@
+"""
+Firebase Cache - Bounded LRU cache for Firestore documents
+Entries expire per collection TTL and are evicted by entry count and approximate size
+"""
+import copy
+import json
+import threading
+import time
+from collections import OrderedDict
+
+# Seconds to keep documents per collection; 0 disables caching for that collection
+# Other workers keep serving an entry until it expires, so users and businesses
+# (password hashes, access PINs) stay at the 60s the cache has always used
+DEFAULT_COLLECTION_TTLS = {
+    'users': 60,
+    'businesses': 60,
+    'customers': 120,
+    'products': 60,
+    'vouchers': 60,
+    'offers': 60,
+    'customer_credits': 0,
+    'business_summaries': 0
+}
+
+def estimate_size(value):
+    """Approximate memory footprint of a cached document in bytes"""
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    try:
+        return len(json.dumps(value, default=str))
+    except (TypeError, ValueError):
+        return 1024
+
+class LRUCache:
+    """Thread-safe LRU cache bounded by entry count and approximate bytes"""
+
+    def __init__(self, max_entries=2000, max_bytes=16 * 1024 * 1024, default_ttl=60, collection_ttls=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.collection_ttls = dict(DEFAULT_COLLECTION_TTLS if collection_ttls is None else collection_ttls)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def ttl_for(self, collection_name):
+        """Get the TTL in seconds for a collection"""
+        return self.collection_ttls.get(collection_name, self.default_ttl)
+
+    def get(self, key):
+        """Get a copy of a cached value, or None if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, size, expires_at = entry
+            if time.time() >= expires_at:
+                self._remove(key)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+        # Callers mutate returned documents, so never hand out the cached object
+        return copy.deepcopy(value)
+
+    def set(self, key, value, ttl):
+        """Store a copy of value for ttl seconds, evicting least recently used entries"""
+        if ttl <= 0:
+            return
+
+        value = copy.deepcopy(value)
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (value, size, time.time() + ttl)
+            self._bytes += size
+
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        """Drop a single entry"""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def invalidate_prefix(self, prefix):
+        """Drop every entry whose key starts with prefix"""
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                self._remove(key)
+
+    def clear(self):
+        """Drop all entries"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Get hit/miss/eviction counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': (self.hits / lookups) if lookups else 0.0
+            }
+
+    def _remove(self, key):
+        """Remove an entry; caller must hold the lock"""
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
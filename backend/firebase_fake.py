@@ -0,0 +1,689 @@
+"""
+Firebase Fake - In-memory stand-in for Firestore
+Used by the benchmark harness to run the backend offline. InMemoryFirebaseDB is
+the real FirebaseDB on top of an in-memory client, so query translation, cursors,
+caching and cache invalidation behave exactly as in production.
+InMemoryAsyncFirebaseDB does the same for AsyncFirebaseDB, over the same documents.
+"""
+import asyncio
+import copy
+import logging
+import threading
+import time
+from collections import defaultdict
+from firebase_admin import firestore
+from google.api_core.exceptions import AlreadyExists
+from google.cloud.firestore_v1.base_query import FieldFilter
+from google.cloud.firestore_v1.transforms import Increment
+from firebase_utils import FirebaseDB
+from firebase_async import AsyncFirebaseDB
+from firebase_stats import track_call
+
+logger = logging.getLogger(__name__)
+
+# Firestore bills aggregation queries one read per this many index entries
+AGGREGATION_ENTRIES_PER_READ = 1000
+
+# Firestore orders values of different types by type first
+_TYPE_ORDER = [type(None), bool, (int, float), str, bytes, list, dict]
+
+def _sort_key(value):
+    """Firestore-like ordering key for a field value"""
+    # bool is listed before numbers, so True/False never rank as integers
+    for rank, types in enumerate(_TYPE_ORDER):
+        if isinstance(value, types):
+            return (rank, repr(value) if isinstance(value, (list, dict)) else value)
+    return (len(_TYPE_ORDER), repr(value))
+
+def _get_field(data, field_path):
+    """Resolve a dotted field path, returning (found, value)"""
+    value = data
+    for part in field_path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return False, None
+        value = value[part]
+    return True, value
+
+def _matches(data, field_filter):
+    """Check a document against a single FieldFilter"""
+    found, value = _get_field(data, field_filter.field_path)
+    if not found:
+        return False
+
+    op, expected = field_filter.op_string, field_filter.value
+    if op == '==':
+        return value == expected
+    if op == '!=':
+        return value is not None and value != expected
+    if op == 'in':
+        return value in expected
+    if op == 'not-in':
+        return value is not None and value not in expected
+    if op == 'array_contains':
+        return isinstance(value, list) and expected in value
+    if op == 'array_contains_any':
+        return isinstance(value, list) and any(item in value for item in expected)
+
+    # Range filters only match values of the same type
+    if _sort_key(value)[0] != _sort_key(expected)[0]:
+        return False
+    if op == '<':
+        return value < expected
+    if op == '<=':
+        return value <= expected
+    if op == '>':
+        return value > expected
+    if op == '>=':
+        return value >= expected
+    raise ValueError(f"Unsupported operator: {op}")
+
+class ReadStats:
+    """Counts Firestore RPCs and billed document reads per collection"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.rpcs = 0
+            self.reads = defaultdict(int)
+            self.writes = defaultdict(int)
+
+    def record_read(self, collection_name, documents, rpc=True):
+        with self._lock:
+            if rpc:
+                self.rpcs += 1
+            # Every query is billed at least one read, even when empty
+            self.reads[collection_name] += max(documents, 1)
+
+    def record_write(self, collection_name):
+        with self._lock:
+            self.writes[collection_name] += 1
+
+    def total_reads(self):
+        with self._lock:
+            return sum(self.reads.values())
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'rpcs': self.rpcs,
+                'reads': dict(self.reads),
+                'writes': dict(self.writes)
+            }
+
+class MemorySnapshot:
+    """Minimal DocumentSnapshot"""
+
+    def __init__(self, reference, data, fields=None):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self._fields = fields
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        if self._data is None:
+            return None
+        if self._fields is None:
+            return copy.deepcopy(self._data)
+        return {field: copy.deepcopy(self._data[field]) for field in self._fields if field in self._data}
+
+    def get(self, field_path):
+        return _get_field(self._data or {}, field_path)[1]
+
+class MemoryDocumentReference:
+    """Minimal DocumentReference"""
+
+    def __init__(self, client, collection_name, document_id):
+        self._client = client
+        self.collection_name = collection_name
+        self.id = document_id
+
+    def get(self, transaction=None):
+        self._client.simulate_latency()
+        data = self._client.read_document(self.collection_name, self.id)
+        self._client.stats.record_read(self.collection_name, 1)
+        return MemorySnapshot(self, data)
+
+    def set(self, data, merge=False):
+        batch = self._client.batch()
+        batch.set(self, data, merge=merge)
+        batch.commit()
+
+    def update(self, data):
+        batch = self._client.batch()
+        batch.update(self, data)
+        batch.commit()
+
+    def delete(self):
+        batch = self._client.batch()
+        batch.delete(self)
+        batch.commit()
+
+class MemoryAggregationResult:
+    def __init__(self, alias, value):
+        self.alias = alias
+        self.value = value
+
+class MemoryAggregationQuery:
+    """count()/sum() over a MemoryQuery"""
+
+    def __init__(self, query, alias, field=None):
+        self._query = query
+        self._alias = alias
+        self._field = field
+
+    def get(self):
+        self._query._client.simulate_latency()
+        matched = self._query._matching_documents()[self._query._offset:]
+        if self._query._limit is not None:
+            matched = matched[:self._query._limit]
+        self._query._client.stats.record_read(
+            self._query._collection_name,
+            -(-len(matched) // AGGREGATION_ENTRIES_PER_READ)
+        )
+
+        if self._field is None:
+            value = len(matched)
+        else:
+            value = 0
+            for _, data in matched:
+                found, field_value = _get_field(data, self._field)
+                if found and isinstance(field_value, (int, float)) and not isinstance(field_value, bool):
+                    value += field_value
+        return [[MemoryAggregationResult(self._alias, value)]]
+
+class MemoryQuery:
+    """Immutable query over one collection, mirroring the Firestore Query API"""
+
+    def __init__(self, client, collection_name, filters=(), orders=(), offset=0,
+                 limit=None, limit_to_last=False, start_after=None, end_before=None, fields=None):
+        self._client = client
+        self._collection_name = collection_name
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._offset = offset
+        self._limit = limit
+        self._limit_to_last = limit_to_last
+        self._start_after = start_after
+        self._end_before = end_before
+        self._fields = fields
+
+    def _copy(self, **changes):
+        state = {
+            'filters': self._filters,
+            'orders': self._orders,
+            'offset': self._offset,
+            'limit': self._limit,
+            'limit_to_last': self._limit_to_last,
+            'start_after': self._start_after,
+            'end_before': self._end_before,
+            'fields': self._fields
+        }
+        state.update(changes)
+        return MemoryQuery(self._client, self._collection_name, **state)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is None:
+            filter = FieldFilter(field_path, op_string, value)
+        return self._copy(filters=self._filters + (filter,))
+
+    def order_by(self, field_path, direction=firestore.Query.ASCENDING):
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count):
+        return self._copy(limit=count, limit_to_last=False)
+
+    def limit_to_last(self, count):
+        return self._copy(limit=count, limit_to_last=True)
+
+    def offset(self, num_to_skip):
+        return self._copy(offset=num_to_skip)
+
+    def select(self, field_paths):
+        return self._copy(fields=list(field_paths))
+
+    def start_after(self, document_fields):
+        return self._copy(start_after=document_fields)
+
+    def end_before(self, document_fields):
+        return self._copy(end_before=document_fields)
+
+    def count(self, alias=None):
+        return MemoryAggregationQuery(self, alias)
+
+    def sum(self, field_ref, alias=None):
+        return MemoryAggregationQuery(self, alias, field=field_ref)
+
+    def _effective_orders(self):
+        """Explicit orders, then the first inequality field, then the document ID"""
+        orders = list(self._orders)
+        ordered_fields = {field for field, _ in orders}
+        for field_filter in self._filters:
+            if field_filter.op_string in ('<', '<=', '>', '>=', '!=', 'not-in') and field_filter.field_path not in ordered_fields:
+                orders.append((field_filter.field_path, firestore.Query.ASCENDING))
+                break
+        return orders
+
+    def _position(self, orders, document_id, data):
+        """Comparable position of a document in the query's sort order"""
+        key = []
+        for field, direction in orders:
+            value = document_id if field == '__name__' else _get_field(data, field)[1]
+            field_key = _sort_key(value)
+            key.append(_Reversed(field_key) if direction == firestore.Query.DESCENDING else field_key)
+        # Ties are broken by document ID in the direction of the last order
+        last_descending = bool(orders) and orders[-1][1] == firestore.Query.DESCENDING
+        key.append(_Reversed(document_id) if last_descending else document_id)
+        return tuple(key)
+
+    def _cursor_position(self, orders, cursor):
+        """Position of a cursor: a snapshot, or a dict of ordered field values ('__name__' for the ID)"""
+        if isinstance(cursor, dict):
+            return self._position(orders, cursor.get('__name__', ''), cursor)
+        return self._position(orders, cursor.id, cursor._data or {})
+
+    def _matching_documents(self):
+        """Filtered and ordered (document_id, data) pairs, before cursors and limits"""
+        orders = self._effective_orders()
+        documents = []
+        for document_id, data in self._client.scan(self._collection_name):
+            # Documents missing an ordered field are excluded, as in Firestore
+            if any(field != '__name__' and not _get_field(data, field)[0] for field, _ in orders):
+                continue
+            if all(_matches(data, field_filter) for field_filter in self._filters):
+                documents.append((document_id, data))
+        documents.sort(key=lambda item: self._position(orders, *item))
+        return documents
+
+    def _execute(self):
+        self._client.simulate_latency()
+        orders = self._effective_orders()
+        documents = self._matching_documents()
+
+        if self._start_after is not None:
+            cursor = self._cursor_position(orders, self._start_after)
+            documents = [item for item in documents if self._position(orders, *item) > cursor]
+        if self._end_before is not None:
+            cursor = self._cursor_position(orders, self._end_before)
+            documents = [item for item in documents if self._position(orders, *item) < cursor]
+
+        documents = documents[self._offset:]
+        if self._limit is not None:
+            documents = documents[-self._limit:] if self._limit_to_last else documents[:self._limit]
+
+        self._client.stats.record_read(self._collection_name, len(documents))
+        return [
+            MemorySnapshot(MemoryDocumentReference(self._client, self._collection_name, document_id), data, self._fields)
+            for document_id, data in documents
+        ]
+
+    def stream(self, transaction=None):
+        if self._limit_to_last:
+            raise ValueError("Query results for queries that include limit_to_last() constraints cannot be streamed. Use Query.get() instead.")
+        return iter(self._execute())
+
+    def get(self, transaction=None):
+        return self._execute()
+
+class _Reversed:
+    """Wraps a sort key so it orders descending"""
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return self.key > other.key
+
+    def __gt__(self, other):
+        return self.key < other.key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+class MemoryCollectionReference(MemoryQuery):
+    """Minimal CollectionReference"""
+
+    def __init__(self, client, collection_name):
+        super().__init__(client, collection_name)
+        self.id = collection_name
+
+    def document(self, document_id):
+        return MemoryDocumentReference(self._client, self._collection_name, document_id)
+
+class MemoryWriteBatch:
+    """Buffers writes and applies them atomically on commit"""
+
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def create(self, reference, document_data):
+        self._writes.append(('create', reference, document_data, False))
+
+    def set(self, reference, document_data, merge=False):
+        self._writes.append(('set', reference, document_data, merge))
+
+    def update(self, reference, field_updates):
+        self._writes.append(('update', reference, field_updates, True))
+
+    def delete(self, reference):
+        self._writes.append(('delete', reference, None, False))
+
+    def commit(self):
+        self._client.simulate_latency()
+        self._client.apply_writes(self._writes)
+        self._writes = []
+
+class MemoryFirestoreClient:
+    """
+    In-memory Firestore client supporting the API surface FirebaseDB uses
+    latency: simulated seconds per RPC, to model network round trips
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.stats = ReadStats()
+        self._collections = defaultdict(dict)
+        # Re-entrant so transactions can commit while holding it
+        self.lock = threading.RLock()
+
+    def simulate_latency(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def without_latency(self):
+        """A view of the same documents, stats and lock that does not sleep"""
+        view = copy.copy(self)
+        view.latency = 0.0
+        return view
+
+    def collection(self, collection_name):
+        return MemoryCollectionReference(self, collection_name)
+
+    def batch(self):
+        return MemoryWriteBatch(self)
+
+    def get_all(self, references, transaction=None):
+        self.simulate_latency()
+        snapshots = []
+        for index, reference in enumerate(references):
+            data = self.read_document(reference.collection_name, reference.id)
+            # One RPC for the whole batch, one read per document
+            self.stats.record_read(reference.collection_name, 1, rpc=index == 0)
+            snapshots.append(MemorySnapshot(reference, data))
+        return snapshots
+
+    def read_document(self, collection_name, document_id):
+        with self.lock:
+            return self._collections[collection_name].get(document_id)
+
+    def scan(self, collection_name):
+        with self.lock:
+            return list(self._collections[collection_name].items())
+
+    def seed(self, collection_name, document_id, data):
+        """Insert a document directly, bypassing stats and latency"""
+        with self.lock:
+            self._collections[collection_name][document_id] = copy.deepcopy(data)
+
+    def size(self, collection_name):
+        with self.lock:
+            return len(self._collections[collection_name])
+
+    def apply_writes(self, writes):
+        with self.lock:
+            # Validate first so a failing write leaves the batch unapplied
+            for kind, reference, _, _ in writes:
+                if kind == 'update' and reference.id not in self._collections[reference.collection_name]:
+                    raise KeyError(f"No document to update: {reference.collection_name}/{reference.id}")
+                if kind == 'create' and reference.id in self._collections[reference.collection_name]:
+                    raise AlreadyExists(f"Document already exists: {reference.collection_name}/{reference.id}")
+
+            for kind, reference, data, merge in writes:
+                documents = self._collections[reference.collection_name]
+                self.stats.record_write(reference.collection_name)
+                if kind == 'delete':
+                    documents.pop(reference.id, None)
+                    continue
+
+                current = documents.get(reference.id) if merge else None
+                document = copy.deepcopy(current) if current else {}
+                for field, value in data.items():
+                    if isinstance(value, Increment):
+                        previous = document.get(field, 0)
+                        value = (previous if isinstance(previous, (int, float)) else 0) + value.value
+                    document[field] = copy.deepcopy(value)
+                documents[reference.id] = document
+
+class AsyncMemoryDocumentReference:
+    """AsyncDocumentReference over a MemoryDocumentReference"""
+
+    def __init__(self, client, reference):
+        self._client = client
+        self._reference = reference
+        self.collection_name = reference.collection_name
+        self.id = reference.id
+
+    async def get(self, transaction=None):
+        await self._client.simulate_latency()
+        return self._reference.get()
+
+    async def set(self, data, merge=False):
+        await self._client.simulate_latency()
+        self._reference.set(data, merge=merge)
+
+    async def update(self, data):
+        await self._client.simulate_latency()
+        self._reference.update(data)
+
+    async def delete(self):
+        await self._client.simulate_latency()
+        self._reference.delete()
+
+class AsyncMemoryAggregationQuery:
+    """AsyncAggregationQuery over a MemoryAggregationQuery"""
+
+    def __init__(self, client, aggregation):
+        self._client = client
+        self._aggregation = aggregation
+
+    async def get(self):
+        await self._client.simulate_latency()
+        return self._aggregation.get()
+
+class AsyncMemoryQuery:
+    """AsyncQuery over a MemoryQuery; builder methods return wrapped queries"""
+
+    def __init__(self, client, query):
+        self._client = client
+        self._query = query
+
+    def _wrap(self, result):
+        if isinstance(result, MemoryAggregationQuery):
+            return AsyncMemoryAggregationQuery(self._client, result)
+        return AsyncMemoryQuery(self._client, result)
+
+    def where(self, *args, **kwargs):
+        return self._wrap(self._query.where(*args, **kwargs))
+
+    def order_by(self, *args, **kwargs):
+        return self._wrap(self._query.order_by(*args, **kwargs))
+
+    def limit(self, count):
+        return self._wrap(self._query.limit(count))
+
+    def limit_to_last(self, count):
+        return self._wrap(self._query.limit_to_last(count))
+
+    def offset(self, num_to_skip):
+        return self._wrap(self._query.offset(num_to_skip))
+
+    def select(self, field_paths):
+        return self._wrap(self._query.select(field_paths))
+
+    def start_after(self, document_fields):
+        return self._wrap(self._query.start_after(document_fields))
+
+    def end_before(self, document_fields):
+        return self._wrap(self._query.end_before(document_fields))
+
+    def count(self, alias=None):
+        return self._wrap(self._query.count(alias))
+
+    def sum(self, field_ref, alias=None):
+        return self._wrap(self._query.sum(field_ref, alias))
+
+    async def stream(self, transaction=None):
+        await self._client.simulate_latency()
+        for snapshot in self._query.stream():
+            yield snapshot
+
+    async def get(self, transaction=None):
+        await self._client.simulate_latency()
+        return self._query.get()
+
+class AsyncMemoryCollectionReference(AsyncMemoryQuery):
+    """AsyncCollectionReference over a MemoryCollectionReference"""
+
+    def __init__(self, client, collection):
+        super().__init__(client, collection)
+        self.id = collection.id
+
+    def document(self, document_id):
+        return AsyncMemoryDocumentReference(self._client, self._query.document(document_id))
+
+class AsyncMemoryWriteBatch:
+    """AsyncWriteBatch over a MemoryWriteBatch"""
+
+    def __init__(self, client, batch):
+        self._client = client
+        self._batch = batch
+
+    def create(self, reference, document_data):
+        self._batch.create(reference._reference, document_data)
+
+    def set(self, reference, document_data, merge=False):
+        self._batch.set(reference._reference, document_data, merge=merge)
+
+    def update(self, reference, field_updates):
+        self._batch.update(reference._reference, field_updates)
+
+    def delete(self, reference):
+        self._batch.delete(reference._reference)
+
+    async def commit(self):
+        await self._client.simulate_latency()
+        self._batch.commit()
+
+class AsyncMemoryFirestoreClient:
+    """
+    AsyncClient over a MemoryFirestoreClient's documents
+    Latency is awaited instead of slept, so concurrent requests overlap on one event loop
+    """
+
+    def __init__(self, client):
+        self.latency = client.latency
+        self.stats = client.stats
+        self._client = client.without_latency()
+
+    async def simulate_latency(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def collection(self, collection_name):
+        return AsyncMemoryCollectionReference(self, self._client.collection(collection_name))
+
+    def batch(self):
+        return AsyncMemoryWriteBatch(self, self._client.batch())
+
+    async def get_all(self, references, transaction=None):
+        await self.simulate_latency()
+        for snapshot in self._client.get_all([reference._reference for reference in references]):
+            yield snapshot
+
+class InMemoryFirebaseDB(FirebaseDB):
+    """FirebaseDB backed by MemoryFirestoreClient instead of a Firebase project"""
+
+    def __init__(self, latency=0.0):
+        super().__init__()
+        self.db = MemoryFirestoreClient(latency=latency)
+
+    def _ensure_initialized(self):
+        """Set up the collection mapping without touching firebase_admin"""
+        if not self._initialized:
+            self.collections = {
+                name: name for name in [
+                    'users', 'businesses', 'customers', 'customer_credits', 'transactions',
+                    'recurring_transactions', 'products', 'vouchers', 'offers',
+                    'business_summaries', 'tombstones', 'scheduler_locks', 'phone_index'
+                ]
+            }
+            self._initialized = True
+
+    @property
+    def stats(self):
+        return self.db.stats
+
+    def seed(self, collection_name, document_id, data):
+        """Insert a document without going through the cache or read/write counters"""
+        self.db.seed(collection_name, document_id, data)
+
+    def run_transaction(self, reads, build_operations):
+        """Serialize transactions on the client lock instead of Firestore's optimistic retries"""
+        try:
+            self._ensure_initialized()
+
+            written = []
+            try:
+                with self.db.lock, track_call('transaction_write', 'transaction') as call:
+                    documents = {}
+                    for collection_name, document_id in reads:
+                        with track_call('get', collection_name, 'transaction') as read_call:
+                            snapshot = self._doc_ref(collection_name, document_id).get()
+                            documents[(collection_name, document_id)] = self._doc_to_dict(snapshot)
+                            read_call.documents = 1
+
+                    batch = self.db.batch()
+                    for op_type, collection_name, document_id, data in build_operations(documents):
+                        self._apply_operation(batch, op_type, self._doc_ref(collection_name, document_id), data)
+                        written.append((collection_name, document_id))
+                    batch.commit()
+                    call.collection = ','.join(sorted({name for name, _ in written}))
+                    call.documents = len(written)
+            finally:
+                for collection_name, document_id in written:
+                    self._invalidate_cache(collection_name, document_id)
+            return True
+
+        except Exception as e:
+            logger.error(f"Firebase transaction error: {e}")
+            return False
+
+class InMemoryAsyncFirebaseDB(AsyncFirebaseDB):
+    """AsyncFirebaseDB over the documents and cache of an InMemoryFirebaseDB"""
+
+    def __init__(self, sync_db):
+        super().__init__(share_cache_with=sync_db)
+        self._sync_db = sync_db
+        self.db = AsyncMemoryFirestoreClient(sync_db.db)
+
+    def _ensure_initialized(self):
+        if not self._initialized:
+            self._sync_db._ensure_initialized()
+            self.collections = self._sync_db.collections
+            self._initialized = True
+
+    @property
+    def stats(self):
+        return self.db.stats
+
+    async def run_transaction(self, reads, build_operations):
+        """Transactions are serialized on the client lock, so run the sync fake's on a thread"""
+        return await asyncio.to_thread(self._sync_db.run_transaction, reads, build_operations)
@@ -41,6 +41,11 @@ class Query:
         """Search for documents (limited support in Firestore)"""
         return {'type': 'search', 'attribute': attribute, 'value': value}
     
+    @staticmethod
+    def contains(attribute, value):
+        """Query for documents where the array attribute contains value"""
+        return {'type': 'contains', 'attribute': attribute, 'value': value}
+    
     @staticmethod
     def isNull(attribute):
         """Query for documents where attribute is null"""
@@ -110,3 +115,8 @@ class Query:
     def cursorBefore(documentId):
         """Cursor for pagination"""
         return {'type': 'cursorBefore', 'documentId': documentId}
+    
+    @staticmethod
+    def cursorAfterValues(values):
+        """Cursor after a position given by the values of the ordered fields ('$id' for the document ID)"""
+        return {'type': 'cursorAfterValues', 'values': values}
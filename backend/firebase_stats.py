@@ -0,0 +1,152 @@
+"""
+Firebase Stats - Per-request accounting of Firestore RPCs
+Every FirebaseDB RPC is recorded against the active request (if any) with its
+collection, query shape, document count, approximate bytes and wall time.
+RPCs slower than FIREBASE_SLOW_QUERY_MS are logged to the firebase.slow_queries logger.
+"""
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from firebase_cache import estimate_size
+
+slow_query_logger = logging.getLogger('firebase.slow_queries')
+
+# RPCs at or above this wall time (milliseconds) go to the slow-query log
+SLOW_QUERY_MS = float(os.environ.get('FIREBASE_SLOW_QUERY_MS', 500))
+
+# Aggregation queries are billed one read per this many index entries
+AGGREGATION_ENTRIES_PER_READ = 1000
+
+# Operations that write documents rather than read them
+WRITE_OPERATIONS = ('create', 'update', 'delete', 'batch', 'transaction_write')
+
+_current_stats = contextvars.ContextVar('firebase_request_stats', default=None)
+
+def query_shape(queries):
+    """Describe Appwrite-style queries without their values, e.g. 'equal(business_id) orderDesc(created_at)'"""
+    parts = []
+    for q in queries or []:
+        if not isinstance(q, dict):
+            parts.append(type(q).__name__)
+        elif q.get('attribute'):
+            parts.append(f"{q.get('type')}({q['attribute']})")
+        elif q.get('attributes'):
+            parts.append(f"{q.get('type')}({','.join(q['attributes'])})")
+        else:
+            parts.append(str(q.get('type')))
+    return ' '.join(parts)
+
+class CallRecord:
+    """A single Firestore RPC"""
+
+    __slots__ = ('operation', 'collection', 'shape', 'documents', 'bytes', 'seconds', 'results')
+
+    def __init__(self, operation, collection, shape=''):
+        self.operation = operation
+        self.collection = collection
+        self.shape = shape
+        self.documents = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        # Documents returned by the RPC; sized only when the call is actually recorded
+        self.results = None
+
+    def set_results(self, documents):
+        """Record the documents an RPC returned or wrote"""
+        self.results = documents
+        self.documents = len(documents)
+
+    @property
+    def reads(self):
+        """Billed document reads for this RPC"""
+        if self.operation in WRITE_OPERATIONS:
+            return 0
+        if self.operation == 'aggregate':
+            return max(1, -(-self.documents // AGGREGATION_ENTRIES_PER_READ))
+        # Queries are billed at least one read even when nothing matches
+        return max(1, self.documents)
+
+    def to_dict(self):
+        return {
+            'operation': self.operation,
+            'collection': self.collection,
+            'shape': self.shape,
+            'documents': self.documents,
+            'bytes': self.bytes,
+            'ms': round(self.seconds * 1000, 2)
+        }
+
+class RequestStats:
+    """Firestore RPCs made while serving one request; safe to share with pool threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = []
+
+    def add(self, call):
+        with self._lock:
+            self.calls.append(call)
+
+    def summary(self):
+        """Totals overall and per collection"""
+        with self._lock:
+            calls = list(self.calls)
+
+        by_collection = {}
+        for call in calls:
+            entry = by_collection.setdefault(call.collection, {'calls': 0, 'reads': 0, 'writes': 0, 'bytes': 0, 'ms': 0.0})
+            entry['calls'] += 1
+            entry['reads'] += call.reads
+            entry['writes'] += call.documents if call.operation in WRITE_OPERATIONS else 0
+            entry['bytes'] += call.bytes
+            entry['ms'] += call.seconds * 1000
+
+        for entry in by_collection.values():
+            entry['ms'] = round(entry['ms'], 2)
+
+        return {
+            'calls': len(calls),
+            'reads': sum(entry['reads'] for entry in by_collection.values()),
+            'writes': sum(entry['writes'] for entry in by_collection.values()),
+            'bytes': sum(entry['bytes'] for entry in by_collection.values()),
+            'ms': round(sum(call.seconds for call in calls) * 1000, 2),
+            'by_collection': by_collection
+        }
+
+def start_request():
+    """Start collecting RPCs for the current request; returns a token for end_request"""
+    return _current_stats.set(RequestStats())
+
+def end_request(token):
+    """Stop collecting RPCs for the current request"""
+    _current_stats.reset(token)
+
+def current_stats():
+    """Get the RequestStats for the active request, or None outside a request"""
+    return _current_stats.get()
+
+@contextmanager
+def track_call(operation, collection_name, shape=''):
+    """
+    Time a Firestore RPC and record it against the active request
+    The caller reports what the RPC returned with call.set_results()
+    """
+    call = CallRecord(operation, collection_name, shape)
+    started = time.perf_counter()
+    try:
+        yield call
+    finally:
+        call.seconds = time.perf_counter() - started
+        stats = _current_stats.get()
+        slow = call.seconds * 1000 >= SLOW_QUERY_MS
+        if call.results and (stats is not None or slow):
+            call.bytes = sum(estimate_size(document) for document in call.results)
+        call.results = None
+        if stats is not None:
+            stats.add(call)
+        if slow:
+            slow_query_logger.warning(json.dumps({'event': 'slow_query', **call.to_dict()}))
@@ -1,30 +1,154 @@
 """
 Firebase Database Utilities - Replacement for Appwrite operations
 """
+import base64
+import contextvars
 import json
 import logging
 import os
+import threading
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from dotenv import load_dotenv
 import firebase_admin
 from firebase_admin import credentials, firestore, auth
 from google.cloud.firestore_v1.base_query import FieldFilter
+from firebase_cache import LRUCache
+from firebase_query import Query
+from firebase_stats import track_call, query_shape
+import query_planner
 
 # Load environment variables
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
-class FirebaseDB:
+# Firestore rejects batches and transactions with more than 500 writes
+BATCH_LIMIT = 500
+
+# Documents fetched per get_all RPC in get_many
+GET_MANY_CHUNK_SIZE = 100
+
+# Shared worker pool for overlapping independent Firestore RPCs
+_executor = None
+_executor_lock = threading.Lock()
+
+# Set inside pool threads so nested fan-outs run inline instead of deadlocking the pool
+_in_pool = contextvars.ContextVar('firestore_in_pool', default=False)
+
+def get_executor():
+    """Get the process-wide thread pool used for concurrent Firestore calls"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=int(os.environ.get('FIREBASE_MAX_WORKERS', 8)),
+                    thread_name_prefix='firestore'
+                )
+    return _executor
+
+def _run_in_pool(call):
+    """Run a call in a pool thread, marking the context as pooled"""
+    _in_pool.set(True)
+    return call()
+
+def run_concurrently(calls):
+    """
+    Run independent zero-argument callables on the shared pool and return their results in order
+    Each call runs in a copy of the caller's context, so request-scoped state follows it
+    Exceptions raised by a call are re-raised in the caller
+    """
+    calls = list(calls)
+    if len(calls) <= 1 or _in_pool.get():
+        return [call() for call in calls]
+    
+    futures = [
+        get_executor().submit(contextvars.copy_context().run, _run_in_pool, call)
+        for call in calls
+    ]
+    return [future.result() for future in futures]
+
+# Query types that position the result window rather than filter it
+CURSOR_QUERY_TYPES = ('cursorAfter', 'cursorBefore')
+
+# Firestore's name for the document ID in orders and cursors ('$id' in queries)
+DOCUMENT_ID_FIELD = '__name__'
+
+# Query types whose field Firestore orders results by (range filters order implicitly)
+ORDERING_QUERY_TYPES = (
+    'orderAsc', 'orderDesc', 'notEqual', 'lessThan', 'lessThanEqual',
+    'greaterThan', 'greaterThanEqual', 'between', 'startsWith'
+)
+
+# Documents fetched per page by iter_documents
+ITER_PAGE_SIZE = int(os.environ.get('FIREBASE_ITER_PAGE_SIZE', 500))
+
+def encode_page_token(document_id):
+    """Encode the last document of a page as an opaque page token"""
+    payload = json.dumps({'after': document_id}).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+def decode_page_token(page_token):
+    """Decode a page token into the document ID to resume after, or None if invalid"""
+    try:
+        padded = page_token + '=' * (-len(page_token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        document_id = payload.get('after')
+        return document_id if isinstance(document_id, str) and document_id else None
+    except (ValueError, TypeError, AttributeError):
+        return None
+
+class _ListResults:
+    """
+    Result handling shared by the sync and async list_documents
+    add() each fetched snapshot in order until it returns True, then finish() the call
+    """
+    
+    def __init__(self, to_dict, plan, limit, from_end):
+        self.to_dict = to_dict
+        self.plan = plan
+        self.limit = limit
+        self.from_end = from_end
+        self.documents = []
+    
+    def add(self, snapshot):
+        """Admit a fetched snapshot; True once no more are needed"""
+        document = self.to_dict(snapshot)
+        if document is not None:
+            document = self.plan.admit(document)
+        if document is not None:
+            self.documents.append(document)
+        # cursorBefore keeps the last matches, so everything before the cursor is read
+        return not self.from_end and self.plan.satisfied(self.limit)
+    
+    def finish(self, call):
+        """Trim the results and record them on the list call"""
+        if self.from_end and self.limit is not None:
+            self.documents = self.documents[-self.limit:] if self.limit else []
+        call.set_results(self.documents)
+        call.documents = max(call.documents, self.plan.scanned)
+        return self.documents
+
+class BaseFirebaseDB:
+    """
+    State, caching and query/result helpers shared by FirebaseDB and AsyncFirebaseDB
+    Subclasses provide the Firestore client (_client) and the public methods, which
+    are plain calls on FirebaseDB and coroutines on AsyncFirebaseDB
+    """
+    
     def __init__(self):
         self._initialized = False
         self.db = None
         self.collections = None
-        # Simple in-memory cache to reduce duplicate API calls
-        self._cache = {}
-        self._cache_ttl = 60  # Cache for 60 seconds
-        
+        # Bounded LRU cache to reduce duplicate API calls, invalidated on every write
+        self._cache = LRUCache(
+            max_entries=int(os.environ.get('FIREBASE_CACHE_MAX_ENTRIES', 2000)),
+            max_bytes=int(os.environ.get('FIREBASE_CACHE_MAX_BYTES', 16 * 1024 * 1024)),
+            default_ttl=int(os.environ.get('FIREBASE_CACHE_TTL', 60))
+        )
+    
     def _ensure_initialized(self):
         """Initialize Firebase config when first used"""
         if not self._initialized:
@@ -50,7 +174,7 @@ class FirebaseDB:
                 firebase_admin.initialize_app(cred)
             
             # Get Firestore client
-            self.db = firestore.client()
+            self.db = self._client()
             
             # Collection names mapping
             self.collections = {
@@ -62,7 +186,11 @@ class FirebaseDB:
                 'recurring_transactions': 'recurring_transactions',
                 'products': 'products',
                 'vouchers': 'vouchers',
-                'offers': 'offers'
+                'offers': 'offers',
+                'business_summaries': 'business_summaries',
+                'tombstones': 'tombstones',
+                'scheduler_locks': 'scheduler_locks',
+                'phone_index': 'phone_index'
             }
             self._initialized = True
     
@@ -74,26 +202,49 @@ class FirebaseDB:
             return f"{collection_name}:query:{query_hash}"
         return None
     
-    def _is_cache_valid(self, cache_key):
-        """Check if cache entry is still valid"""
-        if cache_key not in self._cache:
-            return False
-        import time
-        return (time.time() - self._cache[cache_key]['timestamp']) < self._cache_ttl
-    
     def _get_from_cache(self, cache_key):
         """Get data from cache"""
-        if self._is_cache_valid(cache_key):
-            return self._cache[cache_key]['data']
-        return None
+        return self._cache.get(cache_key)
+    
+    def _set_cache(self, collection_name, cache_key, data):
+        """Set data in cache using the collection's TTL"""
+        self._cache.set(cache_key, data, self._cache.ttl_for(collection_name))
+    
+    def _invalidate_cache(self, collection_name, document_id):
+        """Drop a cached document after it is written"""
+        self._cache.invalidate(self._get_cache_key(collection_name, document_id))
     
-    def _set_cache(self, cache_key, data):
-        """Set data in cache"""
-        import time
-        self._cache[cache_key] = {
-            'data': data,
-            'timestamp': time.time()
-        }
+    def cache_stats(self):
+        """Get cache hit/miss/eviction counters"""
+        return self._cache.stats()
+    
+    def _doc_ref(self, collection_name, document_id):
+        """Get a Firestore document reference"""
+        return self.db.collection(self.collections[collection_name]).document(document_id)
+    
+    def _apply_operation(self, writer, op_type, doc_ref, data):
+        """Apply a single write operation to a batch or transaction"""
+        # Stamp timestamps like create_document/update_document unless the caller set them
+        if op_type in ('create', 'insert'):
+            data = {'created_at': datetime.utcnow().isoformat(), **data}
+            data.setdefault('updated_at', data['created_at'])
+        elif op_type in ('update', 'merge'):
+            data = {'updated_at': datetime.utcnow().isoformat(), **data}
+        
+        if op_type == 'create':
+            writer.set(doc_ref, data)
+        elif op_type == 'insert':
+            # Fails the whole batch or transaction if the document already exists
+            writer.create(doc_ref, data)
+        elif op_type == 'update':
+            writer.update(doc_ref, data)
+        elif op_type == 'merge':
+            writer.set(doc_ref, data, merge=True)
+        elif op_type == 'increment':
+            # Server-side increments, creating the document if it does not exist
+            writer.set(doc_ref, {field: firestore.Increment(value) for field, value in data.items()}, merge=True)
+        elif op_type == 'delete':
+            writer.delete(doc_ref)
     
     def _doc_to_dict(self, doc):
         """Convert Firestore document to dictionary with $id field"""
@@ -102,88 +253,178 @@ class FirebaseDB:
         data = doc.to_dict()
         data['$id'] = doc.id
         return data
-        
-    def create_document(self, collection_name, document_id, data):
-        """Create a new document in collection"""
-        try:
-            self._ensure_initialized()
-            collection_ref = self.db.collection(self.collections[collection_name])
-            
-            # Add timestamp if not present
-            if 'created_at' not in data:
-                data['created_at'] = datetime.now().isoformat()
-            
-            # Set document with specific ID
-            doc_ref = collection_ref.document(document_id)
-            doc_ref.set(data)
-            
-            # Return document with $id field for compatibility
-            result = data.copy()
-            result['$id'] = document_id
-            return result
-            
-        except Exception as e:
-            logger.error(f"Firebase create error: {e}")
-            return None
-
-    def get_document(self, collection_name, document_id):
-        """Get a single document by ID with caching"""
-        try:
-            self._ensure_initialized()
-            
-            # Check cache first
-            cache_key = self._get_cache_key(collection_name, document_id)
-            cached_result = self._get_from_cache(cache_key)
+    
+    def _cached_documents(self, collection_name, document_ids):
+        """
+        Serve what get_many can from the cache
+        Returns (results, chunks of the IDs still to fetch, GET_MANY_CHUNK_SIZE each)
+        """
+        results = {}
+        missing = []
+        for document_id in dict.fromkeys(document_ids):
+            if not document_id:
+                continue
+            cached_result = self._get_from_cache(self._get_cache_key(collection_name, document_id))
             if cached_result is not None:
-                return cached_result
-            
-            doc_ref = self.db.collection(self.collections[collection_name]).document(document_id)
-            doc = doc_ref.get()
-            
-            result = self._doc_to_dict(doc)
-            
-            # Cache the result
-            if result:
-                self._set_cache(cache_key, result)
-            return result
-            
-        except Exception as e:
-            logger.error(f"Firebase get error: {e}")
-            return None
-
-    def list_documents(self, collection_name, queries=None, limit=5000):
+                results[document_id] = cached_result
+            else:
+                missing.append(document_id)
+        return results, [missing[i:i + GET_MANY_CHUNK_SIZE] for i in range(0, len(missing), GET_MANY_CHUNK_SIZE)]
+    
+    def _cache_documents(self, collection_name, results, documents):
+        """Cache fetched documents and add them to get_many results"""
+        for document in documents:
+            self._set_cache(collection_name, self._get_cache_key(collection_name, document['$id']), document)
+            results[document['$id']] = document
+    
+    def _list_plan(self, collection_name, queries, limit):
         """
-        List documents with optional queries
-        queries should be a list of Query objects (for Appwrite compatibility)
+        Plan a list_documents call
+        Returns (plan, limit, query, cursors): the query has every native query applied
+        except the cursors, whose documents must be fetched before they can position it
         """
-        try:
-            self._ensure_initialized()
-            collection_ref = self.db.collection(self.collections[collection_name])
-            query = collection_ref
-            
-            # Parse Appwrite-style queries and convert to Firestore
-            if queries:
-                for q in queries:
-                    query = self._parse_query(query, q)
-            
-            # Apply limit
-            query = query.limit(limit)
-            
-            # Execute query
-            docs = query.stream()
-            
-            # Convert to list of dicts with $id field
-            results = []
-            for doc in docs:
-                doc_dict = self._doc_to_dict(doc)
-                if doc_dict:
-                    results.append(doc_dict)
-            
-            return results
-            
-        except Exception as e:
-            logger.error(f"Firebase list error: {e}")
-            return []
+        plan = query_planner.plan(queries)
+        query = self.db.collection(self.collections[collection_name])
+        cursors = []
+        for q in plan.native:
+            if isinstance(q, dict) and q.get('type') in CURSOR_QUERY_TYPES:
+                cursors.append(q)
+            else:
+                query = self._parse_query(query, q)
+        return plan, plan.result_limit(limit), query, cursors
+    
+    def _list_results(self, plan, limit, from_end):
+        """Collector for the documents list_documents returns"""
+        return _ListResults(self._doc_to_dict, plan, limit, from_end)
+    
+    @staticmethod
+    def _list_query(query, plan, limit, positions):
+        """
+        The query list_documents runs, positioned at (cursor, snapshot) pairs
+        Returns (query, from_end); from_end queries must be fetched with get()
+        """
+        from_end = False
+        for cursor, snapshot in positions:
+            if cursor['type'] == 'cursorAfter':
+                query = query.start_after(snapshot)
+            else:
+                query = query.end_before(snapshot)
+                from_end = True
+        
+        # With a residual filter the matches can be anywhere, so stream without a limit
+        # and stop once enough documents match
+        if plan.residual or limit is None:
+            return query, from_end
+        # cursorBefore returns the page immediately preceding the cursor,
+        # which Firestore only supports through limit_to_last (not streamable)
+        return (query.limit_to_last(limit) if from_end else query.limit(limit)), from_end
+    
+    @staticmethod
+    def _page_queries(queries, page_token):
+        """Queries for list_page resuming after page_token; raises ValueError for a bad token"""
+        queries = list(queries or [])
+        if page_token:
+            after_id = decode_page_token(page_token)
+            if not after_id:
+                raise ValueError('Invalid page token')
+            queries.append(Query.cursorAfter(after_id))
+        return queries
+    
+    @staticmethod
+    def _split_page(documents, page_size):
+        """(page, next_page_token) from up to page_size + 1 documents"""
+        if len(documents) > page_size:
+            documents = documents[:page_size]
+            return documents, encode_page_token(documents[-1]['$id'])
+        return documents, None
+    
+    def _iter_plan(self, collection_name, queries, page_size):
+        """Plan an iter_documents call: (plan, query, page_size)"""
+        self._ensure_initialized()
+        query = self.db.collection(self.collections[collection_name])
+        plan = query_planner.plan(queries)
+        
+        for q in self._cursor_safe_queries(plan.native):
+            query = self._parse_query(query, q)
+        
+        # Without a residual filter every fetched document counts towards the limit
+        if plan.limit is not None and not plan.residual:
+            page_size = max(1, min(page_size, plan.limit))
+        return plan, query, page_size
+    
+    @staticmethod
+    def _page_query(query, page_size, last_snapshot):
+        """The query for the iter_documents page after last_snapshot (None for the first)"""
+        query = query.limit(page_size)
+        return query if last_snapshot is None else query.start_after(last_snapshot)
+    
+    def _page_documents(self, snapshots, call):
+        """Documents of one fetched iter_documents page, recorded on its call"""
+        documents = [document for document in map(self._doc_to_dict, snapshots) if document]
+        call.set_results(documents)
+        return documents
+    
+    @staticmethod
+    def _cursor_safe_queries(queries):
+        """
+        Queries for iter_documents, which positions every page itself
+        A page cursor needs the values of the fields results are ordered by, so those
+        fields are added to any select
+        """
+        ordered_fields = []
+        for q in queries:
+            if isinstance(q, dict) and q.get('type') in CURSOR_QUERY_TYPES + ('cursorAfterValues', 'offset'):
+                raise ValueError(f"iter_documents does not support {q['type']} queries")
+            if isinstance(q, dict) and q.get('type') in ORDERING_QUERY_TYPES and q['attribute'] != '$id':
+                ordered_fields.append(q['attribute'])
+        
+        safe_queries = []
+        for q in queries:
+            if isinstance(q, dict) and q.get('type') == 'select':
+                missing = [field for field in ordered_fields if field not in q['attributes']]
+                q = {**q, 'attributes': list(q['attributes']) + list(dict.fromkeys(missing))}
+            safe_queries.append(q)
+        return safe_queries
+    
+    def _aggregate_query(self, collection_name, plan):
+        """The Firestore query an aggregation without residual queries runs over"""
+        query = self.db.collection(self.collections[collection_name])
+        for q in plan.native:
+            query = self._parse_query(query, q)
+        if plan.limit is not None:
+            query = query.limit(plan.limit)
+        return query
+    
+    @staticmethod
+    def _aggregate_value(results, label, call):
+        """The value of a fetched aggregation, recorded on its call"""
+        value = results[0][0].value
+        # Counts tell us how many index entries were scanned; sums are billed the minimum
+        if label == 'count':
+            call.documents = value
+        return value
+    
+    @staticmethod
+    def _aggregate_documents_queries(plan, field):
+        """Queries reading just the fields a residual aggregation needs"""
+        fields = [q['attribute'] for q in plan.residual] + ([field] if field else [])
+        native = [q for q in plan.native if not (isinstance(q, dict) and q.get('type') == 'select')]
+        return native + [Query.select(list(dict.fromkeys(fields)))]
+    
+    @staticmethod
+    def _accumulate(value, document, field):
+        """Add a matching document to a residual count (field None) or sum"""
+        if field is None:
+            return value + 1
+        field_value = query_planner.field_value(document, field)
+        if isinstance(field_value, (int, float)) and not isinstance(field_value, bool):
+            return value + field_value
+        return value
+    
+    @staticmethod
+    def _field_path(attribute):
+        """Firestore field path of a query attribute ('$id' is the document ID)"""
+        return DOCUMENT_ID_FIELD if attribute == '$id' else attribute
     
     def _parse_query(self, query, appwrite_query):
         """
@@ -225,17 +466,36 @@ class FirebaseDB:
                 query = query.where(filter=FieldFilter(field, '>=', value))
             
             elif query_type == 'orderDesc':
-                field = appwrite_query['attribute']
+                field = self._field_path(appwrite_query['attribute'])
                 query = query.order_by(field, direction=firestore.Query.DESCENDING)
             
             elif query_type == 'orderAsc':
-                field = appwrite_query['attribute']
+                field = self._field_path(appwrite_query['attribute'])
                 query = query.order_by(field, direction=firestore.Query.ASCENDING)
             
+            elif query_type == 'cursorAfterValues':
+                # Positioned by values rather than a fetched snapshot, so the position
+                # holds even after that document is updated
+                values = appwrite_query['values']
+                query = query.start_after({self._field_path(field): value for field, value in values.items()})
+            
             elif query_type == 'limit':
-                # Limit is handled separately in list_documents
+                # Limits are planned by query_planner and applied by the caller
                 pass
             
+            elif query_type == 'offset':
+                query = query.offset(appwrite_query['value'])
+            
+            elif query_type == 'select':
+                # Field mask: only the listed fields (plus the document ID) are returned
+                query = query.select(appwrite_query['attributes'])
+            
+            elif query_type == 'between':
+                # Inclusive range, as in Appwrite
+                field = appwrite_query['attribute']
+                query = query.where(filter=FieldFilter(field, '>=', appwrite_query['start']))
+                query = query.where(filter=FieldFilter(field, '<=', appwrite_query['end']))
+            
             elif query_type == 'startsWith':
                 # Firestore range query for string prefix
                 field = appwrite_query['attribute']
@@ -243,6 +503,11 @@ class FirebaseDB:
                 query = query.where(filter=FieldFilter(field, '>=', value))
                 query = query.where(filter=FieldFilter(field, '<', value + '\uf8ff'))
             
+            elif query_type == 'contains':
+                field = appwrite_query['attribute']
+                value = appwrite_query['value']
+                query = query.where(filter=FieldFilter(field, 'array_contains', value))
+            
             elif query_type == 'isNull':
                 field = appwrite_query['attribute']
                 query = query.where(filter=FieldFilter(field, '==', None))
@@ -252,7 +517,241 @@ class FirebaseDB:
                 query = query.where(filter=FieldFilter(field, '!=', None))
         
         return query
+    
+    def _filter_query(self, collection_name, field, operator, value, limit):
+        """The query_documents query: one filter and a limit"""
+        query = self.db.collection(self.collections[collection_name])
+        return query.where(filter=FieldFilter(field, operator, value)).limit(limit)
 
+
+class FirebaseDB(BaseFirebaseDB):
+    """Firestore access through the blocking client"""
+    
+    def _client(self):
+        """Firestore client for this layer"""
+        return firestore.client()
+    
+    def create_document(self, collection_name, document_id, data):
+        """Create a new document in collection"""
+        try:
+            self._ensure_initialized()
+            collection_ref = self.db.collection(self.collections[collection_name])
+            
+            # Add timestamps if not present; updated_at lets delta sync find new documents
+            if 'created_at' not in data:
+                data['created_at'] = datetime.utcnow().isoformat()
+            if 'updated_at' not in data:
+                data['updated_at'] = data['created_at']
+            
+            # Set document with specific ID
+            doc_ref = collection_ref.document(document_id)
+            with track_call('create', collection_name) as call:
+                doc_ref.set(data)
+                call.set_results([data])
+            
+            # Return document with $id field for compatibility
+            result = data.copy()
+            result['$id'] = document_id
+            
+            # Write-through: the full document is known, so cache it
+            self._set_cache(collection_name, self._get_cache_key(collection_name, document_id), result)
+            return result
+            
+        except Exception as e:
+            logger.error(f"Firebase create error: {e}")
+            return None
+    
+    def get_document(self, collection_name, document_id, use_cache=True):
+        """Get a single document by ID with caching"""
+        try:
+            self._ensure_initialized()
+            
+            # Check cache first
+            cache_key = self._get_cache_key(collection_name, document_id)
+            cached_result = self._get_from_cache(cache_key) if use_cache else None
+            if cached_result is not None:
+                return cached_result
+            
+            doc_ref = self.db.collection(self.collections[collection_name]).document(document_id)
+            with track_call('get', collection_name) as call:
+                doc = doc_ref.get()
+                result = self._doc_to_dict(doc)
+                call.set_results([result] if result else [])
+            
+            # Cache the result
+            if result:
+                self._set_cache(collection_name, cache_key, result)
+            return result
+            
+        except Exception as e:
+            logger.error(f"Firebase get error: {e}")
+            return None
+    
+    def get_many(self, collection_name, document_ids, parallel=False):
+        """
+        Get several documents by ID with batched get_all reads
+        Returns a dict of document_id -> document; missing documents are omitted
+        Set parallel=True to fetch the chunks concurrently on the shared pool
+        """
+        try:
+            self._ensure_initialized()
+            results, chunks = self._cached_documents(collection_name, document_ids)
+            if parallel:
+                fetched = run_concurrently(
+                    lambda chunk=chunk: self._get_all(collection_name, chunk) for chunk in chunks
+                )
+            else:
+                fetched = (self._get_all(collection_name, chunk) for chunk in chunks)
+            
+            for documents in fetched:
+                self._cache_documents(collection_name, results, documents)
+            return results
+            
+        except Exception as e:
+            logger.error(f"Firebase get many error: {e}")
+            return {}
+    
+    def gather(self, calls):
+        """
+        Run independent reads concurrently and return their results in order
+        calls: list of zero-argument callables, e.g.
+            lambda: db.get_document('businesses', business_id)
+        Latency is roughly that of the slowest call instead of the sum of all of them
+        """
+        try:
+            # Initialize up front so the pool threads do not race to do it
+            self._ensure_initialized()
+        except Exception as e:
+            logger.error(f"Firebase initialization error: {e}")
+        return run_concurrently(calls)
+    
+    def _get_all(self, collection_name, document_ids):
+        """Fetch one chunk of documents in a single get_all RPC"""
+        doc_refs = [self._doc_ref(collection_name, document_id) for document_id in document_ids]
+        documents = []
+        with track_call('get_all', collection_name, f"ids({len(doc_refs)})") as call:
+            for doc in self.db.get_all(doc_refs):
+                doc_dict = self._doc_to_dict(doc)
+                if doc_dict:
+                    documents.append(doc_dict)
+            call.set_results(documents)
+        return documents
+    
+    def list_documents(self, collection_name, queries=None, limit=5000):
+        """
+        List documents with optional queries
+        queries should be a list of Query objects (for Appwrite compatibility)
+        A Query.limit among them lowers limit (None for no limit); queries Firestore
+        cannot run are applied to the documents as they stream in (see query_planner)
+        """
+        try:
+            self._ensure_initialized()
+            plan, limit, query, cursors = self._list_plan(collection_name, queries, limit)
+            
+            # Cursors are applied after ordering so they bind to the final sort order
+            positions = []
+            for cursor in cursors:
+                with track_call('get', collection_name, cursor['type']) as call:
+                    snapshot = self._doc_ref(collection_name, cursor['documentId']).get()
+                    call.documents = 1
+                if not snapshot.exists:
+                    logger.warning(f"Cursor document {cursor['documentId']} not found in {collection_name}")
+                    return []
+                positions.append((cursor, snapshot))
+            query, from_end = self._list_query(query, plan, limit, positions)
+            
+            results = self._list_results(plan, limit, from_end)
+            if limit != 0:
+                # Streaming is lazy, so the RPC is timed until the last document arrives
+                with track_call('list', collection_name, query_shape(queries)) as call:
+                    for snapshot in query.get() if from_end else query.stream():
+                        if results.add(snapshot):
+                            break
+                    results.finish(call)
+            
+            plan.report(collection_name, queries)
+            return results.documents
+            
+        except Exception as e:
+            logger.error(f"Firebase list error: {e}")
+            return []
+    
+    def list_page(self, collection_name, queries, page_size, page_token=None):
+        """
+        List one page of documents using cursor pagination
+        Returns (documents, next_page_token); next_page_token is None on the last page
+        queries should include an order so pages are stable
+        """
+        queries = self._page_queries(queries, page_token)
+        # Fetch one extra document to learn whether another page exists
+        return self._split_page(self.list_documents(collection_name, queries, limit=page_size + 1), page_size)
+    
+    def iter_documents(self, collection_name, queries=None, page_size=ITER_PAGE_SIZE):
+        """
+        Yield matching documents lazily, fetching page_size at a time
+        Each page resumes after the last snapshot of the previous one, so memory use is
+        bounded by page_size rather than the size of the result. Unlike list_documents,
+        errors are raised: a failed page must not look like the end of the collection.
+        A Query.limit stops the iteration; residual queries filter each page.
+        """
+        plan, query, page_size = self._iter_plan(collection_name, queries, page_size)
+        try:
+            yield from plan.apply(self._iter_pages(collection_name, query, queries, page_size))
+        finally:
+            plan.report(collection_name, queries, 'iter')
+    
+    def _iter_pages(self, collection_name, query, queries, page_size):
+        """Yield the documents of a query one page_size page at a time"""
+        last_snapshot = None
+        while True:
+            with track_call('list', collection_name, f"{query_shape(queries)} page".strip()) as call:
+                snapshots = list(self._page_query(query, page_size, last_snapshot).stream())
+                documents = self._page_documents(snapshots, call)
+            
+            yield from documents
+            
+            if len(snapshots) < page_size:
+                return
+            last_snapshot = snapshots[-1]
+    
+    def count(self, collection_name, queries=None):
+        """Count matching documents with a server-side aggregation query"""
+        return self._aggregate(collection_name, queries, lambda query: query.count(alias='result'), 'count')
+    
+    def sum(self, collection_name, field, queries=None):
+        """Sum a numeric field over matching documents with a server-side aggregation query"""
+        return self._aggregate(collection_name, queries, lambda query: query.sum(field, alias='result'), f"sum({field})", field)
+    
+    def _aggregate(self, collection_name, queries, build_aggregation, label, field=None):
+        """
+        Run a single aggregation over an Appwrite-style query
+        Billed as one read per 1000 index entries instead of one read per document
+        Queries Firestore cannot run fall back to reading the matching documents
+        """
+        try:
+            self._ensure_initialized()
+            plan = query_planner.plan(queries)
+            if plan.residual:
+                return self._aggregate_documents(collection_name, queries, plan, label, field)
+            
+            with track_call('aggregate', collection_name, f"{query_shape(queries)} {label}".strip()) as call:
+                results = build_aggregation(self._aggregate_query(collection_name, plan)).get()
+                return self._aggregate_value(results, label, call)
+            
+        except Exception as e:
+            logger.error(f"Firebase aggregation error: {e}")
+            return None
+    
+    def _aggregate_documents(self, collection_name, queries, plan, label, field=None):
+        """Count the documents matching a plan with residual queries, or sum field over them"""
+        value = 0
+        documents = self.iter_documents(collection_name, self._aggregate_documents_queries(plan, field))
+        for document in plan.apply(documents, plan.limit):
+            value = self._accumulate(value, document, field)
+        
+        plan.report(collection_name, queries, label)
+        return value
+    
     def update_document(self, collection_name, document_id, data):
         """Update a document"""
         try:
@@ -260,9 +759,12 @@ class FirebaseDB:
             doc_ref = self.db.collection(self.collections[collection_name]).document(document_id)
             
             # Add updated_at timestamp
-            data['updated_at'] = datetime.now().isoformat()
+            data['updated_at'] = datetime.utcnow().isoformat()
             
-            doc_ref.update(data)
+            with track_call('update', collection_name) as call:
+                doc_ref.update(data)
+                call.set_results([data])
+            self._invalidate_cache(collection_name, document_id)
             
             # Return updated document with $id field
             result = data.copy()
@@ -272,13 +774,16 @@ class FirebaseDB:
         except Exception as e:
             logger.error(f"Firebase update error: {e}")
             return None
-
+    
     def delete_document(self, collection_name, document_id):
         """Delete a document"""
         try:
             self._ensure_initialized()
             doc_ref = self.db.collection(self.collections[collection_name]).document(document_id)
-            doc_ref.delete()
+            with track_call('delete', collection_name) as call:
+                doc_ref.delete()
+                call.documents = 1
+            self._invalidate_cache(collection_name, document_id)
             return True
             
         except Exception as e:
@@ -289,27 +794,80 @@ class FirebaseDB:
         """
         Perform batch write operations
         operations: list of tuples (operation_type, collection_name, document_id, data)
-        operation_type: 'create', 'update', 'delete'
+        operation_type: 'create', 'insert', 'update', 'merge', 'increment', 'delete'
+        'create' overwrites an existing document; 'insert' fails the chunk instead
+        'increment' data maps field names to numeric deltas
+        Operations are committed in chunks of BATCH_LIMIT, so only each chunk is atomic
         """
         try:
             self._ensure_initialized()
-            batch = self.db.batch()
             
-            for op_type, collection_name, document_id, data in operations:
-                doc_ref = self.db.collection(self.collections[collection_name]).document(document_id)
+            for start in range(0, len(operations), BATCH_LIMIT):
+                chunk = operations[start:start + BATCH_LIMIT]
+                batch = self.db.batch()
+                for op_type, collection_name, document_id, data in chunk:
+                    doc_ref = self._doc_ref(collection_name, document_id)
+                    self._apply_operation(batch, op_type, doc_ref, data)
+                
+                collection_names = ','.join(sorted({operation[1] for operation in chunk}))
+                with track_call('batch', collection_names) as call:
+                    batch.commit()
+                    call.set_results([data for _, _, _, data in chunk if data])
+                    call.documents = len(chunk)
                 
-                if op_type == 'create':
-                    batch.set(doc_ref, data)
-                elif op_type == 'update':
-                    batch.update(doc_ref, data)
-                elif op_type == 'delete':
-                    batch.delete(doc_ref)
-            
-            batch.commit()
+                for _, collection_name, document_id, _ in chunk:
+                    self._invalidate_cache(collection_name, document_id)
+            
             return True
             
         except Exception as e:
             logger.error(f"Firebase batch write error: {e}")
+            # A failed commit may have partially applied, so drop everything it touched
+            for _, collection_name, document_id, _ in operations:
+                self._invalidate_cache(collection_name, document_id)
+            return False
+    
+    def run_transaction(self, reads, build_operations):
+        """
+        Read documents and apply writes atomically in a Firestore transaction
+        reads: list of (collection_name, document_id) tuples to read first
+        build_operations: callable receiving {(collection_name, document_id): document or None}
+        and returning a list of batch_write style operation tuples.
+        It may be called more than once if Firestore retries the transaction.
+        """
+        try:
+            self._ensure_initialized()
+            
+            written = []
+            
+            @firestore.transactional
+            def run(transaction):
+                written.clear()
+                documents = {}
+                for collection_name, document_id in reads:
+                    with track_call('get', collection_name, 'transaction') as call:
+                        snapshot = self._doc_ref(collection_name, document_id).get(transaction=transaction)
+                        documents[(collection_name, document_id)] = self._doc_to_dict(snapshot)
+                        call.documents = 1
+                
+                for op_type, collection_name, document_id, data in build_operations(documents):
+                    doc_ref = self._doc_ref(collection_name, document_id)
+                    self._apply_operation(transaction, op_type, doc_ref, data)
+                    written.append((collection_name, document_id))
+            
+            try:
+                # Timed end to end, including the reads and any retries
+                with track_call('transaction_write', 'transaction') as call:
+                    run(self.db.transaction())
+                    call.collection = ','.join(sorted({name for name, _ in written}))
+                    call.documents = len(written)
+            finally:
+                for collection_name, document_id in written:
+                    self._invalidate_cache(collection_name, document_id)
+            return True
+            
+        except Exception as e:
+            logger.error(f"Firebase transaction error: {e}")
             return False
     
     def query_documents(self, collection_name, field, operator, value, limit=100):
@@ -319,16 +877,15 @@ class FirebaseDB:
         """
         try:
             self._ensure_initialized()
-            query = self.db.collection(self.collections[collection_name])
-            query = query.where(filter=FieldFilter(field, operator, value))
-            query = query.limit(limit)
+            query = self._filter_query(collection_name, field, operator, value, limit)
             
-            docs = query.stream()
             results = []
-            for doc in docs:
-                doc_dict = self._doc_to_dict(doc)
-                if doc_dict:
-                    results.append(doc_dict)
+            with track_call('list', collection_name, f"{field}{operator}") as call:
+                for doc in query.stream():
+                    doc_dict = self._doc_to_dict(doc)
+                    if doc_dict:
+                        results.append(doc_dict)
+                call.set_results(results)
             
             return results
             
@@ -336,5 +893,6 @@ class FirebaseDB:
             logger.error(f"Firebase query error: {e}")
             return []
 
+
 # Global database instance
 db = FirebaseDB()
@@ -0,0 +1,95 @@
+"""
+Image Pipeline - Shrink photos before they are uploaded
+Phone photos arrive at full camera resolution with EXIF metadata. Before upload
+they are rotated upright, stripped of metadata, downsampled to IMAGE_MAX_DIMENSION
+and re-encoded at IMAGE_QUALITY, which cuts upload time and outbound bandwidth.
+Pillow is imported on first use so API workers do not pay for it at startup.
+"""
+import logging
+import os
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+# Longest side in pixels after downsampling
+IMAGE_MAX_DIMENSION = int(os.environ.get('IMAGE_MAX_DIMENSION', 1600))
+
+# Encoder quality (1-95)
+IMAGE_QUALITY = int(os.environ.get('IMAGE_QUALITY', 80))
+
+# Output format: webp or jpeg
+IMAGE_FORMAT = os.environ.get('IMAGE_FORMAT', 'webp').lower()
+
+# Decoded pixel limit; images still larger after draft decoding are uploaded untouched
+MAX_PIXELS = 50_000_000
+
+_EXTENSIONS = {'webp': '.webp', 'jpeg': '.jpg'}
+
+def optimize_image(path, max_dimension=None, quality=None, image_format=None):
+    """
+    Re-encode an image file to a smaller temporary file without metadata
+    Returns (output_path, stats). The output never carries EXIF (including GPS), even
+    when it is no smaller than the original; animated images keep their frames and
+    format. output_path is the original path only when the image cannot be decoded.
+    """
+    from PIL import Image, ImageOps
+
+    max_dimension = max_dimension or IMAGE_MAX_DIMENSION
+    quality = quality or IMAGE_QUALITY
+    image_format = image_format or IMAGE_FORMAT
+    if image_format not in _EXTENSIONS:
+        image_format = 'jpeg'
+
+    original_bytes = os.path.getsize(path)
+    stats = {
+        'original_bytes': original_bytes,
+        'optimized_bytes': original_bytes,
+        'bytes_saved': 0,
+        'format': None
+    }
+
+    output_path = None
+    try:
+        with Image.open(path) as img:
+            # JPEG can decode at 1/2, 1/4 or 1/8 scale, which skips most of the decode work
+            img.draft('RGB', (max_dimension, max_dimension))
+            if img.width * img.height > MAX_PIXELS:
+                raise ValueError(f"{img.width}x{img.height} is over the {MAX_PIXELS} pixel limit")
+
+            if getattr(img, 'is_animated', False):
+                # Resizing would need every frame redrawn; re-saving alone drops the metadata
+                output_format = img.format
+                fd, output_path = tempfile.mkstemp(prefix='upload_', suffix=f".{output_format.lower()}")
+                with os.fdopen(fd, 'wb') as out:
+                    img.save(out, format=output_format, save_all=True)
+            else:
+                output_format = image_format.upper()
+
+                # Apply the EXIF orientation before the metadata is dropped
+                img = ImageOps.exif_transpose(img)
+                img.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+                has_alpha = img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info)
+                if image_format == 'webp':
+                    img = img.convert('RGBA' if has_alpha else 'RGB')
+                else:
+                    img = img.convert('RGB')
+
+                fd, output_path = tempfile.mkstemp(prefix='upload_', suffix=_EXTENSIONS[image_format])
+                with os.fdopen(fd, 'wb') as out:
+                    # No exif/icc arguments, so metadata is not copied to the output
+                    img.save(out, format=output_format, quality=quality, optimize=True)
+    except Exception as e:
+        logger.warning(f"Image optimization skipped for {path}: {e}")
+        if output_path:
+            os.remove(output_path)
+        return path, stats
+
+    # Kept even when it is not smaller: uploading the original would leak its metadata
+    optimized_bytes = os.path.getsize(output_path)
+    stats.update({
+        'optimized_bytes': optimized_bytes,
+        'bytes_saved': max(0, original_bytes - optimized_bytes),
+        'format': output_format.lower()
+    })
+    return output_path, stats
@@ -0,0 +1,434 @@
+"""
+Invoice Renderer - Tax invoice PDFs built with ReportLab
+Paragraph and table styles are built once per process, and PDF layout runs in a
+small process pool so CPU-bound rendering does not block the API's request workers.
+"""
+import io
+import logging
+import multiprocessing
+import os
+import threading
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, TimeoutError as FutureTimeoutError, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from functools import lru_cache
+from io import BytesIO
+
+logger = logging.getLogger(__name__)
+
+# Render processes; 0 renders inline in the request worker
+INVOICE_POOL_WORKERS = int(os.environ.get('INVOICE_POOL_WORKERS', 2))
+
+# Invoices allowed to be rendering or waiting for a render process at once
+INVOICE_QUEUE_LIMIT = int(os.environ.get('INVOICE_QUEUE_LIMIT', 8))
+
+# Seconds to wait for a rendered invoice
+INVOICE_RENDER_TIMEOUT = float(os.environ.get('INVOICE_RENDER_TIMEOUT', 20))
+
+class InvoiceRenderError(Exception):
+    """Invoice could not be rendered"""
+
+class InvoiceQueueFull(InvoiceRenderError):
+    """Too many invoices are already waiting to be rendered"""
+
+class InvoiceTimeout(InvoiceRenderError):
+    """Rendering took longer than INVOICE_RENDER_TIMEOUT"""
+
+_pool = None
+_pool_lock = threading.Lock()
+_queue_slots = threading.BoundedSemaphore(max(INVOICE_QUEUE_LIMIT, 1))
+
+def number_to_words(num):
+    """Convert number to words (Indian format)"""
+    try:
+        if not isinstance(num, int):
+            num = int(num)
+    except Exception:
+        return str(num)
+
+    if num < 0:
+        return 'Minus ' + number_to_words(abs(num))
+
+    ones = ['', 'One', 'Two', 'Three', 'Four', 'Five', 'Six', 'Seven', 'Eight', 'Nine']
+    tens = ['', '', 'Twenty', 'Thirty', 'Forty', 'Fifty', 'Sixty', 'Seventy', 'Eighty', 'Ninety']
+    teens = ['Ten', 'Eleven', 'Twelve', 'Thirteen', 'Fourteen', 'Fifteen', 'Sixteen', 'Seventeen', 'Eighteen', 'Nineteen']
+
+    def convert_below_thousand(n):
+        if n == 0:
+            return ''
+        elif n < 10:
+            return ones[n]
+        elif n < 20:
+            return teens[n - 10]
+        elif n < 100:
+            return tens[n // 10] + (' ' + ones[n % 10] if n % 10 != 0 else '')
+        else:
+            return ones[n // 100] + ' Hundred' + (' ' + convert_below_thousand(n % 100) if n % 100 != 0 else '')
+
+    if num == 0:
+        return 'Zero'
+    elif num < 1000:
+        return convert_below_thousand(num)
+    elif num < 100000:
+        return convert_below_thousand(num // 1000) + ' Thousand' + (' ' + convert_below_thousand(num % 1000) if num % 1000 != 0 else '')
+    elif num < 10000000:
+        return convert_below_thousand(num // 100000) + ' Lakh' + (' ' + convert_below_thousand(num % 100000) if num % 100000 != 0 else '')
+    elif num < 1000000000:
+        return convert_below_thousand(num // 10000000) + ' Crore' + (' ' + convert_below_thousand(num % 10000000) if num % 10000000 != 0 else '')
+    else:
+        return str(num)
+
+@lru_cache(maxsize=1)
+def invoice_styles():
+    """Paragraph styles, table styles and column widths, built once per process"""
+    # Reportlab is only needed here, so it is loaded on the first invoice
+    from reportlab.lib import colors
+    from reportlab.lib.units import inch
+    from reportlab.platypus import TableStyle
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.enums import TA_CENTER, TA_RIGHT
+
+    styles = getSampleStyleSheet()
+    return {
+        'normal': styles['Normal'],
+        'title': ParagraphStyle('Title', parent=styles['Heading1'], fontSize=18, textColor=colors.HexColor('#000000'),
+                                alignment=TA_CENTER, spaceAfter=20, fontName='Helvetica-Bold'),
+        'declaration': ParagraphStyle('Declaration', parent=styles['Normal'], fontSize=9, spaceAfter=10),
+        'signature': ParagraphStyle('Signature', parent=styles['Normal'], fontSize=9, alignment=TA_RIGHT),
+        'footer': ParagraphStyle('Footer', parent=styles['Normal'], fontSize=8, alignment=TA_CENTER),
+        'header_table': TableStyle([
+            ('GRID', (0, 0), (-1, -1), 1, colors.black),
+            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+            ('PADDING', (0, 0), (-1, -1), 10),
+            ('FONTSIZE', (0, 0), (-1, -1), 9),
+        ]),
+        'items_table': TableStyle([
+            ('GRID', (0, 0), (-1, -1), 1, colors.black),
+            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#666666')),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
+            ('FONTSIZE', (0, 0), (-1, -1), 8),
+            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+            ('PADDING', (0, 0), (-1, -1), 6),
+            ('ALIGN', (3, 1), (6, -1), 'RIGHT'),
+        ]),
+        'tax_table': TableStyle([
+            ('GRID', (0, 0), (-1, -1), 1, colors.black),
+            ('BACKGROUND', (0, 0), (-1, 1), colors.HexColor('#666666')),
+            ('TEXTCOLOR', (0, 0), (-1, 1), colors.whitesmoke),
+            ('SPAN', (0, 0), (0, 1)), ('SPAN', (1, 0), (1, 1)), ('SPAN', (2, 0), (3, 0)),
+            ('SPAN', (4, 0), (5, 0)), ('SPAN', (6, 0), (6, 1)),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('FONTSIZE', (0, 0), (-1, -1), 8),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+            ('PADDING', (0, 0), (-1, -1), 6),
+        ]),
+        'amount_words_table': TableStyle([
+            ('GRID', (0, 0), (-1, -1), 1, colors.black),
+            ('FONTNAME', (0, 0), (-1, -1), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, -1), 9),
+            ('PADDING', (0, 0), (-1, -1), 8),
+            ('ALIGN', (1, 0), (1, 0), 'RIGHT'),
+        ]),
+        'header_widths': [4*inch, 3.5*inch],
+        'items_widths': [0.4*inch, 3*inch, 0.8*inch, 0.9*inch, 0.9*inch, 0.5*inch, 1*inch],
+        'tax_widths': [0.8*inch, 1.3*inch, 0.6*inch, 1*inch, 0.8*inch, 1*inch, 1*inch],
+        'amount_words_widths': [5.5*inch, 2*inch]
+    }
+
+def create_invoice_pdf(data):
+    """Generate tax invoice PDF and return its bytes"""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.platypus import SimpleDocTemplate, Table, Paragraph, Spacer
+
+    try:
+        styles = invoice_styles()
+        buffer = BytesIO()
+        doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=30, leftMargin=30, topMargin=30, bottomMargin=30)
+        elements = []
+
+        # Title
+        elements.append(Paragraph("TAX INVOICE", styles['title']))
+        elements.append(Spacer(1, 10))
+
+        # Invoice details
+        invoice_date = datetime.now().strftime("%d-%b-%y")
+        invoice_number = f"2025-26/{datetime.now().strftime('%m%d%H%M')}"
+
+        # Header table
+        seller_info = f"""<b>{data.get('seller_name', '')}</b><br/>{data.get('seller_address', '')}<br/>
+        {data.get('seller_city', '')}, {data.get('seller_state', '')} - {data.get('seller_pincode', '')}<br/>
+        GSTIN/UIN: {data.get('seller_gstin', '')}<br/>
+        State Name: {data.get('seller_state_name', '')}, Code: {data.get('seller_state_code', '')}"""
+
+        buyer_info = f"""<b>{data.get('buyer_name', '')}</b><br/>{data.get('buyer_address', '')}<br/>
+        {data.get('buyer_city', '')}, {data.get('buyer_state', '')} - {data.get('buyer_pincode', '')}<br/>
+        {"GSTIN/UIN: " + data.get('buyer_gstin', '') if data.get('buyer_gstin') else ''}<br/>
+        {"State Code: " + data.get('buyer_state_code', '') if data.get('buyer_state_code') else ''}"""
+
+        invoice_meta = f"""<b>Invoice No.</b> {invoice_number}<br/><b>Dated:</b> {invoice_date}<br/>
+        {"<b>Vehicle No:</b> " + data.get('vehicle_number', '') if data.get('vehicle_number') else ''}"""
+
+        header_data = [
+            [Paragraph(seller_info, styles['normal']), Paragraph(invoice_meta, styles['normal'])],
+            [Paragraph("<b>Buyer (Bill to)</b>", styles['normal']), ''],
+            [Paragraph(buyer_info, styles['normal']), '']
+        ]
+
+        header_table = Table(header_data, colWidths=styles['header_widths'])
+        header_table.setStyle(styles['header_table'])
+        elements.append(header_table)
+        elements.append(Spacer(1, 15))
+
+        # Items table
+        items = data.get('items', [])
+        cgst_rate = float(data.get('cgst_rate', 9))
+        sgst_rate = float(data.get('sgst_rate', 9))
+
+        subtotal = 0
+        items_data = [['Sl', 'Description of Goods', 'HSN/SAC', 'Quantity', 'Rate', 'per', 'Amount']]
+        hsn_codes = []
+
+        for idx, item in enumerate(items, 1):
+            if not item.get('description'):
+                continue
+            qty = float(item.get('quantity', 0))
+            rate = float(item.get('rate', 0))
+            amount = qty * rate
+            subtotal += amount
+
+            hsn = item.get('hsn_code', '')
+            if hsn and hsn not in hsn_codes:
+                hsn_codes.append(hsn)
+
+            items_data.append([
+                str(idx), item.get('description', ''), hsn,
+                f"{qty} {item.get('unit', 'Nos')}", f"Rs {rate:,.2f}",
+                item.get('unit', 'Nos'), f"Rs {amount:,.2f}"
+            ])
+
+        items_data.append(['', '', '', '', '', 'Total', f"Rs {subtotal:,.2f}"])
+
+        items_table = Table(items_data, colWidths=styles['items_widths'])
+        items_table.setStyle(styles['items_table'])
+        elements.append(items_table)
+        elements.append(Spacer(1, 10))
+
+        # Tax calculation
+        cgst_amount = (subtotal * cgst_rate) / 100
+        sgst_amount = (subtotal * sgst_rate) / 100
+        total = subtotal + cgst_amount + sgst_amount
+        hsn_display = hsn_codes[0] if hsn_codes else ''
+
+        tax_data = [
+            ['HSN/SAC', 'Taxable Value', 'CGST', '', 'SGST/UTGST', '', 'Total Tax Amount'],
+            ['', '', 'Rate', 'Amount', 'Rate', 'Amount', ''],
+            [hsn_display, f"Rs {subtotal:,.2f}", f"{cgst_rate}%", f"Rs {cgst_amount:,.2f}",
+             f"{sgst_rate}%", f"Rs {sgst_amount:,.2f}", f"Rs {(cgst_amount + sgst_amount):,.2f}"],
+            ['', f"Total Rs {subtotal:,.2f}", '', '', '', '', f"Rs {(cgst_amount + sgst_amount):,.2f}"]
+        ]
+
+        tax_table = Table(tax_data, colWidths=styles['tax_widths'])
+        tax_table.setStyle(styles['tax_table'])
+        elements.append(tax_table)
+        elements.append(Spacer(1, 10))
+
+        # Amount in words
+        total_int = int(total)
+        amount_words = f"INR {number_to_words(total_int)} Only"
+        amount_words_data = [[f"Amount Chargeable (in words): {amount_words}", f"Rs {total:,.2f}"]]
+        amount_words_table = Table(amount_words_data, colWidths=styles['amount_words_widths'])
+        amount_words_table.setStyle(styles['amount_words_table'])
+        elements.append(amount_words_table)
+        elements.append(Spacer(1, 15))
+
+        # Notes
+        if data.get('notes'):
+            elements.append(Paragraph(f"<b>Notes:</b> {data.get('notes', '')}", styles['normal']))
+            elements.append(Spacer(1, 10))
+
+        # Declaration and signature
+        elements.append(Spacer(1, 10))
+        elements.append(Paragraph("<b>Declaration:</b>", styles['declaration']))
+        elements.append(Paragraph("We declare that this invoice shows the actual price of the goods described and that all particulars are true and correct.", styles['declaration']))
+        elements.append(Spacer(1, 20))
+
+        elements.append(Paragraph(f"<b>For {data.get('seller_name', '')}</b>", styles['signature']))
+        elements.append(Spacer(1, 30))
+        elements.append(Paragraph("Authorised Signatory", styles['signature']))
+
+        elements.append(Paragraph("This is a Computer Generated Invoice", styles['footer']))
+
+        doc.build(elements)
+        return buffer.getvalue()
+    except Exception as e:
+        raise InvoiceRenderError(f"Error creating PDF: {str(e)}")
+
+def _warm_up():
+    """Pool initializer: import ReportLab and build the styles before the first job"""
+    invoice_styles()
+
+def get_pool():
+    """Get the render process pool, or None when rendering inline"""
+    global _pool
+    if INVOICE_POOL_WORKERS <= 0:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # Spawned, not forked: request workers run gRPC threads that must not be forked
+                _pool = ProcessPoolExecutor(
+                    max_workers=INVOICE_POOL_WORKERS,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_warm_up
+                )
+    return _pool
+
+def _reset_pool(broken_pool):
+    """Drop a pool whose worker process died so the next invoice starts a fresh one"""
+    global _pool
+    with _pool_lock:
+        if _pool is broken_pool:
+            _pool = None
+    broken_pool.shutdown(wait=False)
+
+def _submit(pool, data, wait_for_slot=False):
+    """Submit one invoice to the pool, holding a queue slot until it finishes rendering"""
+    if wait_for_slot:
+        acquired = _queue_slots.acquire(timeout=INVOICE_RENDER_TIMEOUT)
+    else:
+        acquired = _queue_slots.acquire(blocking=False)
+    if not acquired:
+        raise InvoiceQueueFull('Too many invoices are being generated, please try again shortly')
+
+    try:
+        future = pool.submit(create_invoice_pdf, data)
+    except (BrokenProcessPool, RuntimeError) as e:
+        _queue_slots.release()
+        _reset_pool(pool)
+        raise InvoiceRenderError(f"Invoice renderer unavailable: {str(e)}")
+
+    # The slot is held until the render really finishes, even if the caller gave up
+    future.add_done_callback(lambda _: _queue_slots.release())
+    return future
+
+def render_invoice(data, timeout=None):
+    """
+    Render an invoice PDF on the process pool and return its bytes
+    Raises InvoiceQueueFull when INVOICE_QUEUE_LIMIT invoices are already pending
+    and InvoiceTimeout when rendering takes longer than the timeout
+    """
+    pool = get_pool()
+    if pool is None:
+        return create_invoice_pdf(data)
+
+    future = _submit(pool, data)
+    try:
+        return future.result(timeout=INVOICE_RENDER_TIMEOUT if timeout is None else timeout)
+    except FutureTimeoutError:
+        future.cancel()
+        raise InvoiceTimeout('Invoice generation timed out')
+    except BrokenProcessPool as e:
+        _reset_pool(pool)
+        logger.error(f"Invoice render process died: {e}")
+        raise InvoiceRenderError('Invoice renderer crashed, please try again')
+
+def render_invoices(invoices):
+    """
+    Render several invoices in parallel, yielding (index, pdf_bytes, error) as each finishes
+    Only twice the pool size is in flight at once, so memory stays bounded however
+    many invoices are requested; bulk jobs wait for queue slots instead of failing
+    """
+    pool = get_pool()
+    if pool is None:
+        for index, data in enumerate(invoices):
+            try:
+                yield index, create_invoice_pdf(data), None
+            except InvoiceRenderError as e:
+                yield index, None, str(e)
+        return
+
+    pending = iter(enumerate(invoices))
+    in_flight = {}
+    max_in_flight = INVOICE_POOL_WORKERS * 2
+
+    try:
+        while True:
+            while len(in_flight) < max_in_flight:
+                item = next(pending, None)
+                if item is None:
+                    break
+                index, data = item
+                try:
+                    in_flight[_submit(pool, data, wait_for_slot=True)] = index
+                except InvoiceRenderError as e:
+                    yield index, None, str(e)
+
+            if not in_flight:
+                return
+
+            done, _ = wait(in_flight, timeout=INVOICE_RENDER_TIMEOUT, return_when=FIRST_COMPLETED)
+            if not done:
+                # Nothing finished within the timeout, so give up on everything in flight
+                for future, index in in_flight.items():
+                    future.cancel()
+                    yield index, None, 'Invoice generation timed out'
+                in_flight.clear()
+                continue
+
+            for future in done:
+                index = in_flight.pop(future)
+                try:
+                    yield index, future.result(), None
+                except BrokenProcessPool:
+                    _reset_pool(pool)
+                    pool = get_pool()
+                    yield index, None, 'Invoice renderer crashed'
+                except InvoiceRenderError as e:
+                    yield index, None, str(e)
+    finally:
+        # The client went away or the generator was closed early
+        for future in in_flight:
+            future.cancel()
+
+class _ZipStream(io.RawIOBase):
+    """Unseekable sink that lets zipfile write straight into a streamed response"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def stream_invoice_zip(invoices):
+    """
+    Render (filename, invoice data) pairs in parallel and stream them as a ZIP archive
+    Each PDF is written and flushed as soon as it is ready; failed invoices are
+    listed in errors.txt at the end of the archive
+    """
+    invoices = list(invoices)
+    sink = _ZipStream()
+    errors = []
+
+    with zipfile.ZipFile(sink, mode='w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for index, pdf_bytes, error in render_invoices([data for _, data in invoices]):
+            filename = invoices[index][0]
+            if error:
+                errors.append(f"{filename}: {error}")
+            else:
+                archive.writestr(filename, pdf_bytes)
+            yield sink.drain()
+
+        if errors:
+            archive.writestr('errors.txt', '\n'.join(errors) + '\n')
+    yield sink.drain()
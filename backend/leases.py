@@ -0,0 +1,41 @@
+"""
+Leases - Short-lived ownership of a task shared by several workers
+A lease is a scheduler_locks document naming its owner and expiry, taken and given
+up in Firestore transactions. A holder that dies loses it once it expires, so the
+task is picked up again by the next worker that asks.
+"""
+import os
+import uuid
+from datetime import datetime, timedelta
+
+def new_owner():
+    """Lease owner ID for one run of a task in this process"""
+    return f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+def acquire(firebase_db, document, owner, seconds):
+    """Take or renew the lease in document (collection, id); False if another owner holds it"""
+    acquired = []
+    now = datetime.utcnow()
+
+    def build_operations(documents):
+        acquired.clear()
+        lease = documents.get(document) or {}
+        if lease.get('owner') not in (None, owner) and lease.get('expires_at', '') > now.isoformat():
+            return []
+        acquired.append(True)
+        return [('merge', *document, {
+            'owner': owner,
+            'expires_at': (now + timedelta(seconds=seconds)).isoformat()
+        })]
+
+    return firebase_db.run_transaction([document], build_operations) and bool(acquired)
+
+def release(firebase_db, document, owner):
+    """Give up the lease in document if owner still holds it"""
+    def build_operations(documents):
+        lease = documents.get(document) or {}
+        if lease.get('owner') != owner:
+            return []
+        return [('merge', *document, {'owner': None, 'expires_at': ''})]
+
+    firebase_db.run_transaction([document], build_operations)
@@ -0,0 +1,163 @@
+"""
+Ledger Export - Stream transactions, customers and products as CSV or NDJSON
+Rows are written as Firestore pages arrive (FirebaseDB.iter_documents) and sent in
+chunks of about EXPORT_CHUNK_BYTES, so an export of any size runs in constant memory
+and the first bytes leave before the whole collection has been read.
+"""
+import csv
+import io
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from firebase_query import Query
+import ledger_summary
+
+logger = logging.getLogger(__name__)
+
+# Bytes buffered before a chunk is sent
+EXPORT_CHUNK_BYTES = int(os.environ.get('EXPORT_CHUNK_BYTES', 64 * 1024))
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson'
+}
+
+TRANSACTION_COLUMNS = [
+    'id', 'created_at', 'customer_id', 'customer_name', 'transaction_type',
+    'amount', 'notes', 'created_by', 'receipt_image_url'
+]
+CUSTOMER_COLUMNS = [
+    'id', 'name', 'phone_number', 'balance', 'total_credit', 'total_payment',
+    'transaction_count', 'last_transaction_date', 'created_at'
+]
+PRODUCT_COLUMNS = [
+    'id', 'name', 'description', 'category', 'subcategory', 'stock_quantity', 'unit',
+    'price', 'hsn_code', 'is_public', 'low_stock_threshold', 'created_at', 'updated_at'
+]
+
+# Spreadsheet apps run cells starting with these as formulas
+_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+def parse_date_range(args):
+    """
+    Read optional start_date/end_date (YYYY-MM-DD, inclusive) query parameters
+    Returns ((start, end), error); start and end are ISO timestamps or None
+    """
+    try:
+        start = datetime.strptime(args['start_date'], '%Y-%m-%d') if args.get('start_date') else None
+        end = datetime.strptime(args['end_date'], '%Y-%m-%d') + timedelta(days=1) if args.get('end_date') else None
+    except ValueError:
+        return None, 'start_date and end_date must be dates like 2025-03-31'
+    if start and end and end <= start:
+        return None, 'end_date must not be before start_date'
+    return (start.isoformat() if start else None, end.isoformat() if end else None), None
+
+def _csv_value(value):
+    """Cell text for a value, with formula-like text neutralised"""
+    if value is None:
+        return ''
+    if isinstance(value, str) and value.startswith(_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+def stream_rows(rows, columns, export_format):
+    """Encode row dicts as CSV (with a header row) or NDJSON, yielding byte chunks"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if export_format == 'csv' else None
+    if writer:
+        # The BOM makes Excel read the file as UTF-8 (customer names, the ₹ sign)
+        buffer.write('\ufeff')
+        writer.writerow(columns)
+        # Send the header at once so the download starts before the first page is read
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+
+    try:
+        for row in rows:
+            if writer:
+                writer.writerow([_csv_value(row.get(column)) for column in columns])
+            else:
+                buffer.write(json.dumps({column: row.get(column) for column in columns}, ensure_ascii=False))
+                buffer.write('\n')
+
+            if buffer.tell() >= EXPORT_CHUNK_BYTES:
+                yield buffer.getvalue().encode('utf-8')
+                buffer.seek(0)
+                buffer.truncate()
+    except Exception as e:
+        # Headers are already sent, so the only signal left is an incomplete response
+        logger.error(f"Export stream failed: {e}")
+        raise
+
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+def transaction_rows(firebase_db, business_id, resolve_receipt_url, start=None, end=None, customer_id=None):
+    """
+    Transactions newest first (like /api/transactions), with customer names
+    resolve_receipt_url turns a stored receipt public_id into the URL /api/transactions returns
+    """
+    customer_names = {
+        customer['$id']: customer.get('name', 'Unknown')
+        for customer in firebase_db.iter_documents('customers', [
+            Query.equal('business_id', business_id),
+            Query.select(['name'])
+        ])
+    }
+
+    queries = [Query.equal('business_id', business_id)]
+    if customer_id:
+        queries.append(Query.equal('customer_id', customer_id))
+    if start:
+        queries.append(Query.greaterThanEqual('created_at', start))
+    if end:
+        queries.append(Query.lessThan('created_at', end))
+    queries.append(Query.order_desc('created_at'))
+
+    for txn in firebase_db.iter_documents('transactions', queries):
+        yield {
+            'id': txn['$id'],
+            'created_at': txn.get('created_at'),
+            'customer_id': txn.get('customer_id'),
+            'customer_name': customer_names.get(txn.get('customer_id'), 'Unknown'),
+            'transaction_type': txn.get('transaction_type'),
+            'amount': txn.get('amount'),
+            'notes': txn.get('notes'),
+            'created_by': txn.get('created_by'),
+            'receipt_image_url': resolve_receipt_url(txn.get('receipt_image_url', ''))
+        }
+
+def customer_rows(firebase_db, business_id):
+    """Customers with their maintained balances"""
+    # Make sure balances have been backfilled for older businesses
+    ledger_summary.get_summary(firebase_db, business_id)
+
+    credits = ledger_summary.credit_map(firebase_db.iter_documents('customer_credits', [
+        Query.equal('business_id', business_id),
+        Query.select(['customer_id', 'current_balance', 'total_credit', 'total_payment',
+                      'transaction_count', 'last_transaction_at'])
+    ]), business_id)
+
+    for customer in firebase_db.iter_documents('customers', [Query.equal('business_id', business_id)]):
+        credit = credits.get(customer['$id']) or {}
+        yield {
+            'id': customer['$id'],
+            'name': customer.get('name'),
+            'phone_number': customer.get('phone_number'),
+            'balance': credit.get('current_balance', 0),
+            'total_credit': credit.get('total_credit', 0),
+            'total_payment': credit.get('total_payment', 0),
+            'transaction_count': credit.get('transaction_count', 0),
+            'last_transaction_date': credit.get('last_transaction_at') or '',
+            'created_at': customer.get('created_at')
+        }
+
+def product_rows(firebase_db, business_id):
+    """Products in the business catalog"""
+    for product in firebase_db.iter_documents('products', [Query.equal('business_id', business_id)]):
+        yield {
+            'id': product['$id'],
+            **{column: product.get(column) for column in PRODUCT_COLUMNS if column != 'id'}
+        }
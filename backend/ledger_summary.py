@@ -0,0 +1,302 @@
+"""
+Ledger Summary - Incrementally maintained per-business totals
+Keeps business_summaries/{business_id} and the customer_credits balances in step
+with every transaction write, so the dashboard reads one document instead of
+scanning the whole ledger.
+
+Businesses from before the summary (or an older SUMMARY_VERSION) are rebuilt from
+the full ledger once, under a lease, so concurrent requests wait for one rebuild
+instead of each scanning. Incremental writes check in their transaction that the
+summary is current and backfill it first otherwise, so they never land on a summary
+a rebuild is about to replace. `python ledger_summary.py` backfills every business
+ahead of time.
+"""
+import logging
+import os
+import time
+from datetime import datetime
+from firebase_query import Query
+import leases
+
+logger = logging.getLogger(__name__)
+
+# Bump when the summary layout changes so stale documents are rebuilt
+# (3: rebuild totals that version 2's unguarded rebuilds could lose increments from)
+SUMMARY_VERSION = 3
+
+# Seconds a rebuild's lease stays valid; a worker that dies mid-rebuild frees it then
+REBUILD_LEASE_SECONDS = 120
+
+# Seconds a request waits for another worker's rebuild before giving up
+REBUILD_WAIT_SECONDS = float(os.environ.get('SUMMARY_REBUILD_WAIT_SECONDS', 30))
+REBUILD_POLL_SECONDS = 0.5
+
+class SummaryUnavailable(Exception):
+    """Another worker's rebuild of the summary did not finish in time"""
+
+def credit_document_id(business_id, customer_id):
+    """Deterministic customer_credits document ID for a business/customer pair"""
+    return f"{business_id}_{customer_id}"
+
+def is_current(summary):
+    """Whether a stored summary is complete and kept up to date by incremental writes"""
+    return bool(summary) and summary.get('version') == SUMMARY_VERSION
+
+def _commit_with_current_summary(firebase_db, business_id, reads, build_operations):
+    """
+    Run a write that increments the business summary in a transaction that also
+    checks the summary is current; an outdated one is backfilled and the write retried
+    Returns False if the write failed
+    """
+    summary_key = ('business_summaries', business_id)
+    for attempt in range(2):
+        outdated = []
+
+        def build_checked_operations(documents):
+            outdated.clear()
+            if not is_current(documents.get(summary_key)):
+                outdated.append(True)
+                return []
+            return build_operations(documents)
+
+        if not firebase_db.run_transaction(list(reads) + [summary_key], build_checked_operations):
+            return False
+        if not outdated:
+            return True
+        if attempt == 0:
+            backfill(firebase_db, business_id)
+    logger.error(f"Summary of business {business_id} is still outdated after a rebuild")
+    return False
+
+def transaction_delta(transaction_type, amount):
+    """Signed effect of a transaction on the customer's outstanding balance"""
+    if transaction_type == 'credit':
+        return amount
+    elif transaction_type == 'payment':
+        return -amount
+    return 0
+
+def record_transaction(firebase_db, transaction_id, transaction_data):
+    """
+    Write a transaction together with its customer balance and business summary
+    updates in a single Firestore transaction
+    """
+    business_id = transaction_data['business_id']
+    customer_id = transaction_data['customer_id']
+    transaction_type = transaction_data['transaction_type']
+    amount = float(transaction_data['amount'])
+    delta = transaction_delta(transaction_type, amount)
+    credit_id = credit_document_id(business_id, customer_id)
+
+    def build_operations(documents):
+        credit = documents.get(('customer_credits', credit_id)) or {}
+        old_balance = float(credit.get('current_balance', 0))
+        new_balance = old_balance + delta
+
+        # A customer enters or leaves the pending list when their balance crosses zero
+        pending_delta = int(new_balance > 0) - int(old_balance > 0)
+
+        # The credit document was read in this transaction, so exact values are
+        # as safe as increments and keep the stored balance readable by older code
+        return [
+            ('create', 'transactions', transaction_id, transaction_data),
+            ('merge', 'customer_credits', credit_id, {
+                'business_id': business_id,
+                'customer_id': customer_id,
+                'current_balance': new_balance,
+                'total_credit': float(credit.get('total_credit', 0)) + (amount if transaction_type == 'credit' else 0),
+                'total_payment': float(credit.get('total_payment', 0)) + (amount if transaction_type == 'payment' else 0),
+                'transaction_count': int(credit.get('transaction_count', 0)) + 1,
+                'last_transaction_at': max(credit.get('last_transaction_at') or '', transaction_data.get('created_at') or ''),
+                'updated_at': datetime.utcnow().isoformat()
+            }),
+            ('increment', 'business_summaries', business_id, {
+                'total_credit': amount if transaction_type == 'credit' else 0,
+                'total_payment': amount if transaction_type == 'payment' else 0,
+                'outstanding_balance': delta,
+                'pending_customers_count': pending_delta,
+                'total_transactions': 1
+            })
+        ]
+
+    if not _commit_with_current_summary(firebase_db, business_id, [('customer_credits', credit_id)], build_operations):
+        return None
+
+    result = transaction_data.copy()
+    result['$id'] = transaction_id
+    return result
+
+def record_customer(firebase_db, customer_id, customer_data):
+    """Create a customer and bump the business customer count in one transaction"""
+    business_id = customer_data['business_id']
+
+    def build_operations(documents):
+        return [
+            ('create', 'customers', customer_id, customer_data),
+            ('increment', 'business_summaries', business_id, {'total_customers': 1})
+        ]
+
+    if not _commit_with_current_summary(firebase_db, business_id, [], build_operations):
+        return None
+
+    result = customer_data.copy()
+    result['$id'] = customer_id
+    return result
+
+def rebuild_summary(firebase_db, business_id):
+    """
+    Recompute the summary and customer balances from the full ledger
+    Only safe while no incremental write can commit for the business: call backfill()
+    rather than this, unless nothing else is running (benchmark setup)
+    """
+    # Only the fields needed for the totals are downloaded, a page at a time
+    total_customers = sum(1 for _ in firebase_db.iter_documents('customers', [
+        Query.equal('business_id', business_id),
+        Query.select(['business_id'])
+    ]))
+    transactions = firebase_db.iter_documents('transactions', [
+        Query.equal('business_id', business_id),
+        Query.select(['customer_id', 'amount', 'transaction_type', 'created_at'])
+    ])
+
+    total_credit = 0
+    total_payment = 0
+    total_transactions = 0
+    credits = {}
+    for txn in transactions:
+        total_transactions += 1
+        amount = float(txn.get('amount', 0))
+        txn_type = txn.get('transaction_type')
+        if txn_type == 'credit':
+            total_credit += amount
+        elif txn_type == 'payment':
+            total_payment += amount
+
+        cid = txn.get('customer_id')
+        if cid:
+            credit = credits.setdefault(cid, {
+                'current_balance': 0,
+                'total_credit': 0,
+                'total_payment': 0,
+                'transaction_count': 0,
+                'last_transaction_at': ''
+            })
+            credit['current_balance'] += transaction_delta(txn_type, amount)
+            credit['total_credit'] += amount if txn_type == 'credit' else 0
+            credit['total_payment'] += amount if txn_type == 'payment' else 0
+            credit['transaction_count'] += 1
+            credit['last_transaction_at'] = max(credit['last_transaction_at'], txn.get('created_at') or '')
+
+    now = datetime.utcnow().isoformat()
+    summary = {
+        'business_id': business_id,
+        'total_customers': total_customers,
+        'total_transactions': total_transactions,
+        'total_credit': total_credit,
+        'total_payment': total_payment,
+        'outstanding_balance': total_credit - total_payment,
+        'pending_customers_count': sum(1 for credit in credits.values() if credit['current_balance'] > 0),
+        'version': SUMMARY_VERSION,
+        'rebuilt_at': now
+    }
+
+    # Balances first: writes accept the summary as current as soon as it is stored,
+    # so it goes last and only once every balance is in place
+    operations = [
+        ('merge', 'customer_credits', credit_document_id(business_id, cid), {
+            'business_id': business_id,
+            'customer_id': cid,
+            **credit,
+            'updated_at': now
+        })
+        for cid, credit in credits.items()
+    ]
+    if operations and not firebase_db.batch_write(operations):
+        logger.error(f"Failed to store rebuilt balances for business {business_id}")
+        return summary
+    if not firebase_db.batch_write([('create', 'business_summaries', business_id, summary)]):
+        logger.error(f"Failed to store rebuilt summary for business {business_id}")
+        return summary
+
+    logger.info(f"Rebuilt ledger summary for business {business_id} from {total_transactions} transactions")
+    return summary
+
+def backfill(firebase_db, business_id):
+    """
+    Rebuild a missing or outdated summary once across workers; returns the current summary
+    The rebuild runs under a lease and other callers wait for its result instead of
+    scanning the ledger too. Raises SummaryUnavailable if it does not finish in time.
+    """
+    lease = ('scheduler_locks', f"summary_{business_id}")
+    owner = leases.new_owner()
+    deadline = time.monotonic() + REBUILD_WAIT_SECONDS
+    while not leases.acquire(firebase_db, lease, owner, REBUILD_LEASE_SECONDS):
+        if time.monotonic() >= deadline:
+            raise SummaryUnavailable(f"Summary rebuild for business {business_id} is still running")
+        time.sleep(REBUILD_POLL_SECONDS)
+        summary = firebase_db.get_document('business_summaries', business_id, use_cache=False)
+        if is_current(summary):
+            return summary
+
+    try:
+        # Another worker may have finished the rebuild while this one waited
+        summary = firebase_db.get_document('business_summaries', business_id, use_cache=False)
+        if is_current(summary):
+            return summary
+        return rebuild_summary(firebase_db, business_id)
+    finally:
+        leases.release(firebase_db, lease, owner)
+
+def get_summary(firebase_db, business_id):
+    """Get the business summary, backfilling it if missing or outdated (see backfill)"""
+    # Totals change on every write, so always read the stored document
+    summary = firebase_db.get_document('business_summaries', business_id, use_cache=False)
+    if is_current(summary):
+        return summary
+    return backfill(firebase_db, business_id)
+
+def credit_map(customer_credits, business_id):
+    """
+    Map customer_id -> customer_credits document
+    Documents maintained by this module win over legacy documents for the same customer
+    """
+    credits = {}
+    for credit in customer_credits:
+        customer_id = credit.get('customer_id')
+        if not customer_id:
+            continue
+        if customer_id in credits and credit['$id'] != credit_document_id(business_id, customer_id):
+            continue
+        credits[customer_id] = credit
+    return credits
+
+def balance_map(customer_credits, business_id):
+    """Map customer_id -> current_balance from customer_credits documents"""
+    return {
+        customer_id: credit.get('current_balance', 0)
+        for customer_id, credit in credit_map(customer_credits, business_id).items()
+    }
+
+def get_customer_credit(firebase_db, business_id, customer_id):
+    """Get a customer's maintained credit document, falling back to a legacy one"""
+    credit = firebase_db.get_document('customer_credits', credit_document_id(business_id, customer_id))
+    if credit:
+        return credit
+
+    legacy = firebase_db.list_documents('customer_credits', [
+        Query.equal('business_id', business_id),
+        Query.equal('customer_id', customer_id)
+    ])
+    return legacy[0] if legacy else {}
+
+def backfill_all(firebase_db):
+    """Backfill the summary of every business; returns the number of businesses"""
+    business_ids = [business['$id'] for business in firebase_db.iter_documents('businesses', [Query.select(['name'])])]
+    for business_id in business_ids:
+        get_summary(firebase_db, business_id)
+    return len(business_ids)
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    from firebase_utils import db
+    print(f"Summaries of {backfill_all(db)} business(es) are current")
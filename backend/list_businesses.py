@@ -2,31 +2,32 @@ from firebase_utils import db as firebase_db
 
 print("Fetching all businesses from Firebase...\n")
 
-businesses = firebase_db.list_documents('businesses')
+# Documents are fetched a page at a time and printed as they arrive
+count = 0
+for count, business in enumerate(firebase_db.iter_documents('businesses'), 1):
+    print(f"{count}. {business.get('name', 'N/A')}")
+    print(f"   Business ID: {business.get('$id', 'N/A')}")
+    print(f"   Phone: {business.get('phone_number', 'N/A')}")
+    print(f"   Access PIN: {business.get('access_pin', 'N/A')}")
+    print(f"   Email: {business.get('email', 'N/A')}")
+    print(f"   Location: {business.get('location', 'N/A')}")
+    print()
 
-if businesses:
-    print(f"Found {len(businesses)} business(es):\n")
-    for i, business in enumerate(businesses, 1):
-        print(f"{i}. {business.get('name', 'N/A')}")
-        print(f"   Business ID: {business.get('$id', 'N/A')}")
-        print(f"   Phone: {business.get('phone_number', 'N/A')}")
-        print(f"   Access PIN: {business.get('access_pin', 'N/A')}")
-        print(f"   Email: {business.get('email', 'N/A')}")
-        print(f"   Location: {business.get('location', 'N/A')}")
-        print()
+if count:
+    print(f"Found {count} business(es)")
 else:
     print("No businesses found in Firebase")
 
 print("\nFetching all users from Firebase...\n")
 
-users = firebase_db.list_documents('users')
+count = 0
+for count, user in enumerate(firebase_db.iter_documents('users'), 1):
+    print(f"{count}. User ID: {user.get('$id', 'N/A')}")
+    print(f"   Phone: {user.get('phone_number', 'N/A')}")
+    print(f"   Business ID: {user.get('business_id', 'N/A')}")
+    print()
 
-if users:
-    print(f"Found {len(users)} user(s):\n")
-    for i, user in enumerate(users, 1):
-        print(f"{i}. User ID: {user.get('$id', 'N/A')}")
-        print(f"   Phone: {user.get('phone_number', 'N/A')}")
-        print(f"   Business ID: {user.get('business_id', 'N/A')}")
-        print()
+if count:
+    print(f"Found {count} user(s)")
 else:
     print("No users found in Firebase")
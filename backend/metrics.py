@@ -0,0 +1,197 @@
+"""
+Metrics - In-process counters, gauges and histograms in Prometheus text format
+Each gunicorn worker keeps its own registry. When PROMETHEUS_MULTIPROC_DIR is set,
+workers write periodic snapshots there and render() merges the numbers of every
+worker that is still running. Snapshots of exited workers are deleted when read, so
+their gauges disappear and a restarted worker's counters are not added to its
+predecessor's; merged counters then drop, which Prometheus treats as a reset.
+The directory must therefore be local to the host the workers run on.
+"""
+import bisect
+import glob
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Default histogram buckets in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Seconds between snapshot writes in multiprocess mode
+FLUSH_INTERVAL = 5
+
+def _labels_key(labels):
+    """Hashable, ordered form of a label dict"""
+    return tuple(sorted((labels or {}).items()))
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def _pid_alive(pid):
+    """Whether a process with this PID is running on this host"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Exists, but belongs to another user
+        return True
+    return True
+
+class MetricsRegistry:
+    """Thread-safe metric store for one process"""
+
+    def __init__(self, multiproc_dir=None):
+        self.multiproc_dir = multiproc_dir
+        self._lock = threading.Lock()
+        self._definitions = {}
+        self._values = {}
+        self._collectors = []
+        self._last_flush = 0.0
+
+    def counter(self, name, help_text):
+        self._definitions[name] = ('counter', help_text, None)
+
+    def gauge(self, name, help_text):
+        self._definitions[name] = ('gauge', help_text, None)
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self._definitions[name] = ('histogram', help_text, tuple(buckets))
+
+    def add_collector(self, collect):
+        """Register a callable run before every snapshot, e.g. to copy cache stats into gauges"""
+        self._collectors.append(collect)
+
+    def inc(self, name, labels=None, value=1):
+        key = (name, _labels_key(labels))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, name, labels=None, value=0):
+        """Set a gauge, or a counter mirrored from another component's running total"""
+        with self._lock:
+            self._values[(name, _labels_key(labels))] = value
+
+    def observe(self, name, labels=None, value=0.0):
+        buckets = self._definitions[name][2]
+        key = (name, _labels_key(labels))
+        with self._lock:
+            # Per-bucket counts followed by the sum and the total count
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0] * (len(buckets) + 1) + [0.0, 0]
+            entry[bisect.bisect_left(buckets, value)] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def snapshot(self):
+        """JSON-serializable copy of every value in this process"""
+        for collect in self._collectors:
+            try:
+                collect()
+            except Exception as e:
+                logger.error(f"Metrics collector error: {e}")
+
+        with self._lock:
+            return [
+                [name, [list(label) for label in labels], list(value) if isinstance(value, list) else value]
+                for (name, labels), value in self._values.items()
+            ]
+
+    def maybe_flush(self):
+        """Write this worker's snapshot if multiprocess mode is on and the interval has passed"""
+        if self.multiproc_dir and time.time() - self._last_flush >= FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """Write this worker's snapshot to the multiprocess directory"""
+        if not self.multiproc_dir:
+            return
+        self._last_flush = time.time()
+        try:
+            os.makedirs(self.multiproc_dir, exist_ok=True)
+            path = os.path.join(self.multiproc_dir, f"metrics_{os.getpid()}.json")
+            temp_path = f"{path}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump(self.snapshot(), f)
+            # Atomic rename so readers never see a partial file
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.error(f"Metrics flush error: {e}")
+
+    def _collect_all(self):
+        """Snapshots from every worker as (pid, values) pairs"""
+        if not self.multiproc_dir:
+            return [(os.getpid(), self.snapshot())]
+
+        self.flush()
+        snapshots = []
+        for path in glob.glob(os.path.join(self.multiproc_dir, 'metrics_*.json')):
+            pid = os.path.basename(path)[len('metrics_'):-len('.json')]
+            if not pid.isdigit() or not _pid_alive(int(pid)):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            try:
+                with open(path) as f:
+                    snapshots.append((pid, json.load(f)))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Skipping unreadable metrics snapshot {path}: {e}")
+        return snapshots
+
+    def render(self):
+        """Prometheus text exposition of all workers' metrics"""
+        merged = {}
+        for pid, values in self._collect_all():
+            for name, labels, value in values:
+                if name not in self._definitions:
+                    continue
+                labels = tuple(tuple(label) for label in labels)
+                # Gauges are per-process readings, so keep each worker's separately
+                if self._definitions[name][0] == 'gauge' and self.multiproc_dir:
+                    labels = tuple(sorted(labels + (('pid', str(pid)),)))
+                key = (name, labels)
+                if isinstance(value, list):
+                    current = merged.get(key)
+                    merged[key] = value if current is None else [a + b for a, b in zip(current, value)]
+                else:
+                    merged[key] = merged.get(key, 0) + value
+
+        lines = []
+        for name, (metric_type, help_text, buckets) in sorted(self._definitions.items()):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for (sample_name, labels), value in sorted(merged.items()):
+                if sample_name != name:
+                    continue
+                if metric_type == 'histogram':
+                    cumulative = 0
+                    for bound, count in zip(buckets + (math.inf,), value[:-2]):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(labels + (('le', _format_value(bound)),))} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(value[-2])}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {value[-1]}")
+                else:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+# Process-wide registry used by the API
+registry = MetricsRegistry(os.environ.get('PROMETHEUS_MULTIPROC_DIR'))
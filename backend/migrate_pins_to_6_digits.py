@@ -5,6 +5,7 @@ Run this once to standardize all existing businesses to 6-digit PINs
 
 import random
 from firebase_utils import FirebaseDB
+from firebase_query import Query
 
 # Initialize database
 firebase_db = FirebaseDB()
@@ -15,13 +16,14 @@ def migrate_pins_to_6_digits():
     print("Starting PIN migration...")
     
     try:
-        # Get all businesses
-        businesses = firebase_db.list_documents('businesses')
+        # Stream all businesses a page at a time
+        businesses = firebase_db.iter_documents('businesses', [
+            Query.select(['access_pin', 'name'])
+        ])
         
         updated_count = 0
         already_6_digit = 0
         
-        # businesses is already a list of documents
         for business in businesses:
             business_id = business['$id']
             current_pin = business.get('access_pin', '')
@@ -0,0 +1,133 @@
+"""
+Phone Index - One document per registered phone number
+phone_index/{phone_number} maps a phone number to its user and business, so login
+is a point read instead of a query, and registration creates the index entry,
+user and business in one Firestore transaction. A second registration for the
+same number reads the existing entry inside its transaction and is rejected.
+
+Accounts created before the index are found through the old query and indexed
+on their next login or registration attempt; `python phone_index.py` backfills
+all of them at once.
+"""
+import logging
+from datetime import datetime
+from firebase_query import Query
+from firebase_utils import BATCH_LIMIT
+
+logger = logging.getLogger(__name__)
+
+class PhoneAlreadyRegistered(Exception):
+    """The phone number already belongs to an account"""
+
+def _legacy_entry(firebase_db, phone_number):
+    """Build an index entry for an account registered before the index existed"""
+    users = firebase_db.list_documents('users', [
+        Query.equal('phone_number', phone_number),
+        Query.equal('user_type', 'business')
+    ], limit=1)
+    if not users:
+        return None
+
+    businesses = firebase_db.list_documents('businesses', [
+        Query.equal('user_id', users[0]['$id'])
+    ], limit=1)
+    return {
+        'user_id': users[0]['$id'],
+        'business_id': businesses[0]['$id'] if businesses else None,
+        'user_type': 'business',
+        'created_at': datetime.utcnow().isoformat()
+    }
+
+def lookup(firebase_db, phone_number):
+    """
+    Get the {user_id, business_id, user_type} entry for a phone number, or None
+    Unindexed legacy accounts are looked up by query and indexed on the way
+    """
+    entry = firebase_db.get_document('phone_index', phone_number)
+    if entry:
+        return entry
+
+    entry = _legacy_entry(firebase_db, phone_number)
+    if entry and entry['business_id']:
+        firebase_db.batch_write([('merge', 'phone_index', phone_number, entry)])
+    return entry
+
+def register(firebase_db, phone_number, user_id, user_data, business_id, business_data):
+    """
+    Create the index entry, user and business atomically
+    Raises PhoneAlreadyRegistered if the number is taken; returns False on write failure
+    """
+    # Accounts older than the index have no entry for the transaction to see
+    if _legacy_entry(firebase_db, phone_number):
+        raise PhoneAlreadyRegistered(phone_number)
+
+    taken = []
+
+    def build_operations(documents):
+        taken.clear()
+        if documents.get(('phone_index', phone_number)):
+            taken.append(True)
+            return []
+        return [
+            ('create', 'phone_index', phone_number, {
+                'user_id': user_id,
+                'business_id': business_id,
+                'user_type': user_data.get('user_type', 'business')
+            }),
+            ('create', 'users', user_id, user_data),
+            ('create', 'businesses', business_id, business_data)
+        ]
+
+    committed = firebase_db.run_transaction([('phone_index', phone_number)], build_operations)
+    if taken:
+        raise PhoneAlreadyRegistered(phone_number)
+    return committed
+
+def backfill(firebase_db, page_size=BATCH_LIMIT):
+    """Index every business account that has no phone_index entry yet"""
+    businesses = firebase_db.iter_documents('businesses', [Query.select(['user_id'])])
+    business_by_user = {business.get('user_id'): business['$id'] for business in businesses}
+
+    users = firebase_db.iter_documents('users', [
+        Query.equal('user_type', 'business'),
+        Query.select(['phone_number'])
+    ], page_size=page_size)
+
+    # Users are checked and indexed one page at a time
+    indexed = 0
+    indexed_numbers = set()
+    page = []
+    for user in users:
+        page.append(user)
+        if len(page) == page_size:
+            indexed += _backfill_page(firebase_db, page, business_by_user, indexed_numbers)
+            page = []
+    if page:
+        indexed += _backfill_page(firebase_db, page, business_by_user, indexed_numbers)
+    return indexed
+
+def _backfill_page(firebase_db, users, business_by_user, indexed_numbers):
+    """Index one page of users; returns how many entries were written"""
+    existing = firebase_db.get_many('phone_index', [user.get('phone_number') for user in users if user.get('phone_number')])
+    operations = []
+    for user in users:
+        phone_number = user.get('phone_number')
+        if (not phone_number or phone_number in existing or phone_number in indexed_numbers
+                or user['$id'] not in business_by_user):
+            continue
+        # With duplicate legacy registrations the first account found keeps the number
+        indexed_numbers.add(phone_number)
+        operations.append(('create', 'phone_index', phone_number, {
+            'user_id': user['$id'],
+            'business_id': business_by_user[user['$id']],
+            'user_type': 'business'
+        }))
+
+    if operations and not firebase_db.batch_write(operations):
+        logger.error("Failed to write phone index backfill")
+        return 0
+    return len(operations)
+
+if __name__ == '__main__':
+    from firebase_utils import db
+    print(f"Indexed {backfill(db)} phone number(s)")
@@ -0,0 +1,186 @@
+"""
+Product Search - Prefix index for searching a business's catalog
+Every product stores `search_terms`: the prefixes of the words in its name,
+category, subcategory and HSN code. A search fetches only the products containing
+the query's rarest word as a term (one array-contains query), checks the other
+words against those candidates and ranks them, so a search reads its matches
+rather than the whole catalog. At most SEARCH_MAX_CANDIDATES candidates are read;
+search() reports when a very common word hit that cap.
+
+Terms are written by add_product/update_product. Products saved before the index
+existed are indexed the first time their business is searched in each worker;
+`python product_search.py` indexes every business at once.
+
+Needs a composite index on products (business_id ASC, search_terms ARRAY_CONTAINS).
+"""
+import logging
+import os
+import re
+import threading
+from firebase_query import Query
+from firebase_utils import BATCH_LIMIT
+
+logger = logging.getLogger(__name__)
+
+# Bump when term generation changes so stored terms are rebuilt
+SEARCH_VERSION = 1
+
+# Longest prefix stored per word; longer query words match on this prefix and are
+# then checked in full against the candidates
+MAX_PREFIX_LENGTH = 15
+
+# Candidates (products containing the query's rarest word) read per search
+SEARCH_MAX_CANDIDATES = int(os.environ.get('SEARCH_MAX_CANDIDATES', 5000))
+
+# Product fields whose words are searchable
+INDEXED_FIELDS = ('name', 'category', 'subcategory', 'hsn_code')
+
+_indexed_businesses = set()
+_indexed_lock = threading.Lock()
+
+def words(text):
+    """Lowercase words of a text (letters and digits in any script)"""
+    return re.findall(r'\w+', str(text or '').lower())
+
+def search_terms(product):
+    """Sorted prefixes of every word in a product's indexed fields"""
+    terms = set()
+    for field in INDEXED_FIELDS:
+        for word in words(product.get(field)):
+            for length in range(1, min(len(word), MAX_PREFIX_LENGTH) + 1):
+                terms.add(word[:length])
+    return sorted(terms)
+
+def index_fields(product):
+    """Fields to store on a product document so it can be searched"""
+    return {'search_terms': search_terms(product), 'search_version': SEARCH_VERSION}
+
+def needs_reindex(update_data):
+    """Whether an update touches a field the search terms are built from"""
+    return any(field in update_data for field in INDEXED_FIELDS)
+
+def score(product, tokens, phrase):
+    """
+    Relevance of a product for the query words, or None if a word does not match
+    Name matches outrank category/HSN matches; a whole-name match ranks first
+    """
+    name = str(product.get('name') or '').lower()
+    name_words = words(name)
+    other_words = [word for field in INDEXED_FIELDS[1:] for word in words(product.get(field))]
+
+    total = 0
+    if name == phrase:
+        total += 100
+    elif name.startswith(phrase):
+        total += 50
+
+    for token in tokens:
+        if token in name_words:
+            total += 10
+        elif any(word.startswith(token) for word in name_words):
+            total += 5
+        elif any(word.startswith(token) for word in other_words):
+            total += 1
+        else:
+            return None
+    return total
+
+def ensure_indexed(firebase_db, business_id):
+    """Index a business's products saved before search terms were maintained, once per worker"""
+    if business_id in _indexed_businesses:
+        return
+
+    # Two aggregation queries (one read per 1000 products) to skip the scan when up to date
+    total = firebase_db.count('products', [Query.equal('business_id', business_id)])
+    indexed = firebase_db.count('products', [
+        Query.equal('business_id', business_id),
+        Query.equal('search_version', SEARCH_VERSION)
+    ])
+    if total is not None and total == indexed:
+        with _indexed_lock:
+            _indexed_businesses.add(business_id)
+        return
+
+    operations = []
+    for product in firebase_db.iter_documents('products', [
+        Query.equal('business_id', business_id),
+        Query.select(list(INDEXED_FIELDS) + ['search_version'])
+    ]):
+        if product.get('search_version') != SEARCH_VERSION:
+            operations.append(('merge', 'products', product['$id'], index_fields(product)))
+            if len(operations) == BATCH_LIMIT:
+                if not firebase_db.batch_write(operations):
+                    logger.error(f"Failed to index products of business {business_id}")
+                    return
+                operations = []
+
+    if operations and not firebase_db.batch_write(operations):
+        logger.error(f"Failed to index products of business {business_id}")
+        return
+    with _indexed_lock:
+        _indexed_businesses.add(business_id)
+
+def search(firebase_db, business_id, text):
+    """
+    Products of a business matching every word of text, best matches first
+    Returns (products, truncated); truncated is True when more than
+    SEARCH_MAX_CANDIDATES products contain the rarest word, so some matches were not read.
+    Other filters are best applied to the results, which needs no further indexes
+    """
+    tokens = list(dict.fromkeys(words(text)))
+    if not tokens:
+        return [], False
+
+    ensure_indexed(firebase_db, business_id)
+
+    # Firestore allows one array-contains per query, so query on the rarest word
+    # (counted with cheap aggregations) and check the others on the candidates
+    terms = list(dict.fromkeys(token[:MAX_PREFIX_LENGTH] for token in tokens))
+    anchor = terms[0]
+    if len(terms) > 1:
+        counts = firebase_db.gather([
+            lambda term=term: firebase_db.count('products', [
+                Query.equal('business_id', business_id),
+                Query.contains('search_terms', term)
+            ])
+            for term in terms
+        ])
+        if 0 in counts:
+            return [], False
+        anchor = min(zip(terms, counts), key=lambda item: item[1] if item[1] is not None else float('inf'))[0]
+
+    # Paged, so only the matches are held; one extra candidate tells whether the cap was hit
+    candidates = firebase_db.iter_documents('products', [
+        Query.equal('business_id', business_id),
+        Query.contains('search_terms', anchor),
+        Query.limit(SEARCH_MAX_CANDIDATES + 1)
+    ])
+
+    phrase = ' '.join(words(text))
+    ranked = []
+    truncated = False
+    for scanned, product in enumerate(candidates):
+        if scanned == SEARCH_MAX_CANDIDATES:
+            truncated = True
+            logger.warning(f"Search {text!r} in business {business_id} stopped at {SEARCH_MAX_CANDIDATES} candidates")
+            break
+        relevance = score(product, tokens, phrase)
+        if relevance is not None:
+            ranked.append((-relevance, len(product.get('name') or ''), str(product.get('name') or '').lower(), product))
+    ranked.sort(key=lambda item: item[:3])
+    return [product for *_, product in ranked], truncated
+
+def backfill(firebase_db):
+    """Index the products of every business; returns the number of businesses"""
+    business_ids = {
+        product.get('business_id')
+        for product in firebase_db.iter_documents('products', [Query.select(['business_id'])])
+    }
+    for business_id in business_ids:
+        if business_id:
+            ensure_indexed(firebase_db, business_id)
+    return len(business_ids)
+
+if __name__ == '__main__':
+    from firebase_utils import db
+    print(f"Indexed products of {backfill(db)} business(es)")
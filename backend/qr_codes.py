@@ -0,0 +1,123 @@
+"""
+QR Codes - Rendering and caching of business QR codes
+A QR image only depends on its payload and styling, so rendered images are cached
+per (business_id, pin, colors, size, format) and served with a deterministic ETag.
+Because the PIN is part of the key, a regenerated PIN never serves a stale image.
+"""
+import hashlib
+import os
+import re
+from io import BytesIO
+from firebase_cache import LRUCache
+
+# Bump when rendering changes so clients drop images cached under old ETags
+RENDER_VERSION = 1
+
+IMAGE_FORMATS = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml'
+}
+
+MIN_BOX_SIZE = 1
+MAX_BOX_SIZE = 40
+
+_HEX_COLOR = re.compile(r'^#?([0-9a-fA-F]{6})$')
+_NAMED_COLORS = {'black': '#000000', 'white': '#ffffff'}
+
+_cache = LRUCache(
+    max_entries=int(os.environ.get('QR_CACHE_MAX_ENTRIES', 512)),
+    max_bytes=int(os.environ.get('QR_CACHE_MAX_BYTES', 8 * 1024 * 1024)),
+    default_ttl=int(os.environ.get('QR_CACHE_TTL', 24 * 60 * 60)),
+    collection_ttls={}
+)
+
+def normalize_color(color):
+    """Normalize a color to #rrggbb, or None if it is not a supported color"""
+    if not color:
+        return None
+    color = _NAMED_COLORS.get(color.lower(), color)
+    match = _HEX_COLOR.match(color)
+    return f"#{match.group(1).lower()}" if match else None
+
+def _cache_key(business_id, pin, data, fill_color, back_color, box_size, border, error_correction, image_format):
+    return f"{business_id}:{pin}:{data}:{fill_color}:{back_color}:{box_size}:{border}:{error_correction}:{image_format}"
+
+def qr_etag(cache_key):
+    """Strong ETag for a rendered QR image, computable without rendering it"""
+    return hashlib.sha1(f"{RENDER_VERSION}:{cache_key}".encode('utf-8')).hexdigest()
+
+def _build_matrix(data, error_correction, border):
+    import qrcode
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=getattr(qrcode.constants, f"ERROR_CORRECT_{error_correction}"),
+        box_size=1,
+        border=border,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    return qr
+
+def render_png(data, fill_color, back_color, box_size, border, error_correction):
+    """Render a QR code as PNG bytes"""
+    qr = _build_matrix(data, error_correction, border)
+    qr.box_size = box_size
+    img = qr.make_image(fill_color=fill_color, back_color=back_color)
+    img_io = BytesIO()
+    img.save(img_io, 'PNG')
+    return img_io.getvalue()
+
+def render_svg(data, fill_color, back_color, box_size, border, error_correction):
+    """Render a QR code as a single-path SVG; much cheaper than PNG and needs no Pillow"""
+    matrix = _build_matrix(data, error_correction, border).get_matrix()
+    size = len(matrix)
+
+    # One horizontal run per stretch of dark modules keeps the path short
+    runs = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < size:
+            if row[x]:
+                start = x
+                while x < size and row[x]:
+                    x += 1
+                runs.append(f"M{start} {y}h{x - start}v1h-{x - start}z")
+            else:
+                x += 1
+
+    pixels = size * box_size
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{pixels}" height="{pixels}" '
+        f'viewBox="0 0 {size} {size}" shape-rendering="crispEdges">'
+        f'<rect width="{size}" height="{size}" fill="{back_color}"/>'
+        f'<path fill="{fill_color}" d="{"".join(runs)}"/></svg>'
+    ).encode('utf-8')
+
+def get_qr_image(business_id, pin, data, fill_color='#000000', back_color='#ffffff', box_size=10,
+                 border=4, error_correction='H', image_format='png', if_none_match=None):
+    """
+    Get a rendered QR image from the cache, rendering it on a miss
+    Returns (etag, content, mimetype); content is None when if_none_match already
+    holds the current ETag, so the caller can answer 304 without rendering
+    """
+    cache_key = _cache_key(business_id, pin, data, fill_color, back_color, box_size, border, error_correction, image_format)
+    etag = qr_etag(cache_key)
+    mimetype = IMAGE_FORMATS[image_format]
+
+    if if_none_match is not None and if_none_match.contains(etag):
+        return etag, None, mimetype
+
+    content = _cache.get(cache_key)
+    if content is None:
+        render = render_svg if image_format == 'svg' else render_png
+        content = render(data, fill_color, back_color, box_size, border, error_correction)
+        _cache.set(cache_key, content, _cache.default_ttl)
+    return etag, content, mimetype
+
+def invalidate_business(business_id):
+    """Drop every cached QR image for a business, e.g. after its PIN changes"""
+    _cache.invalidate_prefix(f"{business_id}:")
+
+def cache_stats():
+    """Get QR cache hit/miss/eviction counters"""
+    return _cache.stats()
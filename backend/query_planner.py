@@ -0,0 +1,148 @@
+"""
+Query Planner - Split firebase_query.Query lists into what Firestore runs and what we filter
+Everything Firestore can execute is pushed down to the query. What it cannot
+(endsWith, search) becomes a residual filter applied to documents as they stream in,
+with any in-query offset and limit applied after it, so reading stops as soon as
+enough documents have matched.
+
+Residual queries read more documents than they return, so every one is logged to
+the firebase.query_fallbacks logger with the documents scanned and returned.
+"""
+import json
+import logging
+import re
+from firebase_stats import query_shape
+
+logger = logging.getLogger(__name__)
+fallback_logger = logging.getLogger('firebase.query_fallbacks')
+
+# Translated to Firestore by FirebaseDB._parse_query
+NATIVE_QUERY_TYPES = (
+    'equal', 'notEqual', 'lessThan', 'lessThanEqual', 'greaterThan', 'greaterThanEqual',
+    'between', 'startsWith', 'contains', 'isNull', 'isNotNull',
+    'orderAsc', 'orderDesc', 'select', 'offset', 'cursorAfter', 'cursorBefore', 'cursorAfterValues'
+)
+
+# Checked against each fetched document
+RESIDUAL_QUERY_TYPES = ('endsWith', 'search')
+
+def words(text):
+    """Lowercase words of a text (letters and digits in any script)"""
+    return re.findall(r'\w+', str(text or '').lower())
+
+def field_value(document, path):
+    """Value of a (dotted) field of a document, or None when missing"""
+    value = document
+    for part in path.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+def matches(document, q):
+    """Whether a document satisfies one residual query"""
+    value = field_value(document, q['attribute'])
+    if q['type'] == 'endsWith':
+        return isinstance(value, str) and value.endswith(q['value'])
+    # search: every query word starts a word of the field, like a full-text prefix search
+    field_words = words(value)
+    return all(any(word.startswith(token) for word in field_words) for token in words(q['value']))
+
+class QueryPlan:
+    """
+    Queries for Firestore plus what is applied to the documents it returns
+    admit() each fetched document in order; stop once `returned` reaches the limit
+    """
+
+    def __init__(self):
+        self.native = []
+        self.residual = []
+        self.limit = None
+        self.offset = 0
+        self.added_fields = []
+        self.scanned = 0
+        self.returned = 0
+
+    def result_limit(self, limit=None):
+        """The smaller of an in-query limit and the caller's limit (None for no limit)"""
+        limits = [value for value in (self.limit, limit) if value is not None]
+        return max(0, min(limits)) if limits else None
+
+    def satisfied(self, limit):
+        """Whether enough documents have been returned for limit (None for no limit)"""
+        return limit is not None and self.returned >= limit
+
+    def admit(self, document):
+        """The document to return for a fetched one, or None if it is filtered out or skipped"""
+        self.scanned += 1
+        if not all(matches(document, q) for q in self.residual):
+            return None
+        if self.offset:
+            self.offset -= 1
+            return None
+        self.returned += 1
+        if self.added_fields:
+            document = {key: value for key, value in document.items() if key not in self.added_fields}
+        return document
+
+    def apply(self, documents, limit=None):
+        """Yield the documents to return from an iterable of fetched ones, stopping at limit"""
+        limit = self.result_limit(limit)
+        if limit == 0:
+            return
+        for document in documents:
+            document = self.admit(document)
+            if document is not None:
+                yield document
+                if self.satisfied(limit):
+                    return
+
+    def report(self, collection_name, queries, operation='list'):
+        """Log a query that was (partly) filtered client-side"""
+        if self.residual:
+            fallback_logger.warning(json.dumps({
+                'event': 'client_side_filter',
+                'operation': operation,
+                'collection': collection_name,
+                'shape': query_shape(queries),
+                'residual': [q['type'] for q in self.residual],
+                'scanned': self.scanned,
+                'returned': self.returned
+            }))
+
+def plan(queries):
+    """Split Appwrite-style queries into a QueryPlan"""
+    result = QueryPlan()
+    offset = None
+    select = None
+
+    for q in queries or []:
+        query_type = q.get('type') if isinstance(q, dict) else None
+        if query_type == 'limit':
+            result.limit = q['value'] if result.limit is None else min(result.limit, q['value'])
+        elif query_type == 'offset':
+            offset = q
+        elif query_type == 'select':
+            select = q
+        elif query_type in RESIDUAL_QUERY_TYPES:
+            result.residual.append(q)
+        elif query_type in NATIVE_QUERY_TYPES or not isinstance(q, dict):
+            result.native.append(q)
+        else:
+            logger.warning(f"Ignoring unsupported query type {query_type!r}")
+
+    if result.residual:
+        # Skipping happens after filtering, so Firestore cannot apply the offset
+        result.offset = offset['value'] if offset else 0
+        if select:
+            # Fetch the fields the filter needs and drop them from the results
+            selected = {field.split('.')[0] for field in select['attributes']}
+            fields = [q['attribute'] for q in result.residual if q['attribute'].split('.')[0] not in selected]
+            select = {**select, 'attributes': list(select['attributes']) + list(dict.fromkeys(fields))}
+            result.added_fields = list(dict.fromkeys(field.split('.')[0] for field in fields))
+    elif offset:
+        result.native.append(offset)
+
+    if select:
+        result.native.append(select)
+    return result
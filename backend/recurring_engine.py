@@ -0,0 +1,399 @@
+"""
+Recurring Engine - Executes due recurring transactions
+Finds active schedules whose next_execution_date has passed, records one credit
+transaction per missed period and advances the schedule, committing everything
+through FirebaseDB.batch_write in batches of up to 500 writes.
+
+Runs are idempotent per period: a generated transaction's ID is derived from the
+schedule and the period date and is written with 'insert', so a batch that would
+record a period twice fails as a whole. A schedule's transactions, balance updates
+and new next_execution_date are always committed in the same atomic batch. When a
+batch fails, its schedules are retried one by one in Firestore transactions that
+skip periods already recorded. A lease document keeps two runners (cron plus an
+in-process worker) from overlapping.
+
+Periods more than RECURRING_MAX_CATCH_UP_DAYS old are skipped rather than billed, so
+schedules left behind (never executed, or by an outage) do not back-date months of
+credit entries; resumed schedules start from their next future period.
+
+Needs a composite index on recurring_transactions (is_active ASC, next_execution_date ASC).
+
+Usage:
+    python recurring_engine.py
+    python recurring_engine.py --dry-run
+    python recurring_engine.py --loop 300
+"""
+import argparse
+import calendar
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from firebase_query import Query
+from firebase_utils import BATCH_LIMIT
+import leases
+from ledger_summary import SummaryUnavailable, credit_document_id, get_summary
+
+logger = logging.getLogger(__name__)
+
+# Schedules fetched per query
+PAGE_SIZE = 1000
+
+# Periods caught up per schedule per run; further periods are picked up by the next run
+MAX_CATCH_UP_PERIODS = 31
+
+# Due periods older than this many days are skipped instead of billed
+MAX_CATCH_UP_DAYS = int(os.environ.get('RECURRING_MAX_CATCH_UP_DAYS', 7))
+
+# Seconds a runner's lease stays valid without being renewed
+LEASE_SECONDS = 600
+LEASE_DOCUMENT = ('scheduler_locks', 'recurring_transactions')
+
+FREQUENCIES = ('daily', 'weekly', 'monthly')
+
+def parse_date(value):
+    """Parse a stored ISO timestamp, or None"""
+    try:
+        return datetime.fromisoformat(value) if value else None
+    except (TypeError, ValueError):
+        return None
+
+def advance(when, frequency, day_of_month=None):
+    """
+    Next execution time after `when`
+    Monthly schedules keep their day of month, clamped to shorter months
+    """
+    if frequency == 'daily':
+        return when + timedelta(days=1)
+    if frequency == 'weekly':
+        return when + timedelta(weeks=1)
+
+    year, month = (when.year + 1, 1) if when.month == 12 else (when.year, when.month + 1)
+    day = min(day_of_month or when.day, calendar.monthrange(year, month)[1])
+    return when.replace(year=year, month=month, day=day)
+
+def period_transaction_id(schedule_id, period):
+    """Deterministic transaction ID for one period of a schedule"""
+    return f"recurring_{schedule_id}_{period.strftime('%Y%m%d')}"
+
+def schedule_day_of_month(schedule):
+    """Day of month a monthly schedule runs on: the day it was created"""
+    created = parse_date(schedule.get('created_at'))
+    return created.day if created else None
+
+def due_periods(schedule, now):
+    """
+    Execution times that are due for a schedule, and the next one after them
+    Periods older than MAX_CATCH_UP_DAYS are skipped, not returned
+    Returns (periods, next_execution, skipped)
+    """
+    frequency = schedule.get('frequency')
+    when = parse_date(schedule.get('next_execution_date'))
+    day_of_month = schedule_day_of_month(schedule)
+
+    horizon = now - timedelta(days=MAX_CATCH_UP_DAYS)
+    skipped = 0
+    while when < horizon:
+        when = advance(when, frequency, day_of_month)
+        skipped += 1
+
+    periods = []
+    while when <= now and len(periods) < MAX_CATCH_UP_PERIODS:
+        periods.append(when)
+        when = advance(when, frequency, day_of_month)
+    return periods, when, skipped
+
+def resume_date(schedule, now):
+    """
+    next_execution_date for a schedule being re-activated: its first period after now,
+    so the periods missed while it was paused are not billed
+    """
+    when = parse_date(schedule.get('next_execution_date'))
+    if when is None or schedule.get('frequency') not in FREQUENCIES:
+        return now
+    day_of_month = schedule_day_of_month(schedule)
+    while when <= now:
+        when = advance(when, schedule['frequency'], day_of_month)
+    return when
+
+def acquire_lease(firebase_db, owner):
+    """Take or renew the runner lease; False if another runner holds it"""
+    return leases.acquire(firebase_db, LEASE_DOCUMENT, owner, LEASE_SECONDS)
+
+def release_lease(firebase_db, owner):
+    """Give up the runner lease if this runner still holds it"""
+    leases.release(firebase_db, LEASE_DOCUMENT, owner)
+
+def schedule_operations(schedule, periods, next_execution, credit, balances, now):
+    """
+    Writes for one schedule: its period transactions, the customer balance and
+    the advanced schedule. credit is the stored customer_credits document, if any.
+    Returns (operations, summary_delta)
+    """
+    business_id = schedule['business_id']
+    customer_id = schedule['customer_id']
+    amount = float(schedule.get('amount', 0))
+    total = amount * len(periods)
+    credit_id = credit_document_id(business_id, customer_id)
+
+    operations = []
+    for period in periods:
+        created_at = period.isoformat()
+        operations.append(('insert', 'transactions', period_transaction_id(schedule['$id'], period), {
+            'business_id': business_id,
+            'customer_id': customer_id,
+            'transaction_type': 'credit',
+            'amount': amount,
+            'notes': schedule.get('notes', ''),
+            'receipt_image_url': '',
+            'created_by': 'recurring',
+            'recurring_transaction_id': schedule['$id'],
+            'created_at': created_at,
+            'updated_at': now.isoformat()
+        }))
+
+    # Balances read at the start of the run, kept current as this run adds to them
+    old_balance = balances.get(credit_id, 0)
+    balances[credit_id] = old_balance + total
+
+    if periods:
+        # A caught-up period can be older than a transaction recorded by hand since
+        last_transaction_at = max((credit or {}).get('last_transaction_at') or '', periods[-1].isoformat())
+        operations.append(('merge', 'customer_credits', credit_id, {
+            'business_id': business_id,
+            'customer_id': customer_id,
+            'last_transaction_at': last_transaction_at
+        }))
+        operations.append(('increment', 'customer_credits', credit_id, {
+            'current_balance': total,
+            'total_credit': total,
+            'transaction_count': len(periods)
+        }))
+
+    schedule_update = {'next_execution_date': next_execution.isoformat()}
+    if periods:
+        schedule_update.update({
+            'last_executed_at': now.isoformat(),
+            'last_period': periods[-1].strftime('%Y-%m-%d')
+        })
+    operations.append(('update', 'recurring_transactions', schedule['$id'], schedule_update))
+
+    summary_delta = {
+        'total_credit': total,
+        'outstanding_balance': total,
+        'pending_customers_count': int(balances[credit_id] > 0) - int(old_balance > 0),
+        'total_transactions': len(periods)
+    }
+    return operations, summary_delta
+
+def execute_schedule(firebase_db, schedule, periods, next_execution, now):
+    """
+    Commit one schedule on its own in a Firestore transaction, after its batch failed
+    The schedule, balance and period transactions are read again: nothing is written if
+    the schedule has moved on (another runner, a toggle), and periods whose transaction
+    already exists are not billed twice. Returns the transactions created, or None
+    """
+    schedule_key = ('recurring_transactions', schedule['$id'])
+    credit_key = ('customer_credits', credit_document_id(schedule['business_id'], schedule['customer_id']))
+    period_keys = [('transactions', period_transaction_id(schedule['$id'], period)) for period in periods]
+    created = []
+
+    def build_operations(documents):
+        created.clear()
+        current = documents.get(schedule_key)
+        if (not current or not current.get('is_active')
+                or current.get('next_execution_date') != schedule.get('next_execution_date')):
+            return []
+
+        credit = documents.get(credit_key)
+        new_periods = [period for period, key in zip(periods, period_keys) if documents.get(key) is None]
+        created.extend(new_periods)
+        balances = {credit_key[1]: float((credit or {}).get('current_balance', 0))}
+        operations, summary_delta = schedule_operations(schedule, new_periods, next_execution, credit, balances, now)
+        return operations + [('increment', 'business_summaries', schedule['business_id'], summary_delta)]
+
+    if not firebase_db.run_transaction([schedule_key, credit_key] + period_keys, build_operations):
+        return None
+    return len(created)
+
+def commit_chunk(firebase_db, operations, summaries, dry_run):
+    """Commit one chunk of schedule writes plus its per-business summary increments"""
+    operations = operations + [
+        ('increment', 'business_summaries', business_id, delta)
+        for business_id, delta in summaries.items()
+    ]
+    if dry_run:
+        return True
+    return firebase_db.batch_write(operations)
+
+def run_due(firebase_db, now=None, dry_run=False, page_size=PAGE_SIZE):
+    """
+    Execute every due schedule once
+    Returns counts of schedules executed/failed/skipped and transactions created
+    """
+    now = now or datetime.utcnow()
+    owner = leases.new_owner()
+    stats = {'schedules': 0, 'transactions': 0, 'failed': 0, 'skipped': 0, 'skipped_periods': 0, 'batches': 0}
+
+    def commit(operations, summaries, executed):
+        """Commit a chunk, falling back to one transaction per schedule if the batch fails"""
+        stats['batches'] += 1
+        if commit_chunk(firebase_db, operations, summaries, dry_run):
+            stats['schedules'] += len(executed)
+            stats['transactions'] += sum(len(periods) for _, periods, _ in executed)
+            return
+
+        logger.warning(f"Recurring batch of {len(executed)} schedule(s) failed; retrying them one by one")
+        for schedule, periods, next_execution in executed:
+            created = execute_schedule(firebase_db, schedule, periods, next_execution, now)
+            if created is None:
+                stats['failed'] += 1
+            else:
+                stats['schedules'] += 1
+                stats['transactions'] += created
+
+    if not dry_run and not acquire_lease(firebase_db, owner):
+        logger.info("Recurring run skipped: another runner holds the lease")
+        stats['locked'] = True
+        return stats
+
+    started = time.perf_counter()
+    seen = set()
+    lower_bound = ''
+    # Businesses whose summary is known to be current, or could not be made so
+    current_summaries = set()
+    unavailable_summaries = set()
+    try:
+        while True:
+            if not dry_run and seen and not acquire_lease(firebase_db, owner):
+                logger.warning("Recurring run stopped: lease was taken over by another runner")
+                break
+
+            # Pages continue from the last next_execution_date read rather than a
+            # document cursor, because committed schedules have already moved past now
+            page = firebase_db.list_documents('recurring_transactions', [
+                Query.equal('is_active', True),
+                Query.greaterThanEqual('next_execution_date', lower_bound),
+                Query.lessThanEqual('next_execution_date', now.isoformat()),
+                Query.order_asc('next_execution_date')
+            ], limit=page_size)
+            schedules = [schedule for schedule in page if schedule['$id'] not in seen]
+            if not schedules:
+                if len(page) >= page_size:
+                    logger.warning(f"More than {page_size} schedules share next_execution_date {lower_bound}; "
+                                   f"the rest run next time")
+                break
+            seen.update(schedule['$id'] for schedule in schedules)
+            lower_bound = schedules[-1]['next_execution_date']
+
+            # Increments must only land on a current summary, so backfill outdated
+            # ones first (this also writes the balances read below)
+            for business_id in {schedule.get('business_id') for schedule in schedules} - current_summaries:
+                if not business_id or dry_run:
+                    continue
+                try:
+                    get_summary(firebase_db, business_id)
+                    current_summaries.add(business_id)
+                except SummaryUnavailable as e:
+                    logger.warning(f"Recurring transactions of business {business_id} wait for the next run: {e}")
+                    unavailable_summaries.add(business_id)
+
+            # One batched read of the balances this page touches, for pending_customers_count
+            credit_ids = list({
+                credit_document_id(schedule.get('business_id'), schedule.get('customer_id'))
+                for schedule in schedules
+            })
+            credits = firebase_db.get_many('customer_credits', credit_ids, parallel=True)
+            balances = {credit_id: float(credit.get('current_balance', 0)) for credit_id, credit in credits.items()}
+
+            operations, summaries, executed = [], {}, []
+            for schedule in schedules:
+                if (schedule.get('frequency') not in FREQUENCIES or not schedule.get('business_id')
+                        or not schedule.get('customer_id') or not parse_date(schedule.get('next_execution_date'))):
+                    logger.warning(f"Skipping malformed recurring transaction {schedule['$id']}")
+                    stats['skipped'] += 1
+                    continue
+                if schedule['business_id'] in unavailable_summaries:
+                    stats['skipped'] += 1
+                    continue
+
+                # One schedule that cannot be computed (e.g. a timezone-aware date
+                # compared with naive now) must not stop the rest of the run
+                credit_id = credit_document_id(schedule['business_id'], schedule['customer_id'])
+                had_balance, balance = credit_id in balances, balances.get(credit_id)
+                try:
+                    periods, next_execution, skipped = due_periods(schedule, now)
+                    schedule_ops, summary_delta = schedule_operations(
+                        schedule, periods, next_execution, credits.get(credit_id), balances, now
+                    )
+                except Exception as e:
+                    logger.error(f"Skipping recurring transaction {schedule['$id']}: {e}")
+                    if had_balance:
+                        balances[credit_id] = balance
+                    else:
+                        balances.pop(credit_id, None)
+                    stats['skipped'] += 1
+                    continue
+                if skipped:
+                    logger.info(f"Recurring transaction {schedule['$id']} skipped {skipped} period(s) "
+                                   f"older than {MAX_CATCH_UP_DAYS} days")
+                    stats['skipped_periods'] += skipped
+
+                # A schedule's writes never straddle two batches
+                business_id = schedule['business_id']
+                new_summaries = len(summaries) + (business_id not in summaries)
+                if operations and len(operations) + len(schedule_ops) + new_summaries > BATCH_LIMIT:
+                    commit(operations, summaries, executed)
+                    operations, summaries, executed = [], {}, []
+
+                operations.extend(schedule_ops)
+                summary = summaries.setdefault(business_id, {})
+                for field, value in summary_delta.items():
+                    summary[field] = summary.get(field, 0) + value
+                executed.append((schedule, periods, next_execution))
+
+            if operations:
+                commit(operations, summaries, executed)
+    finally:
+        if not dry_run:
+            release_lease(firebase_db, owner)
+
+    stats['seconds'] = round(time.perf_counter() - started, 2)
+    logger.info(f"Recurring run complete: {stats}")
+    return stats
+
+def start_worker(firebase_db, interval):
+    """Run due schedules every `interval` seconds on a daemon thread"""
+    def loop():
+        while True:
+            try:
+                run_due(firebase_db)
+            except Exception as e:
+                logger.error(f"Recurring worker error: {e}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=loop, name='recurring-worker', daemon=True)
+    thread.start()
+    return thread
+
+def main():
+    parser = argparse.ArgumentParser(description='Execute due recurring transactions')
+    parser.add_argument('--dry-run', action='store_true', help='Report what would be executed without writing')
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE, help='Schedules fetched per query')
+    parser.add_argument('--loop', type=int, metavar='SECONDS', help='Keep running, every SECONDS seconds')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    from firebase_utils import db as firebase_db
+
+    while True:
+        stats = run_due(firebase_db, dry_run=args.dry_run, page_size=args.page_size)
+        print(f"Executed {stats['schedules']} schedule(s), created {stats['transactions']} transaction(s), "
+              f"{stats['failed']} failed, {stats['skipped']} skipped")
+        if not args.loop:
+            break
+        time.sleep(args.loop)
+
+if __name__ == '__main__':
+    main()
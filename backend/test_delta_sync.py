@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Delta Sync Test
+Checks that an initial sync larger than SYNC_PAGE_LIMIT is paged to completion, that
+incremental syncs see every later write on a host whose local time is not UTC, and
+that a truncated feed moves forward even when its documents share one timestamp.
+Runs offline against the in-memory Firestore fake.
+
+Usage:
+    python -m pytest test_delta_sync.py
+"""
+
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import delta_sync
+
+PAGE_LIMIT = 50
+TRANSACTIONS = PAGE_LIMIT * 2 + 20
+
+@pytest.fixture(autouse=True)
+def small_pages_on_non_utc_host(monkeypatch):
+    """Small sync pages, and local time hours away from UTC; both restored afterwards"""
+    monkeypatch.setattr(delta_sync, 'SYNC_PAGE_LIMIT', PAGE_LIMIT)
+    monkeypatch.setenv('TZ', 'Asia/Kolkata')
+    if hasattr(time, 'tzset'):
+        time.tzset()
+    yield
+    monkeypatch.undo()
+    if hasattr(time, 'tzset'):
+        time.tzset()
+
+def sync(db, sync_token=None):
+    """Call collect_changes the way /api/sync does"""
+    decoded = delta_sync.decode_sync_token(sync_token) if sync_token else (None, True, None, None)
+    return delta_sync.collect_changes(db, 'b1', *decoded)
+
+def sync_until_done(db, sync_token=None, max_calls=20):
+    """Sync until has_more clears; returns (transaction ids, responses, final token)"""
+    received = []
+    responses = []
+    result = sync(db, sync_token)
+    while True:
+        responses.append(result)
+        received.extend(txn['$id'] for txn in result['changes']['transactions'])
+        if not result['has_more']:
+            return received, responses, result['sync_token']
+        assert len(responses) < max_calls, "sync never finished"
+        result = sync(db, result['sync_token'])
+
+def seed_ledger(db):
+    for i in range(TRANSACTIONS):
+        db.create_document('transactions', f"t{i:04d}", {'business_id': 'b1', 'amount': i})
+    db.create_document('customers', 'c1', {'business_id': 'b1', 'name': 'Asha'})
+    db.create_document('transactions', 'other', {'business_id': 'b2', 'amount': 1})
+
+def test_initial_sync_is_paged(db):
+    """an initial sync larger than SYNC_PAGE_LIMIT delivers every document"""
+    seed_ledger(db)
+    received, responses, _ = sync_until_done(db)
+
+    assert len(responses) == 3, f"expected 3 pages, got {len(responses)}"
+    assert responses[0]['full'] and not any(response['full'] for response in responses[1:])
+    assert sorted(received) == [f"t{i:04d}" for i in range(TRANSACTIONS)], f"got {len(received)} transactions"
+    assert [c['$id'] for c in responses[0]['changes']['customers']] == ['c1']
+    assert all(len(response['changes']['transactions']) <= PAGE_LIMIT for response in responses)
+
+def test_incremental_sync_after_initial(db):
+    """writes made after an initial sync reach the next incremental sync"""
+    seed_ledger(db)
+    _, _, sync_token = sync_until_done(db)
+
+    # Without an overlap the token is the only thing keeping the new write in the window
+    time.sleep(0.01)
+    db.create_document('transactions', 'new', {'business_id': 'b1', 'amount': 5})
+    db.update_document('customers', 'c1', {'name': 'Asha K'})
+    since = delta_sync.decode_sync_token(sync_token)[0]
+    result = delta_sync.collect_changes(db, 'b1', since, overlap=False)
+
+    assert [txn['$id'] for txn in result['changes']['transactions']] == ['new']
+    assert [c['name'] for c in result['changes']['customers']] == ['Asha K']
+
+    # Nothing new since: an exact resume returns nothing
+    since = delta_sync.decode_sync_token(result['sync_token'])[0]
+    time.sleep(0.01)
+    result = delta_sync.collect_changes(db, 'b1', since, overlap=False)
+    assert not result['changes']['transactions'], "already-synced transactions were sent again"
+
+def test_truncated_feed_with_one_timestamp_moves_forward(db):
+    """more than SYNC_PAGE_LIMIT changes sharing one updated_at are paged, not repeated"""
+    stamp = datetime.utcnow().isoformat()
+    # Like one recurring run: every transaction carries the same stamp
+    for i in range(TRANSACTIONS):
+        db.seed('transactions', f"r{i:04d}", {'business_id': 'b1', 'amount': i, 'created_at': stamp, 'updated_at': stamp})
+    since = (datetime.utcnow() - timedelta(minutes=1)).isoformat()
+
+    received, responses, sync_token = sync_until_done(db, delta_sync.encode_sync_token(since))
+
+    assert sorted(received) == [f"r{i:04d}" for i in range(TRANSACTIONS)]
+    assert len(received) == TRANSACTIONS, "a page was sent twice"
+    assert len(responses) == 3
+
+    # Once the feed is read to the end the token no longer carries its cursor
+    assert delta_sync.decode_sync_token(sync_token)[3] is None
+
+def test_invalid_tokens_rejected():
+    """a sync token with a malformed page cursor or feed cursor is rejected"""
+    bad = delta_sync.encode_sync_token('2025-01-01T00:00:00', pages={'transactions': '!!'})
+    assert delta_sync.decode_sync_token(bad) is None
+    bad = delta_sync.encode_sync_token('2025-01-01T00:00:00', pages={'users': 'dDE'})
+    assert delta_sync.decode_sync_token(bad) is None
+    bad = delta_sync.encode_sync_token('2025-01-01T00:00:00', cursors={'transactions': ['2025-01-01T00:00:00']})
+    assert delta_sync.decode_sync_token(bad) is None
+    bad = delta_sync.encode_sync_token('2025-01-01T00:00:00', cursors={'users': ['2025-01-01T00:00:00', 'u1']})
+    assert delta_sync.decode_sync_token(bad) is None
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Firebase Async Parity Test
+Runs the same queries through FirebaseDB and AsyncFirebaseDB over the in-memory
+Firestore fake and checks they return the same documents and bill the same reads:
+native and residual filters, offsets, cursors in both directions, explicit, Query
+and missing (None) limits, paging, iteration, aggregations and get_many.
+
+Usage:
+    python -m pytest test_firebase_async.py
+"""
+
+import asyncio
+import logging
+
+import pytest
+
+from firebase_query import Query
+from firebase_utils import BaseFirebaseDB, FirebaseDB
+
+# Residual queries and the missing cursor document are logged on purpose
+for name in ('firebase.query_fallbacks', 'firebase_utils', 'firebase_async'):
+    logging.getLogger(name).setLevel(logging.ERROR)
+
+PRODUCTS = 40
+
+QUERY_SETS = [
+    [],
+    [Query.equal('business_id', 'b1')],
+    [Query.equal('business_id', 'b1'), Query.orderDesc('price')],
+    [Query.equal('business_id', 'b1'), Query.orderAsc('price'), Query.limit(7)],
+    [Query.equal('business_id', 'b1'), Query.orderAsc('price'), Query.offset(5), Query.limit(4)],
+    [Query.greaterThan('price', 100), Query.select(['name', 'price'])],
+    [Query.endsWith('name', '7')],
+    [Query.search('name', 'rice'), Query.orderAsc('price'), Query.offset(2)],
+    [Query.search('name', 'rice'), Query.select(['price']), Query.limit(3)],
+    [Query.orderAsc('price'), Query.cursorAfter('p0010'), Query.limit(5)],
+    [Query.orderAsc('price'), Query.cursorBefore('p0030')],
+    [Query.orderAsc('price'), Query.endsWith('name', '1'), Query.cursorBefore('p0030'), Query.limit(2)],
+    [Query.orderAsc('price'), Query.cursorAfter('missing')]
+]
+
+LIMITS = [5000, None, 0, 3]
+
+@pytest.fixture(autouse=True)
+def seed_products(db):
+    for i in range(PRODUCTS):
+        db.seed('products', f"p{i:04d}", {
+            'business_id': 'b1' if i % 4 else 'b2',
+            'name': f"{'Rice' if i % 3 else 'Wheat'} pack {i}",
+            'price': i * 10
+        })
+
+def ids(documents):
+    return [document['$id'] for document in documents]
+
+def measured(db, call):
+    """(result, documents read) of a call, read through without the cache"""
+    db._cache.clear()
+    before = db.stats.total_reads()
+    result = call()
+    return result, db.stats.total_reads() - before
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+async def collect(iterator):
+    return [document async for document in iterator]
+
+def test_list_documents_parity(db, async_db):
+    """list_documents returns the same documents and reads from both layers"""
+    for queries in QUERY_SETS:
+        for limit in LIMITS:
+            expected = measured(db, lambda: db.list_documents('products', queries, limit=limit))
+            actual = measured(db, lambda: run(async_db.list_documents('products', queries, limit=limit)))
+            assert expected == actual, f"{queries} limit={limit}: {ids(expected[0])} != {ids(actual[0])}"
+
+def test_limit_none_is_unlimited(db, async_db):
+    """limit=None lists every matching document on both layers"""
+    queries = [Query.equal('business_id', 'b1')]
+    assert len(db.list_documents('products', queries, limit=None)) == PRODUCTS * 3 // 4
+    assert len(run(async_db.list_documents('products', queries, limit=None))) == PRODUCTS * 3 // 4
+
+def test_list_page_parity(db, async_db):
+    """list_page walks the same pages with the same tokens on both layers"""
+    for queries in ([Query.orderAsc('price')], [Query.orderAsc('price'), Query.search('name', 'rice')]):
+        token = async_token = None
+        while True:
+            page, token = db.list_page('products', queries, 6, token)
+            async_page, async_token = run(async_db.list_page('products', queries, 6, async_token))
+            assert (ids(page), token) == (ids(async_page), async_token)
+            if not token:
+                break
+    try:
+        run(async_db.list_page('products', [], 6, '!!'))
+        assert False, "a bad page token was accepted"
+    except ValueError:
+        pass
+
+def test_iter_documents_parity(db, async_db):
+    """iter_documents yields the same documents from both layers"""
+    for queries in QUERY_SETS:
+        if any(q['type'] in ('offset', 'cursorAfter', 'cursorBefore') for q in queries):
+            continue
+        expected = measured(db, lambda: list(db.iter_documents('products', queries, page_size=7)))
+        actual = measured(db, lambda: run(collect(async_db.iter_documents('products', queries, page_size=7))))
+        assert expected == actual, f"{queries}: {ids(expected[0])} != {ids(actual[0])}"
+
+def test_aggregation_parity(db, async_db):
+    """count and sum agree between the layers, with and without residual queries"""
+    for queries in QUERY_SETS:
+        if any(q['type'] in ('cursorAfter', 'cursorBefore') for q in queries):
+            continue
+        assert db.count('products', queries) == run(async_db.count('products', queries)), queries
+        assert db.sum('products', 'price', queries) == run(async_db.sum('products', 'price', queries)), queries
+
+def test_get_many_and_query_documents_parity(db, async_db):
+    """get_many and query_documents agree between the layers"""
+    document_ids = [f"p{i:04d}" for i in range(0, PRODUCTS, 3)] + ['missing', None]
+    assert db.get_many('products', document_ids) == run(async_db.get_many('products', document_ids))
+    for operator, value in (('==', 'b2'), ('!=', 'b2'), ('in', ['b1', 'b2'])):
+        expected = db.query_documents('products', 'business_id', operator, value, limit=5)
+        assert expected == run(async_db.query_documents('products', 'business_id', operator, value, limit=5)), operator
+
+def test_async_layer_is_not_a_firebase_db(db, async_db):
+    """AsyncFirebaseDB shares FirebaseDB's helpers without claiming to be one"""
+    assert not isinstance(async_db, FirebaseDB)
+    assert isinstance(async_db, BaseFirebaseDB) and isinstance(db, BaseFirebaseDB)
+
+    # The sync gather takes a list of callables, the async one the coroutines themselves
+    expected = db.gather([lambda: db.get_document('products', 'p0001'), lambda: db.count('products')])
+    actual = run(async_db.gather(async_db.get_document('products', 'p0001'), async_db.count('products')))
+    assert expected == actual
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Image Pipeline Test
+Checks that optimize_image never passes EXIF/GPS metadata through: not for photos
+it shrinks, not when the re-encoded file is no smaller, not for animated images and
+not for very large photos. Only undecodable files are returned untouched.
+Runs offline; needs Pillow.
+
+Usage:
+    python -m pytest test_image_pipeline.py
+"""
+
+import os
+import random
+import tempfile
+
+from PIL import Image
+import image_pipeline
+
+GPS_IFD = 0x8825
+
+def gps_exif():
+    """EXIF with a camera model and a GPS position, as phone cameras write it"""
+    exif = Image.Exif()
+    exif[0x0110] = 'Phone Camera'
+    gps = exif.get_ifd(GPS_IFD)
+    gps[1] = 'N'
+    gps[2] = (12.0, 58.0, 17.0)
+    gps[3] = 'E'
+    gps[4] = (77.0, 35.0, 40.0)
+    return exif.tobytes()
+
+def noise(width, height, seed=1):
+    """An RGB image that does not compress well"""
+    rnd = random.Random(seed)
+    return Image.frombytes('RGB', (width, height), bytes(rnd.getrandbits(8) for _ in range(width * height * 3)))
+
+def write(image, suffix, **options):
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    with os.fdopen(fd, 'wb') as out:
+        image.save(out, **options)
+    return path
+
+def assert_no_metadata(path):
+    with Image.open(path) as img:
+        assert 'exif' not in img.info, f"{path} still has EXIF"
+        assert not img.getexif().get_ifd(GPS_IFD), f"{path} still has GPS data"
+    with open(path, 'rb') as f:
+        assert b'Phone Camera' not in f.read()
+
+def optimize(path):
+    output_path, stats = image_pipeline.optimize_image(path)
+    assert output_path != path, "the original file was passed through"
+    assert_no_metadata(output_path)
+    return output_path, stats
+
+def test_large_photo_stripped():
+    """a large JPEG with GPS is shrunk and stripped"""
+    path = write(Image.new('RGB', (3200, 2400), (200, 120, 40)), '.jpg', format='JPEG', exif=gps_exif())
+    output_path, stats = optimize(path)
+    with Image.open(output_path) as img:
+        assert max(img.size) <= image_pipeline.IMAGE_MAX_DIMENSION
+    assert stats['bytes_saved'] > 0
+
+def test_not_smaller_still_stripped():
+    """a JPEG that does not get smaller is still re-saved without GPS"""
+    path = write(noise(64, 64), '.jpg', format='JPEG', quality=5, exif=gps_exif())
+    output_path, stats = optimize(path)
+    assert stats['optimized_bytes'] >= stats['original_bytes'], "test image got smaller; not the case under test"
+    assert stats['bytes_saved'] == 0
+
+def test_animated_stripped():
+    """an animated WebP keeps its frames and loses its EXIF"""
+    frames = [Image.new('RGB', (120, 80), color) for color in ('red', 'green', 'blue')]
+    path = write(frames[0], '.webp', format='WEBP', save_all=True, append_images=frames[1:],
+                 duration=100, loop=0, exif=gps_exif())
+    output_path, stats = optimize(path)
+    with Image.open(output_path) as img:
+        assert img.is_animated and img.n_frames == 3
+    assert stats['format'] == 'webp'
+
+def test_over_pixel_limit_stripped(monkeypatch):
+    """a JPEG over MAX_PIXELS is draft-decoded and stripped"""
+    monkeypatch.setattr(image_pipeline, 'MAX_PIXELS', 3_000_000)
+    # Decodes at 1/4 scale (1600x1600), under the limit
+    path = write(Image.new('L', (6400, 6400), 90), '.jpg', format='JPEG', exif=gps_exif())
+    optimize(path)
+
+def test_undecodable_passed_through():
+    """a file that is not an image is returned untouched"""
+    fd, path = tempfile.mkstemp(suffix='.jpg')
+    with os.fdopen(fd, 'wb') as out:
+        out.write(b'not an image')
+    output_path, stats = image_pipeline.optimize_image(path)
+    assert output_path == path and stats['bytes_saved'] == 0
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Import Time Budget Test
+Fails if `import app` exceeds the cold-start budget or eagerly loads libraries
+that should only be imported by the routes that use them.
+Runs offline: no server, Firebase project or Cloudinary account is needed.
+
+Usage:
+    IMPORT_TIME_BUDGET_MS=800 python -m pytest test_import_time.py
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Wall time allowed for `import app` in a fresh interpreter (best of RUNS)
+IMPORT_TIME_BUDGET_MS = float(os.environ.get('IMPORT_TIME_BUDGET_MS', 1200))
+RUNS = 3
+
+# Loaded on first use by the invoice, QR and upload routes
+LAZY_MODULES = ['reportlab', 'qrcode', 'cloudinary', 'PIL']
+
+PROBE = f"""
+import json, sys, time
+started = time.perf_counter()
+import app
+elapsed = time.perf_counter() - started
+print(json.dumps({{
+    'ms': elapsed * 1000,
+    'loaded': [name for name in {LAZY_MODULES!r} if name in sys.modules]
+}}))
+"""
+
+def measure_import():
+    """Import app in a fresh interpreter and return {'ms': ..., 'loaded': [...]}"""
+    result = subprocess.run(
+        [sys.executable, '-c', PROBE],
+        cwd=BACKEND_DIR,
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def test_import_time_budget():
+    """import app stays within IMPORT_TIME_BUDGET_MS"""
+    best = min(measure_import()['ms'] for _ in range(RUNS))
+    print(f"import app: {best:.0f}ms (budget {IMPORT_TIME_BUDGET_MS:.0f}ms)")
+    assert best <= IMPORT_TIME_BUDGET_MS, f"import app took {best:.0f}ms, budget is {IMPORT_TIME_BUDGET_MS:.0f}ms"
+
+def test_heavy_modules_are_lazy():
+    """import app does not load reportlab, qrcode, cloudinary or PIL"""
+    loaded = measure_import()['loaded']
+    assert not loaded, f"Loaded at import time: {', '.join(loaded)}"
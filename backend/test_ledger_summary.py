@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Ledger Summary Test
+Checks that a business from before summaries is backfilled before its first
+incremental write, so totals count both the old ledger and the new write and no
+partial credit document shadows a legacy one, and that a rebuild another worker is
+running is waited for rather than repeated. Runs offline against the in-memory
+Firestore fake.
+
+Usage:
+    python -m pytest test_ledger_summary.py
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+import leases
+import ledger_summary
+
+@pytest.fixture(autouse=True)
+def legacy_business(db):
+    """A business with ledger history, a legacy credit document and no summary"""
+    db.seed('customers', 'c1', {'business_id': 'b1', 'name': 'Asha'})
+    db.seed('transactions', 't1', {'business_id': 'b1', 'customer_id': 'c1', 'transaction_type': 'credit',
+                                   'amount': 100, 'created_at': '2024-01-01T00:00:00'})
+    db.seed('transactions', 't2', {'business_id': 'b1', 'customer_id': 'c1', 'transaction_type': 'payment',
+                                   'amount': 30, 'created_at': '2024-01-02T00:00:00'})
+    db.seed('customer_credits', 'legacy-c1', {'business_id': 'b1', 'customer_id': 'c1', 'current_balance': 70})
+
+def record(db, transaction_id, transaction_type, amount):
+    return ledger_summary.record_transaction(db, transaction_id, {
+        'business_id': 'b1',
+        'customer_id': 'c1',
+        'transaction_type': transaction_type,
+        'amount': amount,
+        'created_at': datetime.utcnow().isoformat()
+    })
+
+def test_first_write_backfills_the_summary(db):
+    """a write to a business without a summary counts its whole ledger"""
+    assert record(db, 't3', 'credit', 50)
+
+    summary = db.get_document('business_summaries', 'b1', use_cache=False)
+    assert summary['version'] == ledger_summary.SUMMARY_VERSION
+    assert summary['total_transactions'] == 3
+    assert summary['total_credit'] == 150 and summary['total_payment'] == 30
+    assert summary['outstanding_balance'] == 120
+
+    credit = ledger_summary.get_customer_credit(db, 'b1', 'c1')
+    assert credit['current_balance'] == 120 and credit['transaction_count'] == 3
+
+def test_customer_write_backfills_the_summary(db):
+    """adding a customer to a business without a summary counts the existing customers"""
+    assert ledger_summary.record_customer(db, 'c2', {'business_id': 'b1', 'name': 'Ravi'})
+    assert db.get_document('business_summaries', 'b1', use_cache=False)['total_customers'] == 2
+
+def test_outdated_summary_is_rebuilt_once(db):
+    """a summary of an older version is replaced, and a current one is not rebuilt"""
+    db.seed('business_summaries', 'b1', {'version': ledger_summary.SUMMARY_VERSION - 1, 'total_transactions': 99})
+
+    assert ledger_summary.get_summary(db, 'b1')['total_transactions'] == 2
+    before = db.stats.total_reads()
+    ledger_summary.get_summary(db, 'b1')
+    assert db.stats.total_reads() - before == 1, "a current summary was rebuilt again"
+
+def test_rebuild_held_by_another_worker_is_waited_for(db, monkeypatch):
+    """while another worker holds the rebuild lease, readers neither rebuild nor write"""
+    monkeypatch.setattr(ledger_summary, 'REBUILD_WAIT_SECONDS', 0.05)
+    monkeypatch.setattr(ledger_summary, 'REBUILD_POLL_SECONDS', 0.01)
+    assert leases.acquire(db, ('scheduler_locks', 'summary_b1'), 'other-worker', 60)
+
+    with pytest.raises(ledger_summary.SummaryUnavailable):
+        ledger_summary.get_summary(db, 'b1')
+    with pytest.raises(ledger_summary.SummaryUnavailable):
+        record(db, 't3', 'credit', 50)
+    assert db.get_document('business_summaries', 'b1', use_cache=False) is None
+    assert db.get_document('transactions', 't3', use_cache=False) is None
+    assert db.get_document('customer_credits', 'b1_c1', use_cache=False) is None
+
+    # An expired lease is taken over
+    db.seed('scheduler_locks', 'summary_b1', {
+        'owner': 'other-worker',
+        'expires_at': (datetime.utcnow() - timedelta(seconds=1)).isoformat()
+    })
+    assert ledger_summary.get_summary(db, 'b1')['outstanding_balance'] == 70
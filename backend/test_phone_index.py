@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Phone Index Test
+Checks that a second registration for a phone number is rejected, whether the
+number is indexed or belongs to an account from before the index, and that a
+lookup of such a legacy account indexes it. Runs offline against the in-memory
+Firestore fake.
+
+Usage:
+    python -m pytest test_phone_index.py
+"""
+
+import pytest
+
+import phone_index
+
+PHONE = '9876543210'
+
+def register(db, user_id, business_id):
+    return phone_index.register(
+        db, PHONE,
+        user_id, {'phone_number': PHONE, 'user_type': 'business', 'name': user_id},
+        business_id, {'user_id': user_id, 'name': f"{user_id}'s shop"}
+    )
+
+def seed_legacy_account(db):
+    """A business account registered before phone_index existed"""
+    db.seed('users', 'legacy', {'phone_number': PHONE, 'user_type': 'business'})
+    db.seed('businesses', 'legacy-shop', {'user_id': 'legacy', 'name': 'Old shop'})
+
+def test_register_indexes_the_account(db):
+    """registration writes the index entry, user and business together"""
+    assert register(db, 'u1', 'b1')
+    entry = phone_index.lookup(db, PHONE)
+    assert (entry['user_id'], entry['business_id'], entry['user_type']) == ('u1', 'b1', 'business')
+    assert db.get_document('users', 'u1', use_cache=False)['phone_number'] == PHONE
+    assert db.get_document('businesses', 'b1', use_cache=False)['user_id'] == 'u1'
+
+def test_duplicate_registration_rejected(db):
+    """a second registration for an indexed number raises and writes nothing"""
+    assert register(db, 'u1', 'b1')
+    with pytest.raises(phone_index.PhoneAlreadyRegistered):
+        register(db, 'u2', 'b2')
+
+    assert phone_index.lookup(db, PHONE)['user_id'] == 'u1'
+    assert db.get_document('users', 'u2', use_cache=False) is None
+    assert db.get_document('businesses', 'b2', use_cache=False) is None
+
+def test_registration_over_legacy_account_rejected(db):
+    """a number held by an unindexed legacy account cannot be registered again"""
+    seed_legacy_account(db)
+    with pytest.raises(phone_index.PhoneAlreadyRegistered):
+        register(db, 'u2', 'b2')
+    assert db.get_document('users', 'u2', use_cache=False) is None
+
+def test_lookup_backfills_legacy_account(db):
+    """looking up a legacy account finds it by query once and indexes it"""
+    seed_legacy_account(db)
+    assert db.get_document('phone_index', PHONE, use_cache=False) is None
+
+    entry = phone_index.lookup(db, PHONE)
+    assert (entry['user_id'], entry['business_id']) == ('legacy', 'legacy-shop')
+    stored = db.get_document('phone_index', PHONE, use_cache=False)
+    assert (stored['user_id'], stored['business_id'], stored['user_type']) == ('legacy', 'legacy-shop', 'business')
+
+    # Later lookups are a single point read
+    db._cache.clear()
+    before = db.stats.total_reads()
+    assert phone_index.lookup(db, PHONE)['business_id'] == 'legacy-shop'
+    assert db.stats.total_reads() - before == 1
+
+def test_unknown_number_not_indexed(db):
+    """a lookup of a number nobody registered returns None and writes nothing"""
+    assert phone_index.lookup(db, PHONE) is None
+    assert db.get_document('phone_index', PHONE, use_cache=False) is None
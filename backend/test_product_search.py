@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Product Search Test
+Checks that a search reads every candidate up to SEARCH_MAX_CANDIDATES and that
+/api/products reports when a common word made it stop there.
+Runs offline against the in-memory Firestore fake.
+
+Usage:
+    python -m pytest test_product_search.py
+"""
+
+import pytest
+
+import product_search
+
+MAX_CANDIDATES = 30
+
+@pytest.fixture(autouse=True)
+def small_candidate_cap(monkeypatch):
+    monkeypatch.setattr(product_search, 'SEARCH_MAX_CANDIDATES', MAX_CANDIDATES)
+
+def seed_products(db, products):
+    for i in range(products):
+        product = {
+            'business_id': 'b1', 'name': f"Rice {i:03d}", 'category': 'Grocery', 'subcategory': 'Grains',
+            'stock_quantity': 5, 'unit': 'kg', 'price': 60, 'is_public': True
+        }
+        db.seed('products', f"p{i:03d}", {**product, **product_search.index_fields(product)})
+
+def get_products(api, search):
+    return api.get('/api/products', query_string={'search': search}).json
+
+def test_all_candidates_read(db, api):
+    """a search with as many candidates as the cap returns them all, untruncated"""
+    seed_products(db, MAX_CANDIDATES)
+    result = get_products(api, 'rice')
+    assert result['count'] == MAX_CANDIDATES and result['truncated'] is False, result
+
+def test_truncation_reported(db, api):
+    """a search with more candidates than the cap says it was truncated"""
+    seed_products(db, MAX_CANDIDATES + 5)
+    products, truncated = product_search.search(db, 'b1', 'rice')
+    assert truncated and len(products) == MAX_CANDIDATES
+
+    result = get_products(api, 'rice')
+    assert result['count'] == MAX_CANDIDATES and result['truncated'] is True, result
+
+    # A rarer word narrows the candidates below the cap
+    result = get_products(api, 'rice 031')
+    assert [product['name'] for product in result['products']] == ['Rice 031'] and result['truncated'] is False
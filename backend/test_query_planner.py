@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Query Planner Test
+Checks that queries with a residual filter (endsWith, search) return what a plain
+in-memory filter of the whole collection returns, combined with an offset, a limit,
+a select that leaves out the filtered field and a native filter, through
+list_documents, iter_documents and count. Runs offline against the in-memory
+Firestore fake.
+
+Usage:
+    python -m pytest test_query_planner.py
+"""
+
+import itertools
+import logging
+
+import pytest
+
+import query_planner
+from firebase_query import Query
+
+# Every residual query is logged on purpose
+logging.getLogger('firebase.query_fallbacks').setLevel(logging.ERROR)
+
+NAMES = ['Basmati Rice', 'Brown rice flour', 'Rice bran oil', 'Wheat flour', 'Ricotta',
+         'Puffed rice', 'Sona Masoori RICE', 'Corn flour', 'Rye bread', 'Jeera rice mix']
+
+FILTERS = [
+    [Query.endsWith('name', 'flour')],
+    [Query.endsWith('name', 'rice')],
+    [Query.search('name', 'rice')],
+    [Query.search('name', 'ri fl')],
+    [Query.search('name', 'rice'), Query.endsWith('name', 'oil')],
+    [Query.equal('business_id', 'b1'), Query.search('name', 'rice')]
+]
+OFFSETS = [None, 0, 2, 50]
+LIMITS = [None, 0, 1, 3]
+SELECTS = [None, ['price'], ['name', 'price']]
+
+@pytest.fixture(autouse=True)
+def seed_products(db):
+    for i in range(40):
+        db.seed('products', f"p{i:03d}", {
+            'business_id': 'b1' if i % 3 else 'b2',
+            'name': NAMES[i % len(NAMES)],
+            'price': i * 5
+        })
+
+def expected(documents, queries):
+    """The queries applied to every document in order, without the planner"""
+    results = []
+    for document in documents:
+        keep = True
+        for q in queries:
+            value = document.get(q.get('attribute'))
+            if q['type'] == 'equal':
+                keep = keep and value == q['value']
+            elif q['type'] == 'endsWith':
+                keep = keep and value.endswith(q['value'])
+            elif q['type'] == 'search':
+                field_words = value.lower().split()
+                keep = keep and all(any(word.startswith(token) for word in field_words) for token in q['value'].lower().split())
+        if keep:
+            results.append(document)
+
+    for q in queries:
+        if q['type'] == 'offset':
+            results = results[q['value']:]
+    for q in queries:
+        if q['type'] == 'limit':
+            results = results[:q['value']]
+    for q in queries:
+        if q['type'] == 'select':
+            results = [{'$id': d['$id'], **{f: d[f] for f in q['attributes'] if f in d}} for d in results]
+    return results
+
+def combinations():
+    for filters, offset, limit, select in itertools.product(FILTERS, OFFSETS, LIMITS, SELECTS):
+        queries = [Query.orderAsc('price')] + filters
+        if offset is not None:
+            queries.append(Query.offset(offset))
+        if limit is not None:
+            queries.append(Query.limit(limit))
+        if select is not None:
+            queries.append(Query.select(select))
+        yield queries
+
+def all_products(db):
+    return db.list_documents('products', [Query.orderAsc('price')], limit=None)
+
+def test_plan_apply_matches_plain_filter(db):
+    """QueryPlan.apply over what Firestore returns gives what the plain filter does"""
+    products = all_products(db)
+    for queries in combinations():
+        # apply() sees full documents, so compare before any select
+        unselected = [q for q in queries if q['type'] != 'select']
+        plan = query_planner.plan(unselected)
+        assert {q['type'] for q in plan.residual} <= set(query_planner.RESIDUAL_QUERY_TYPES)
+        fetched = expected(products, [q for q in plan.native if q['type'] == 'equal'])
+        assert list(plan.apply(fetched)) == expected(products, unselected), unselected
+
+def test_list_documents_matches_plain_filter(db):
+    """list_documents with residual queries returns what the plain filter does"""
+    products = all_products(db)
+    for queries in combinations():
+        assert db.list_documents('products', queries) == expected(products, queries), queries
+
+def test_iter_documents_and_count_match_plain_filter(db):
+    """iter_documents and count with residual queries agree with the plain filter"""
+    products = all_products(db)
+    for queries in combinations():
+        if any(q['type'] == 'offset' for q in queries):
+            continue
+        assert list(db.iter_documents('products', queries, page_size=4)) == expected(products, queries), queries
+        unselected = [q for q in queries if q['type'] != 'select']
+        assert db.count('products', unselected) == len(expected(products, unselected)), unselected
+
+def test_select_drops_fields_added_for_the_filter(db):
+    """a select without the filtered field still filters on it but does not return it"""
+    plan = query_planner.plan([Query.endsWith('name', 'flour'), Query.select(['price'])])
+    assert plan.added_fields == ['name']
+    assert [q['attributes'] for q in plan.native if q['type'] == 'select'] == [['price', 'name']]
+
+    documents = db.list_documents('products', [Query.endsWith('name', 'flour'), Query.select(['price'])])
+    assert documents and all(set(document) == {'$id', 'price'} for document in documents)
+
+def test_offset_is_native_without_residual_queries():
+    """an offset is left to Firestore unless a residual filter has to run before it"""
+    assert query_planner.plan([Query.offset(5)]).native == [Query.offset(5)]
+    plan = query_planner.plan([Query.search('name', 'rice'), Query.offset(5)])
+    assert plan.offset == 5 and not any(q['type'] == 'offset' for q in plan.native)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Recurring Engine Test
+Checks the catch-up policy (re-activated and never-executed schedules do not bill
+the periods they missed), that last_transaction_at never moves backwards and that a
+period already recorded is not billed again when its batch is retried, and that one
+schedule that cannot be computed does not stop the others.
+Runs offline against the in-memory Firestore fake.
+
+Usage:
+    python -m pytest test_recurring_engine.py
+"""
+
+from datetime import datetime, timedelta
+
+import recurring_engine
+from ledger_summary import credit_document_id
+
+NOW = datetime(2026, 10, 17, 12)
+AMOUNT = 10.0
+
+def seed_schedule(db, next_execution, **schedule):
+    db.seed('recurring_transactions', 'r1', {
+        'business_id': 'b1',
+        'customer_id': 'c1',
+        'amount': AMOUNT,
+        'frequency': 'daily',
+        'is_active': True,
+        'next_execution_date': next_execution.isoformat(),
+        'created_at': next_execution.isoformat(),
+        **schedule
+    })
+
+def credit(db):
+    return db.get_document('customer_credits', credit_document_id('b1', 'c1'), use_cache=False) or {}
+
+def recurring_transactions(db):
+    return [txn for txn in db.db.scan('transactions') if txn[1].get('recurring_transaction_id') == 'r1']
+
+def test_reactivated_schedule_skips_paused_periods(db, api):
+    """re-activating a paused schedule resumes at its next period instead of billing the missed ones"""
+    paused_at = (datetime.utcnow() - timedelta(days=30)).replace(hour=9, minute=0, second=0, microsecond=0)
+    seed_schedule(db, paused_at, is_active=False)
+    response = api.put('/api/recurring-transaction/r1/toggle')
+    assert response.status_code == 200 and response.json['is_active'], response.json
+
+    schedule = db.get_document('recurring_transactions', 'r1', use_cache=False)
+    resumed = datetime.fromisoformat(schedule['next_execution_date'])
+    assert datetime.utcnow() < resumed <= datetime.utcnow() + timedelta(days=1), resumed
+    assert resumed.hour == 9, "the schedule lost its time of day"
+
+    stats = recurring_engine.run_due(db, now=datetime.utcnow())
+    assert stats['transactions'] == 0 and not recurring_transactions(db), stats
+
+def test_never_executed_schedule_catch_up_is_bounded(db):
+    """a schedule due for months bills only the periods within MAX_CATCH_UP_DAYS"""
+    seed_schedule(db, NOW - timedelta(days=180))
+    stats = recurring_engine.run_due(db, now=NOW)
+
+    billed = recurring_transactions(db)
+    assert len(billed) == recurring_engine.MAX_CATCH_UP_DAYS + 1, len(billed)
+    horizon = (NOW - timedelta(days=recurring_engine.MAX_CATCH_UP_DAYS)).isoformat()
+    assert all(txn['created_at'] >= horizon for _, txn in billed)
+    assert stats['skipped_periods'] == 180 - recurring_engine.MAX_CATCH_UP_DAYS
+    assert credit(db)['current_balance'] == AMOUNT * len(billed)
+    schedule = db.get_document('recurring_transactions', 'r1', use_cache=False)
+    assert schedule['next_execution_date'] > NOW.isoformat()
+
+def test_last_transaction_at_never_moves_back(db):
+    """catching up an older period keeps a newer last_transaction_at"""
+    seed_schedule(db, NOW - timedelta(days=2))
+    later = (NOW - timedelta(hours=1)).isoformat()
+    db.seed('customer_credits', credit_document_id('b1', 'c1'), {
+        'business_id': 'b1', 'customer_id': 'c1', 'current_balance': 5.0, 'last_transaction_at': later
+    })
+    recurring_engine.run_due(db, now=NOW - timedelta(hours=2))
+    assert credit(db)['last_transaction_at'] == later
+
+def test_retry_does_not_bill_recorded_period_twice(db):
+    """a period already recorded by an earlier attempt is not billed again"""
+    seed_schedule(db, NOW - timedelta(days=2))
+    # An earlier runner committed the first period, then lost its lease before
+    # this runner read the schedule
+    first = recurring_engine.period_transaction_id('r1', NOW - timedelta(days=2))
+    db.seed('transactions', first, {'business_id': 'b1', 'customer_id': 'c1', 'amount': AMOUNT,
+                                    'transaction_type': 'credit', 'recurring_transaction_id': 'r1'})
+
+    # The business has no summary yet, so the backfill counts the recorded period once
+    stats = recurring_engine.run_due(db, now=NOW)
+    assert stats['failed'] == 0 and stats['transactions'] == 2, stats
+    assert len(recurring_transactions(db)) == 3
+    assert credit(db)['current_balance'] == AMOUNT * 3
+    summary = db.get_document('business_summaries', 'b1', use_cache=False)
+    assert summary['total_transactions'] == 3
+
+    # Running again finds nothing due
+    assert recurring_engine.run_due(db, now=NOW)['transactions'] == 0
+    assert credit(db)['current_balance'] == AMOUNT * 3
+
+def test_bad_schedule_does_not_stop_the_run(db):
+    """a schedule that fails to compute is skipped and the others still run"""
+    seed_schedule(db, NOW - timedelta(days=1))
+    db.seed('recurring_transactions', 'r0', {
+        'business_id': 'b1',
+        'customer_id': 'c1',
+        'amount': AMOUNT,
+        'frequency': 'daily',
+        'is_active': True,
+        # Timezone-aware, so comparing it with the naive run time raises TypeError
+        'next_execution_date': (NOW - timedelta(days=2)).isoformat() + '+00:00'
+    })
+
+    stats = recurring_engine.run_due(db, now=NOW)
+    assert stats['skipped'] == 1 and stats['schedules'] == 1, stats
+    assert len(recurring_transactions(db)) == 2
+    assert credit(db)['current_balance'] == AMOUNT * 2
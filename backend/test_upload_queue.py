@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Upload Queue Test
+Checks that uploads lost with a restarted worker are marked failed by the sweeper,
+while uploads still within UPLOAD_STALE_SECONDS are left pending.
+Runs offline against the in-memory Firestore fake.
+
+Usage:
+    python -m pytest test_upload_queue.py
+"""
+
+from datetime import datetime, timedelta
+
+import upload_queue
+
+TARGETS = [('transactions', 'receipt_status'), ('products', 'image_status')]
+
+def test_stale_uploads_marked_failed(db):
+    """uploads pending past UPLOAD_STALE_SECONDS are marked failed, newer ones are kept"""
+    now = datetime.utcnow()
+    old = (now - timedelta(seconds=upload_queue.UPLOAD_STALE_SECONDS + 60)).isoformat()
+    recent = (now - timedelta(seconds=30)).isoformat()
+
+    db.create_document('transactions', 'lost', {'receipt_status': 'pending', 'created_at': old})
+    db.create_document('transactions', 'queued', {'receipt_status': 'pending', 'created_at': recent})
+    db.create_document('transactions', 'done', {'receipt_status': 'uploaded', 'created_at': old})
+    db.create_document('products', 'lost', {'image_status': 'pending', 'created_at': old})
+
+    assert upload_queue.fail_stale(db, TARGETS, now) == 2
+    statuses = {
+        (name, document_id): db.get_document(name, document_id, use_cache=False)[field]
+        for name, field in TARGETS
+        for document_id in ('lost', 'queued', 'done')
+        if db.get_document(name, document_id, use_cache=False)
+    }
+    assert statuses == {
+        ('transactions', 'lost'): 'failed',
+        ('transactions', 'queued'): 'pending',
+        ('transactions', 'done'): 'uploaded',
+        ('products', 'lost'): 'failed'
+    }, statuses
+
+    # A second sweep finds nothing left to recover
+    assert upload_queue.fail_stale(db, TARGETS, now) == 0
@@ -0,0 +1,176 @@
+"""
+Upload Queue - Background image uploads with retry and backoff
+Request handlers spool the uploaded file to disk, enqueue a job and answer straight
+away; a small thread pool performs the upload and reports the result through
+callbacks, which patch the uploaded URL into the owning document.
+
+Queued jobs live only in this process, so a restart or redeploy loses them; the
+sweeper (start_sweeper) marks documents still 'pending' after UPLOAD_STALE_SECONDS
+as 'failed' so clients can offer to upload again.
+"""
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from firebase_query import Query
+
+logger = logging.getLogger(__name__)
+
+# Upload threads per process; 0 uploads inline in the request worker
+UPLOAD_WORKERS = int(os.environ.get('UPLOAD_WORKERS', 4))
+
+# Attempts per upload before it is reported as failed
+UPLOAD_MAX_ATTEMPTS = int(os.environ.get('UPLOAD_MAX_ATTEMPTS', 4))
+
+# First retry delay in seconds; doubles on every further attempt
+UPLOAD_RETRY_BACKOFF = float(os.environ.get('UPLOAD_RETRY_BACKOFF', 1.0))
+UPLOAD_RETRY_MAX_DELAY = 30.0
+
+# Uploads still pending after this many seconds were lost with the process that queued them
+UPLOAD_STALE_SECONDS = int(os.environ.get('UPLOAD_STALE_SECONDS', 900))
+
+# Seconds between sweeps for lost uploads; off unless set, so importing app (tests,
+# scripts, a gunicorn --preload master) starts no thread. Set it on the web service.
+UPLOAD_SWEEP_INTERVAL = int(os.environ.get('UPLOAD_SWEEP_INTERVAL', 0))
+
+# Cloudinary errors that will not succeed on retry (matched by name so Cloudinary stays lazily imported)
+PERMANENT_ERRORS = {'BadRequest', 'AuthorizationRequired', 'NotAllowed', 'NotFound'}
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = 0
+_pending_lock = threading.Lock()
+
+def get_executor():
+    """Get the upload thread pool, starting it on first use (after any gunicorn fork)"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix='upload')
+        return _executor
+
+def spool(file):
+    """Copy an uploaded file to a temporary path that outlives the request"""
+    suffix = os.path.splitext(getattr(file, 'filename', '') or '')[1]
+    fd, path = tempfile.mkstemp(prefix='upload_', suffix=suffix)
+    with os.fdopen(fd, 'wb') as out:
+        if hasattr(file, 'save'):
+            file.save(out)
+        else:
+            out.write(file.read())
+    return path
+
+def retry_delay(attempt):
+    """Exponential backoff with jitter before the given retry (1-based)"""
+    delay = min(UPLOAD_RETRY_BACKOFF * 2 ** (attempt - 1), UPLOAD_RETRY_MAX_DELAY)
+    return delay * random.uniform(0.5, 1.0)
+
+def pending_uploads():
+    """Uploads queued or in progress in this process"""
+    return _pending
+
+def _run(upload, path, kind, options, on_success, on_failure, on_retry, prepare):
+    global _pending
+    upload_path = path
+    try:
+        if prepare:
+            try:
+                upload_path = prepare(path)
+            except Exception as e:
+                logger.warning(f"Preparing {kind} upload failed, uploading original: {e}")
+
+        for attempt in range(1, UPLOAD_MAX_ATTEMPTS + 1):
+            try:
+                result = upload(upload_path, kind, **options)
+                break
+            except Exception as e:
+                if attempt == UPLOAD_MAX_ATTEMPTS or type(e).__name__ in PERMANENT_ERRORS:
+                    logger.error(f"Upload of {kind} failed after {attempt} attempt(s): {e}")
+                    if on_failure:
+                        on_failure(e)
+                    return
+                delay = retry_delay(attempt)
+                logger.warning(f"Upload of {kind} failed (attempt {attempt}), retrying in {delay:.1f}s: {e}")
+                if on_retry:
+                    on_retry(kind)
+                time.sleep(delay)
+
+        try:
+            on_success(result)
+        except Exception as e:
+            logger.error(f"Upload of {kind} succeeded but saving the result failed: {e}")
+    finally:
+        with _pending_lock:
+            _pending -= 1
+        for spooled_path in {path, upload_path}:
+            try:
+                os.remove(spooled_path)
+            except OSError:
+                pass
+
+def enqueue(upload, file, kind, options, on_success, on_failure=None, on_retry=None, prepare=None):
+    """
+    Spool a file and upload it in the background
+    prepare(path), if given, returns the path to upload instead, e.g. a shrunk copy;
+    upload(path, kind, **options) performs one attempt and returns its result;
+    on_success(result) / on_failure(error) run on the upload thread once it is done
+    """
+    global _pending
+    path = spool(file)
+    with _pending_lock:
+        _pending += 1
+
+    if UPLOAD_WORKERS <= 0:
+        _run(upload, path, kind, options, on_success, on_failure, on_retry, prepare)
+        return
+    get_executor().submit(_run, upload, path, kind, options, on_success, on_failure, on_retry, prepare)
+
+def shutdown(wait=True):
+    """Stop the upload threads, by default after finishing queued uploads"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=wait)
+            _executor = None
+
+def fail_stale(firebase_db, targets, now=None):
+    """
+    Mark uploads left 'pending' for longer than UPLOAD_STALE_SECONDS as 'failed'
+    targets are (collection_name, status_field) pairs; a document's updated_at is
+    when its upload was queued. Returns the number of documents marked.
+    """
+    cutoff = ((now or datetime.utcnow()) - timedelta(seconds=UPLOAD_STALE_SECONDS)).isoformat()
+    operations = []
+    for collection_name, status_field in targets:
+        # Pending uploads are few, so the age check is done here rather than in an index
+        for document in firebase_db.iter_documents(collection_name, [
+            Query.equal(status_field, 'pending'),
+            Query.select(['updated_at'])
+        ]):
+            if (document.get('updated_at') or '') < cutoff:
+                operations.append(('update', collection_name, document['$id'], {status_field: 'failed'}))
+
+    if operations:
+        if not firebase_db.batch_write(operations):
+            logger.error(f"Failed to mark {len(operations)} lost upload(s) as failed")
+            return 0
+        logger.warning(f"Marked {len(operations)} upload(s) pending for over {UPLOAD_STALE_SECONDS}s as failed")
+    return len(operations)
+
+def start_sweeper(sweep, interval=UPLOAD_SWEEP_INTERVAL):
+    """Call sweep() every `interval` seconds on a daemon thread"""
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                sweep()
+            except Exception as e:
+                logger.error(f"Upload sweeper error: {e}")
+
+    thread = threading.Thread(target=loop, name='upload-sweeper', daemon=True)
+    thread.start()
+    return thread